@@ -1,5 +1,6 @@
 import logging.config
 
+from hylfm.cache import app as app_cache
 from hylfm.datasets.named import DatasetChoice, DatasetPart, get_dataset
 from hylfm.get_model import app as app_get_model
 from hylfm.train import app as app_train
@@ -17,6 +18,7 @@ logger = logging.getLogger(__name__)
 
 app = typer.Typer()
 
+app.add_typer(app_cache, name="cache")
 app.add_typer(app_get_model, name="model")
 app.add_typer(app_train, name="train")
 app.add_typer(app_test, name="test")
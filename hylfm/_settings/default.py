@@ -17,16 +17,47 @@ class Settings:
     log_dir: Path = Path(__file__).parent / "../../logs"
     download_dir: Path = Path(__file__).parent / "../../download"
     cache_dir: Path = Path(__file__).parent / "../../cache"
+    cache_budget_bytes: Optional[int] = None  # for `hylfm cache gc`
 
     num_workers_data_loader: Dict[str, int] = field(
         default_factory=lambda: {dp: 0 if debug_mode else 4 for dp in ("train", "validate", "test", "predict")}
     )
     pin_memory: bool = False
+    persistent_workers: bool = False  # keep DataLoader workers alive across epochs (always for validation)
+    prefetch_factor: int = 2  # batches loaded in advance by each DataLoader worker
+    pin_worker_cpus: bool = False  # pin each DataLoader worker to its own subset of the available cpus (linux)
+    input_bound_threshold: float = 0.1  # fraction of time spent waiting for data to report a run as input-bound
+    collate_into_buffers: bool = False  # collate into reusable pinned/shared memory torch buffers
+    batch_buffer_ring_size: int = 6  # per shape and dtype, has to exceed the batches in flight per process
+    augment_on_device: bool = False  # random augmentations after the host-to-device transfer (torch; cuda if available)
+    fuse_transforms: bool = False  # fuse runs of elementwise and view-only transforms (see hylfm.transforms.fusion)
+
+    distributed_backend: Optional[str] = None  # default: nccl if cuda is available, else gloo
+    sampler_block_size: int = 0  # > 0: shuffle training samples in blocks of consecutive indices (BlockShuffleSampler)
+    sampler_shuffle_buffer: int = 0  # mixes indices of consecutively drawn blocks
+    write_checkpoints_async: bool = True  # serialize checkpoints in a background thread (see CheckpointWriter)
+    keep_best_checkpoints: int = 1  # rotating; checkpoints kept for other reasons are never deleted
+    validation_prefetch_lead: int = 8  # iterations before a validation to start loading validation batches
+    validate_async: bool = False  # validate weight snapshots in a background thread while training continues
 
     max_workers_per_dataset: int = 0 if debug_mode else 4
     reserved_workers_per_dataset_for_getitem: int = 0
+    cache_prefetch_lookahead: int = 64  # upcoming sample indices to fill N5 caches for in the background
+    max_cache_fills_in_flight: int = 16  # per cached dataset; further prefetches are dropped (filled on demand)
     max_workers_for_hist: int = 0 if debug_mode else 0
     max_workers_for_stat: int = 0 if debug_mode else 0
+    max_workers_for_filters: int = 0 if debug_mode else 4  # processes
+    filters_on_summary: bool = True  # evaluate filters on per sample summary tables
+    approximate_summary_filters: bool = False  # allow interpolating percentiles not in the summary
+    float_stat_sketch: str = "ddsketch"  # ddsketch|linear|log (adaptive histogram bins)
+    float_stat_bins: int = 2 ** 16
+    stat_range_samples: int = 64
+    max_open_h5_files: int = 64  # per process
+    max_workers_for_h5_index: int = 0 if debug_mode else 8
+    max_workers_for_affine: int = 0 if debug_mode else 8  # threads resampling chunks of AffineTransformation on cpu
+    affine_chunk_size: int = 8  # output planes per chunk
+    affine_grid_cache_bytes: int = 2 * 2 ** 30  # process-wide budget for cached affine grids (all devices)
+    affine_slices_only: bool = True  # resample only the requested z planes (instead of slicing the full output)
     # max_workers_file_logger: int = 1 if debug_mode else 4
     # max_workers_for_trace: int = 1 if debug_mode else 4
     multiprocessing_start_method: str = "spawn"
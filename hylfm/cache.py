@@ -0,0 +1,225 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from hylfm import settings  # import hylfm before numpy!
+from hylfm.datasets import N5CachedDatasetFromInfo
+from hylfm.datasets.cache_manager import CacheManager
+from hylfm.datasets.n5_utils import CACHE_COMPRESSIONS, migrate_n5_cache
+from hylfm.datasets.named import COMBINED_DATASETS, get_dataset_sections, get_dataset_subsection
+from hylfm.hylfm_types import DatasetChoice, DatasetPart
+from hylfm.transform_pipelines import get_transforms_pipeline
+
+import torch.utils.data
+import typer
+import yaml
+
+logger = logging.getLogger(__name__)
+
+app = typer.Typer()
+
+
+def defer_subsection(**kwargs) -> partial:
+    return partial(get_dataset_subsection, **kwargs)
+
+
+def iter_cached_datasets(dataset: torch.utils.data.Dataset) -> Iterator[N5CachedDatasetFromInfo]:
+    if isinstance(dataset, N5CachedDatasetFromInfo):
+        yield dataset
+    elif isinstance(dataset, torch.utils.data.ConcatDataset):
+        for ds in dataset.datasets:
+            yield from iter_cached_datasets(ds)
+    elif isinstance(getattr(dataset, "datasets", None), dict):  # ZipDataset
+        for ds in dataset.datasets.values():
+            yield from iter_cached_datasets(ds)
+    elif isinstance(getattr(dataset, "dataset", None), torch.utils.data.Dataset):  # subset
+        yield from iter_cached_datasets(dataset.dataset)
+
+
+def warm_dataset(dataset: torch.utils.data.Dataset) -> List[Dict[str, Any]]:
+    """fill all N5 caches of an already created dataset (creating it computed stats and filter masks)"""
+    reports = []
+    for ds in iter_cached_datasets(dataset):
+        start = perf_counter()
+        fill_stats = ds.fill()
+        seconds = fill_stats.get("stop", perf_counter()) - fill_stats.get("start", start)
+        reports.append(
+            {
+                "tensor": f"{ds.dataset.info.tag}.{ds.dataset.tensor_name}",
+                "samples": len(ds.dataset),
+                "filled": fill_stats["samples"],
+                "bytes": fill_stats["bytes"],
+                "seconds": seconds,
+            }
+        )
+
+    return reports
+
+
+def warm_subsection(create_subsection: partial) -> List[Dict[str, Any]]:
+    return warm_dataset(create_subsection())
+
+
+def get_warm_jobs(
+    dataset_names: List[DatasetChoice], parts: List[DatasetPart], load_lfd_and_care: bool, **pipeline_kwargs
+) -> Tuple[List[Tuple[str, partial]], List[Tuple[str, torch.utils.data.Dataset]]]:
+    """collect deferred subsections (to be created in parallel) and subsections that were created eagerly"""
+    deferred = []
+    created = []
+    for name in dataset_names:
+        for part in parts:
+            for subname in COMBINED_DATASETS.get(name, [name]):
+                transforms_pipeline = get_transforms_pipeline(
+                    dataset_name=name, dataset_part=part, load_lfd_and_care=load_lfd_and_care, **pipeline_kwargs
+                )
+                sections = get_dataset_sections(
+                    subname, part, transforms_pipeline, load_lfd_and_care, get_subsection=defer_subsection
+                )
+                for s, section in enumerate(sections):
+                    for ss, subsection in enumerate(section):
+                        job_name = f"{subname.value}/{part.value}/{s}/{ss}"
+                        if isinstance(subsection, partial):
+                            deferred.append((job_name, subsection))
+                        else:
+                            created.append((job_name, subsection))
+
+    return deferred, created
+
+
+def log_reports(job_name: str, reports: List[Dict[str, Any]]):
+    for report in reports:
+        seconds = report["seconds"]
+        typer.echo(
+            f"{job_name} {report['tensor']}: filled {report['filled']}/{report['samples']} samples "
+            f"({report['bytes'] / 1e6:.1f} MB) in {seconds:.1f}s"
+            + (
+                f" -> {report['bytes'] / 1e6 / seconds:.1f} MB/s, {report['filled'] / seconds:.1f} samples/s"
+                if report["filled"] and seconds > 0
+                else ""
+            )
+        )
+
+
+@app.command()
+def warm(
+    dataset_names: List[DatasetChoice],
+    parts: List[DatasetPart] = typer.Option(
+        [DatasetPart.train.value, DatasetPart.validate.value, DatasetPart.test.value], "--part"
+    ),
+    nnum: int = typer.Option(19, "--nnum"),
+    z_out: int = typer.Option(49, "--z_out"),
+    scale: int = typer.Option(4, "--scale"),
+    shrink: int = typer.Option(8, "--shrink"),
+    interpolation_order: int = typer.Option(2, "--interpolation_order"),
+    load_lfd_and_care: bool = typer.Option(False, "--load_lfd_and_care"),
+    max_workers: int = typer.Option(4, "--max_workers"),
+):
+    """fill N5 caches, stats and filter masks of all (sub)sections of the given datasets"""
+    deferred, created = get_warm_jobs(
+        dataset_names,
+        parts,
+        load_lfd_and_care,
+        nnum=nnum,
+        z_out=z_out,
+        scale=scale,
+        shrink=shrink,
+        interpolation_order=interpolation_order,
+    )
+    logger.info("warming %d deferred and %d created subsections", len(deferred), len(created))
+    start = perf_counter()
+    total_bytes = 0
+    for job_name, subsection in created:
+        reports = warm_dataset(subsection)
+        total_bytes += sum(r["bytes"] for r in reports)
+        log_reports(job_name, reports)
+
+    if max_workers:
+        mp_context = multiprocessing.get_context(settings.multiprocessing_start_method or None)
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+            futs = {executor.submit(warm_subsection, subsection): job_name for job_name, subsection in deferred}
+            for fut in as_completed(futs):
+                reports = fut.result()
+                total_bytes += sum(r["bytes"] for r in reports)
+                log_reports(futs[fut], reports)
+    else:
+        for job_name, subsection in deferred:
+            reports = warm_subsection(subsection)
+            total_bytes += sum(r["bytes"] for r in reports)
+            log_reports(job_name, reports)
+
+    seconds = perf_counter() - start
+    typer.echo(
+        f"warmed cache with {total_bytes / 1e6:.1f} MB in {seconds:.1f}s ({total_bytes / 1e6 / seconds:.1f} MB/s)"
+    )
+
+
+@app.command()
+def migrate(
+    paths: List[Path] = typer.Argument(None, help="N5 cache stores, defaults to all in settings.cache_dir"),
+    chunks: Optional[str] = typer.Option(None, "--chunks", help="comma separated, e.g. 1,1,64,64 (default: keep)"),
+    compression: Optional[str] = typer.Option(
+        None, "--compression", help="|".join(map(str, CACHE_COMPRESSIONS[1:])) + " (default: keep)"
+    ),
+    compression_opts: Optional[str] = typer.Option(None, "--compression_opts", help="yaml, e.g. '{level: 5}'"),
+    dtype: Optional[str] = typer.Option(None, "--dtype", help="default: keep"),
+):
+    """rewrite existing N5 caches with different chunks, compression or dtype"""
+    if compression not in CACHE_COMPRESSIONS:
+        raise typer.BadParameter(f"{compression} not in {CACHE_COMPRESSIONS}")
+
+    if compression is None and compression_opts is not None:
+        raise typer.BadParameter("--compression_opts requires --compression")
+
+    for path in paths or sorted(settings.cache_dir.glob("*.n5")):
+        migrate_n5_cache(
+            path,
+            chunks=None if chunks is None else [int(c) for c in chunks.split(",")],
+            compression=compression,
+            compression_opts=None if compression_opts is None else yaml.safe_load(compression_opts),
+            dtype=dtype,
+        )
+        typer.echo(f"migrated {path}")
+
+
+@app.command(name="ls")
+def ls(problems_only: bool = typer.Option(False, "--problems_only")):
+    """list cache entries, least recently used first"""
+    entries = sorted(CacheManager().scan().values(), key=lambda e: e.last_access)
+    total = 0
+    for entry in entries:
+        total += entry.size
+        if problems_only and not entry.problems:
+            continue
+
+        last_access = datetime.fromtimestamp(entry.last_access).isoformat(sep=" ", timespec="minutes")
+        typer.echo(f"{last_access} {entry.size / 1e9:8.2f} GB {entry.kind:8} {entry.name}")
+        for problem in entry.problems:
+            typer.echo(f"    ! {problem}")
+
+    typer.echo(f"{len(entries)} entries, {total / 1e9:.2f} GB in {settings.cache_dir}")
+
+
+@app.command()
+def gc(
+    budget_gb: Optional[float] = typer.Option(None, "--budget_gb", help="defaults to settings.cache_budget_bytes"),
+    keep_recent_hours: float = typer.Option(1.0, "--keep_recent_hours"),
+    remove_broken: bool = typer.Option(True, "--remove_broken/--keep_broken"),
+    dry_run: bool = typer.Option(False, "--dry_run"),
+):
+    """remove broken and least recently used cache entries to fit the cache into the byte budget; entries in use by
+    running processes are kept"""
+    removed = CacheManager().gc(
+        budget=None if budget_gb is None else int(budget_gb * 1e9),
+        keep_recent=keep_recent_hours * 3600,
+        remove_broken=remove_broken,
+        dry_run=dry_run,
+    )
+    for entry in removed:
+        typer.echo(f"{'would remove' if dry_run else 'removed'} {entry.size / 1e9:.2f} GB {entry.name}")
+
+    typer.echo(f"{'would free' if dry_run else 'freed'} {sum(e.size for e in removed) / 1e9:.2f} GB")
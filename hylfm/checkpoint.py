@@ -1,10 +1,12 @@
+import os
 import shutil
 import sys
-from dataclasses import asdict, dataclass, field, fields
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, fields, replace
 from enum import Enum
 from inspect import signature
 from pathlib import Path
-from typing import Dict, Optional, Sequence, Union
+from typing import Any, Dict, Optional, Sequence, Union
 
 import packaging.version
 import torch
@@ -19,6 +21,7 @@ from hylfm.hylfm_types import (
     MetricChoice,
     OptimizerChoice,
     PeriodUnit,
+    PrecisionChoice,
 )
 
 
@@ -35,6 +38,38 @@ def _conv_to_simple_dtypes(data: dict):
     }
 
 
+def _to_cpu(data: Any) -> Any:
+    """copy of (nested) state dicts with all tensors copied to the cpu"""
+    if isinstance(data, torch.Tensor):
+        return data.detach().to("cpu", copy=True)
+    elif isinstance(data, dict):
+        copied = (OrderedDict if isinstance(data, OrderedDict) else dict)((k, _to_cpu(v)) for k, v in data.items())
+        if hasattr(data, "_metadata"):  # versions of module state dicts
+            copied._metadata = data._metadata
+
+        return copied
+    elif isinstance(data, (list, tuple)):
+        return type(data)(_to_cpu(v) for v in data)
+    else:
+        return data
+
+
+def _fsync_dir(path: Path):
+    if sys.platform == "win32":
+        return
+
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace_durably(tmp_path: Path, path: Path):
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+
 @dataclass
 class RunConfig:
     batch_size: int
@@ -119,6 +154,8 @@ class TrainRunConfig(RunConfig):
 
     model_weights_name: Optional[str] = None
     zero_max_patience: int = 10
+    precision: PrecisionChoice = PrecisionChoice.fp32
+    channels_last: bool = False
 
     def as_dict(self, for_logging: bool = False) -> dict:
         dat = super().as_dict(for_logging=for_logging)
@@ -140,6 +177,7 @@ class TrainRunConfig(RunConfig):
         mw = dat.pop("model_weights")
         dat["model_weights"] = None if mw is None else Path(mw)
         dat["optimizer"] = OptimizerChoice(dat.pop("optimizer"))
+        dat["precision"] = PrecisionChoice(dat.pop("precision", PrecisionChoice.fp32))
         dat["score_metric"] = MetricChoice(dat.pop("score_metric"))
         dat["validate_every_unit"] = PeriodUnit(dat.pop("validate_every_unit"))
 
@@ -194,12 +232,14 @@ class Checkpoint:
     best_validation_score: Optional[float] = None
     epoch: int = 0
     full_batch_len: int = None  # deprecated: todo: remove
+    grad_scaler_state_dict: Optional[dict] = None
     hylfm_version: str = __version__
     impatience: int = 0
     iteration: int = 0
     lr_scheduler_state_dict: Optional[dict] = None
     model_weights: Optional[dict] = None
     optimizer_state_dict: Optional[dict] = None
+    sampler_state_dict: Optional[dict] = None
     validation_iteration: int = 0
 
     root: Path = field(init=False)
@@ -253,26 +293,51 @@ class Checkpoint:
     def path(self):
         return self.root / f"val{self.validation_iteration:05}_ep{self.epoch}_it{self.iteration}.pth"
 
+    def snapshot(self) -> "Checkpoint":
+        """copy with all state on the cpu, unaffected by further training"""
+        return replace(
+            self,
+            grad_scaler_state_dict=_to_cpu(self.grad_scaler_state_dict),
+            lr_scheduler_state_dict=_to_cpu(self.lr_scheduler_state_dict),
+            model_weights=_to_cpu(self.model_weights),
+            optimizer_state_dict=_to_cpu(self.optimizer_state_dict),
+            sampler_state_dict=_to_cpu(self.sampler_state_dict),
+        )
+
     def save(self, best: bool):
+        """write atomically (a crash never leaves a truncated checkpoint or best.pth)"""
         assert self.training_run_name is not None
         assert self.training_run_id is not None
         path = self.path
 
-        torch.save(self.as_dict(for_logging=False), path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                torch.save(self.as_dict(for_logging=False), f)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            tmp_path.unlink()
+            raise
+
+        _replace_durably(tmp_path, path)
 
         if best:  # overwrite best
             # best_path = self.path.with_stem("best")  # todo: python 3.9
             best_path = self.path.with_name("best.pth")
+            tmp_best_path = best_path.with_name(f".{best_path.name}.tmp")
             try:
-                best_path.unlink()
+                tmp_best_path.unlink()
             except FileNotFoundError:
                 pass
-            # best_path.unlink(missing_ok=True)  # todo: python 3.8
+            # tmp_best_path.unlink(missing_ok=True)  # todo: python 3.8
 
             if sys.platform == "win32":
-                shutil.copy(path, best_path)
+                shutil.copy(path, tmp_best_path)
             else:
-                best_path.symlink_to(path)
+                tmp_best_path.symlink_to(path)
+
+            _replace_durably(tmp_best_path, best_path)
 
         return path
 
@@ -281,7 +346,13 @@ class Checkpoint:
         dat.pop("config")
         if for_logging:
             config_key = "cfg"
-            for key in ["lr_scheduler_state_dict", "model_weights", "optimizer_state_dict"]:
+            for key in [
+                "grad_scaler_state_dict",
+                "lr_scheduler_state_dict",
+                "model_weights",
+                "optimizer_state_dict",
+                "sampler_state_dict",
+            ]:
                 dat.pop(key)
         else:
             config_key = "config"
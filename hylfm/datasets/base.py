@@ -2,16 +2,16 @@ from __future__ import annotations
 
 import bisect
 import logging
-import re
+import threading
 import warnings
+from concurrent.futures import Future
 from concurrent.futures.thread import ThreadPoolExecutor
 from functools import partial
 from hashlib import sha224 as hash_algorithm
 from pathlib import Path
-from time import sleep
+from time import perf_counter
 from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-import h5py
 import imageio
 import numpy
 import torch.utils.data
@@ -19,8 +19,13 @@ import yaml
 import z5py
 
 import hylfm
-import hylfm.datasets.filters
 from hylfm import settings
+from hylfm.datasets.cache_manager import CacheLease
+from hylfm.datasets.filter_engine import compute_filter_mask
+from hylfm.datasets.h5_file_pool import get_h5_file_pool
+from hylfm.datasets.h5_index import H5Index
+from hylfm.datasets.n5_utils import CACHE_COMPRESSIONS, FillMarkers, get_z5_compression_kwargs
+from hylfm.datasets.sample_summary import SampleSummary
 from hylfm.datasets.utils import get_paths, merge_nested_dicts
 from hylfm.hylfm_types import TransformLike
 from hylfm.stat_ import DatasetStat
@@ -51,6 +56,10 @@ class TensorInfo:
         meta: Optional[dict] = None,
         repeat: int = 1,
         tag: Optional[str] = None,
+        cache_chunks: Optional[Sequence[int]] = None,
+        cache_compression: Optional[str] = None,
+        cache_compression_opts: Optional[Dict[str, Any]] = None,
+        cache_dtype: Optional[str] = None,
         **kwargs,
     ):
         assert not location.endswith(".h5"), "h5 path to dataset missing .h5/Dataset"
@@ -70,6 +79,8 @@ class TensorInfo:
         assert isinstance(location, str)
         assert isinstance(datasets_per_file, int)
         assert isinstance(samples_per_dataset, int), samples_per_dataset
+        assert cache_chunks is None or cache_chunks[0] == 1, "cache chunks may not span multiple samples"
+        assert cache_compression in CACHE_COMPRESSIONS, (cache_compression, CACHE_COMPRESSIONS)
         self.name = name
         if tag is None:
             self.tag = name
@@ -86,6 +97,11 @@ class TensorInfo:
         self.skip_indices = skip_indices
         self.meta: dict = meta or {}
         self.repeat = repeat
+        # cache storage options do not change the cached data (beyond dtype precision) and are not part of description
+        self.cache_chunks = None if cache_chunks is None else tuple(cache_chunks)
+        self.cache_compression = cache_compression
+        self.cache_compression_opts = cache_compression_opts or {}
+        self.cache_dtype = cache_dtype
         self.kwargs = kwargs
         self.path: Path = (settings.data_roots[root] if isinstance(root, str) else root) / location
         self.root = root
@@ -236,14 +252,6 @@ class TiffDataset(DatasetFromInfo):
 
 
 class H5Dataset(DatasetFromInfo):
-    @staticmethod
-    def get_ds_resolver(pattern: str, results_to: List[str]) -> Callable[[str], None]:
-        def ds_resolver(name: str):
-            if re.match(pattern, name):
-                results_to.append(name)
-
-        return ds_resolver
-
     def __init__(self, *, info: TensorInfo):
         if info.kwargs:
             raise NotImplementedError(info.kwargs)
@@ -253,7 +261,8 @@ class H5Dataset(DatasetFromInfo):
 
         super().__init__(info=info)
         self._paths = None
-        self._dataset_paths = None
+        self._h5_index: Optional[H5Index] = None
+        self._dataset_paths_per_file: Dict[int, List[str]] = {}
         h5_ext = ".h5"
         assert h5_ext in self.info.path.as_posix(), self.info.path.as_posix()
         file_path_glob, within_pattern = self.info.path.as_posix().split(h5_ext)
@@ -268,20 +277,34 @@ class H5Dataset(DatasetFromInfo):
 
         return self._paths
 
+    @property
+    def h5_index(self) -> H5Index:
+        if self._h5_index is None:
+            self._h5_index = H5Index(self.file_path_glob, self.within_pattern)
+
+        return self._h5_index
+
+    def get_dataset_paths(self, path_idx: int) -> List[str]:
+        """lazily resolve the matching h5 datasets of a single file"""
+        dataset_paths = self._dataset_paths_per_file.get(path_idx)
+        if dataset_paths is None:
+            dataset_paths = [ds["name"] for ds in self.h5_index.resolve(self.paths[path_idx])]
+            assert dataset_paths, (self.paths[path_idx], self.within_pattern)
+            self._dataset_paths_per_file[path_idx] = dataset_paths
+            if len(self._dataset_paths_per_file) == len(self.paths):
+                self.h5_index.save()
+
+        return dataset_paths
+
     @property
     def dataset_paths(self):
-        if self._dataset_paths is None:
-            self._dataset_paths = []
-            for p in self.paths:
-                with h5py.File(p, mode="r") as hf:
-                    root_group = hf["/"]
-                    within = []
-                    root_group.visit(self.get_ds_resolver(self.within_pattern, within))
-                    self._dataset_paths.append(sorted(within))
+        if len(self._dataset_paths_per_file) < len(self.paths):
+            for path_idx, datasets in enumerate(self.h5_index.resolve_many(self.paths)):
+                self._dataset_paths_per_file[path_idx] = [ds["name"] for ds in datasets]
 
-            assert all(self._dataset_paths), self._dataset_paths
+            assert all(self._dataset_paths_per_file.values()), self._dataset_paths_per_file
 
-        return self._dataset_paths
+        return [self._dataset_paths_per_file[i] for i in range(len(self.paths))]
 
     def __len__(self):
         return len(self.paths) * self.info.datasets_per_file * self.info.samples_per_dataset
@@ -292,13 +315,13 @@ class H5Dataset(DatasetFromInfo):
         idx %= self.info.datasets_per_file * self.info.samples_per_dataset
         ds_idx = idx // self.info.samples_per_dataset
         idx %= self.info.samples_per_dataset
-        dataset_path = self.dataset_paths[path_idx][ds_idx]
-        with h5py.File(self.paths[path_idx], mode="r") as hf:
-            h5ds = hf[dataset_path]
-            if self.info.samples_per_dataset > 1:
-                img: numpy.ndarray = h5ds[idx : idx + 1]
-            else:
-                img: numpy.ndarray = h5ds[:]
+        dataset_path = self.get_dataset_paths(path_idx)[ds_idx]
+        if self.info.samples_per_dataset > 1:
+            selection = slice(idx, idx + 1)
+        else:
+            selection = slice(None)
+
+        img: numpy.ndarray = get_h5_file_pool().read(self.paths[path_idx], dataset_path, selection)
 
         for axis in self.insert_singleton_axes_at:
             img = numpy.expand_dims(img, axis=axis)
@@ -324,11 +347,16 @@ class N5CachedDatasetFromInfo(DatasetFromInfoExtender):
     def __init__(self, dataset: DatasetFromInfo):
         super().__init__(dataset=dataset)
         self.repeat = dataset.info.repeat
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._futures: Dict[int, Future] = {}
+        self._futures_lock = threading.Lock()
+        self.fill_stats: Dict[str, float] = {"samples": 0, "bytes": 0}
         description = dataset.description
         data_file_path = (
             settings.cache_dir
             / f"{dataset.info.tag}_{dataset.tensor_name}_{hash_algorithm(description.encode()).hexdigest()}.n5"
         )
+        self.lease = CacheLease(data_file_path)
         data_file_path.with_suffix(".txt").write_text(description)
 
         self.from_source = not dataset.transform.transforms
@@ -345,10 +373,34 @@ class N5CachedDatasetFromInfo(DatasetFromInfoExtender):
                 tensor_shape = tuple(tensor.shape)
                 assert tensor_shape[0] == 1, tensor_shape  # expected explicit batch dimension
                 shape = (_len,) + tensor_shape[1:]
-                data_file.create_dataset(tensor_name, shape=shape, chunks=tensor_shape, dtype=tensor.dtype)
+                info = dataset.info
+                chunks = tensor_shape if info.cache_chunks is None else info.cache_chunks
+                assert len(chunks) == len(shape), (chunks, shape)
+                z5dataset = data_file.create_dataset(
+                    tensor_name,
+                    shape=shape,
+                    chunks=chunks,
+                    dtype=info.cache_dtype or tensor.dtype,
+                    **get_z5_compression_kwargs(info.cache_compression, info.cache_compression_opts),
+                )
+                z5dataset.attrs["source_dtype"] = str(tensor.dtype)
+
+            z5dataset = data_file[tensor_name]
+            self.source_dtype = numpy.dtype(z5dataset.attrs.get("source_dtype", str(z5dataset.dtype)))
+            self.fill_markers = FillMarkers.of(data_file_path / tensor_name, z5dataset.shape[0])
 
         self.stat = None
-        self.stat = DatasetStat(path=data_file_path.with_suffix(".stat_v1.yml"), dataset=self)
+        self.stat = DatasetStat(path=data_file_path.with_suffix(".stat_v2.yml"), dataset=self)
+        self.summary_path = data_file_path.with_suffix(".summary.npz")
+        self._summary: Optional[SampleSummary] = None
+
+    @property
+    def summary(self) -> SampleSummary:
+        """per sample summary table, rows are computed as needed (see `SampleSummary.compute`)"""
+        if self._summary is None:
+            self._summary = SampleSummary(self.summary_path, dataset=self)
+
+        return self._summary
 
     def __getitem__(self, idx) -> Dict[str, Union[List[Dict[str, DatasetStat]], numpy.ndarray]]:
         idx = int(idx)
@@ -356,20 +408,12 @@ class N5CachedDatasetFromInfo(DatasetFromInfoExtender):
         if self.from_source:
             tensor = self.dataset[phys_idx][self.dataset.tensor_name]
         else:
-            if idx % self.repeat == 0:
-                self.submit(phys_idx)  # .result()
-            else:
-                for patience in range(50):
-                    if self.ready(phys_idx):
-                        break
-                    else:
-                        sleep(0.5)
-                else:
-                    raise RuntimeError(f"idx {phys_idx} not ready, but requested as idx//repeat {idx}//{self.repeat}")
-
+            self.submit(phys_idx).result()
             z5dataset = self.data_file[self.dataset.tensor_name]
             assert phys_idx < z5dataset.shape[0], z5dataset.shape
             tensor = z5dataset[phys_idx : phys_idx + 1]
+            if tensor.dtype != self.source_dtype:
+                tensor = tensor.astype(self.source_dtype)
 
         batch_len = tensor.shape[0]
         mini_batch = {
@@ -389,22 +433,109 @@ class N5CachedDatasetFromInfo(DatasetFromInfoExtender):
     def __len__(self):
         return len(self.dataset) * self.repeat
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # background fill engine is local to each process
+        state["_executor"] = None
+        state["_futures"] = {}
+        del state["_futures_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._futures_lock = threading.Lock()
+
+    @property
+    def executor(self) -> Optional[ThreadPoolExecutor]:
+        if self._executor is None and settings.max_workers_per_dataset:
+            max_workers = settings.max_workers_per_dataset - settings.reserved_workers_per_dataset_for_getitem
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(1, max_workers), thread_name_prefix=f"fill_{self.dataset.tensor_name}"
+            )
+
+        return self._executor
+
     def ready(self, idx: int) -> bool:
-        n5ds = self.data_file[self.dataset.tensor_name]
-        chunk_idx = tuple([idx] + [0] * (len(n5ds.shape) - 1))
-        return n5ds.chunk_exists(chunk_idx)
+        return self.fill_markers.is_set(idx)
+
+    def submit(self, idx: int) -> Future:
+        """get a future that resolves once sample `idx` is cached"""
+        with self._futures_lock:
+            fut = self._futures.get(idx)
+            if fut is not None:
+                return fut
+
+            if self.from_source or self.ready(idx):
+                fut = Future()
+                fut.set_result(idx)
+                return fut
+
+            executor = self.executor
+            if executor is None:
+                fut = Future()
+                self._futures[idx] = fut
+            else:
+                fut = executor.submit(self.process, idx)
+                self._futures[idx] = fut
+                fut.add_done_callback(partial(self._forget_future, idx))
+                return fut
 
-    def submit(self, idx: int) -> int:
-        if self.ready(idx):
-            return idx
-        else:
-            return self.process(idx)
+        # no background workers: fill synchronously (outside of lock)
+        try:
+            fut.set_result(self.process(idx))
+        except Exception as e:
+            fut.set_exception(e)
+        finally:
+            self._forget_future(idx, fut)
+
+        return fut
+
+    def _forget_future(self, idx: int, fut: Future):
+        with self._futures_lock:
+            if self._futures.get(idx) is fut:
+                del self._futures[idx]
+
+    def prefetch(self, indices: Sequence[int]) -> None:
+        """schedule background caching of (repeated) `indices`, at most `settings.max_cache_fills_in_flight` at a
+        time"""
+        if self.from_source or self.executor is None:
+            return
+
+        for phys_idx in dict.fromkeys(int(idx) // self.repeat for idx in indices):
+            with self._futures_lock:
+                if len(self._futures) >= settings.max_cache_fills_in_flight:
+                    return
+
+            self.submit(phys_idx)
 
     def process(self, idx: int) -> int:
-        self.data_file[self.dataset.tensor_name][idx, ...] = self.dataset[idx][self.dataset.tensor_name]
+        with self.fill_markers.lock(idx):
+            if self.ready(idx):  # filled by another process meanwhile
+                return idx
+
+            start = perf_counter()
+            tensor = self.dataset[idx][self.dataset.tensor_name]
+            z5dataset = self.data_file[self.dataset.tensor_name]
+            z5dataset[idx, ...] = tensor.astype(z5dataset.dtype, copy=False)
+            self.fill_markers.set(idx)
+
+        with self._futures_lock:
+            self.fill_stats["samples"] += 1
+            self.fill_stats["bytes"] += tensor.nbytes
+            self.fill_stats["start"] = min(self.fill_stats.get("start", start), start)
+            self.fill_stats["stop"] = perf_counter()
 
         return idx
 
+    def fill(self) -> Dict[str, float]:
+        """cache all samples; returns fill statistics of this process"""
+        if not self.from_source:
+            futs = [self.submit(idx) for idx in range(len(self.dataset))]
+            for fut in futs:
+                fut.result()
+
+        return dict(self.fill_stats)
+
 
 class N5CachedDatasetFromInfoSubset(DatasetFromInfoExtender):
     dataset: N5CachedDatasetFromInfo
@@ -440,6 +571,7 @@ class N5CachedDatasetFromInfoSubset(DatasetFromInfoExtender):
         )
         mask_description_file_path = mask_file_path.with_suffix(".txt")
 
+        self.lease = CacheLease(mask_file_path)
         mask_description_file_path.write_text(description)
 
         logger.warning("using dataset mask %s", mask_description_file_path)
@@ -450,40 +582,23 @@ class N5CachedDatasetFromInfoSubset(DatasetFromInfoExtender):
             if dataset.repeat > 1:
                 warnings.warn("computing stat on a repeated dataset!")
 
-            mask = numpy.zeros(len(dataset), dtype=bool)
-            mask[numpy.asarray(indices)] = True
+            resolved_filters = []
             for name, kwargs in filters:
+                kwargs = dict(kwargs)
                 for k, v in kwargs.items():
                     if isinstance(v, dict) and len(v) == 1:
                         kk = list(v.keys())[0]
                         if kk == "percentile":
-                            kwargs[k] = dataset.stat.get_percentiles(dataset.dataset.tensor_name, [v[kk]])
+                            kwargs[k] = dataset.stat.get_percentile(dataset.dataset.tensor_name, v[kk])
                         elif kk == "mean+xstd":
                             mean, std = dataset.stat.get_mean_std(dataset.dataset.tensor_name, (5.0, 99.9))
                             kwargs[k] = mean + std * v[kk]
 
-            filters = [
-                partial(getattr(hylfm.datasets.filters, name), dataset=dataset, **kwargs) for name, kwargs in filters
-            ]
-
-            def apply_filters_to_mask(i: int) -> None:
-                if any([not fil(idx=i) for fil in filters]):
-                    mask[i] = False
-
-            if settings.max_workers_per_dataset:
-                with ThreadPoolExecutor(max_workers=settings.max_workers_per_dataset) as executor:
-                    futs = []
-                    for idx in indices:
-                        futs.append(executor.submit(apply_filters_to_mask, idx))
-
-                    for idx, fut in enumerate(futs):
-                        exc = fut.exception()
-                        if exc is not None:
-                            raise exc
-            else:
-                for idx in indices:
-                    apply_filters_to_mask(idx)
+                resolved_filters.append((name, kwargs))
 
+            mask = compute_filter_mask(
+                dataset, indices, resolved_filters, progress_path=mask_file_path.with_suffix(".progress.npy")
+            )
             numpy.save(str(mask_file_path), mask)
 
         self.mask = mask
@@ -505,6 +620,9 @@ class N5CachedDatasetFromInfoSubset(DatasetFromInfoExtender):
         ret["idx"] = [idx]
         return ret
 
+    def prefetch(self, indices: Sequence[int]) -> None:
+        self.dataset.prefetch(self.indices[numpy.asarray(indices, dtype=int)])
+
 
 def get_dataset_from_info(
     info: TensorInfo,
@@ -577,6 +695,10 @@ class ZipDataset(torch.utils.data.Dataset):
         sample["idx"] = [idx]
         return sample
 
+    def prefetch(self, indices: Sequence[int]) -> None:
+        for ds in self.datasets.values():
+            prefetch(ds, indices)
+
 
 class ConcatDataset(torch.utils.data.ConcatDataset):
     def __init__(self, datasets: List[torch.utils.data.ConcatDataset], transform: Optional[TransformLike] = None):
@@ -592,3 +714,33 @@ class ConcatDataset(torch.utils.data.ConcatDataset):
             sample = self.transform(sample)
 
         return sample
+
+    def __getitems__(self, indices: Sequence[int]) -> List[Dict[str, Any]]:
+        """load a mini-batch, after letting cached datasets fill it and the upcoming batches this (worker) process
+        will load (see `hylfm.sampler.BatchIndices`) in the background"""
+        self.prefetch(indices)
+        # the DataLoader hands batches to its workers round robin
+        worker_info = torch.utils.data.get_worker_info()
+        stride = 1 if worker_info is None else worker_info.num_workers
+        for upcoming in getattr(indices, "upcoming", [])[stride - 1 :: stride]:
+            self.prefetch(upcoming)
+
+        return [self[idx] for idx in indices]
+
+    def prefetch(self, indices: Sequence[int]) -> None:
+        prefetch(self, indices)
+
+
+def prefetch(dataset: torch.utils.data.Dataset, indices: Sequence[int]) -> None:
+    """schedule background caching of `indices` for (nested) cached datasets"""
+    if isinstance(dataset, torch.utils.data.ConcatDataset):
+        per_dataset = {}
+        for idx in indices:
+            dataset_idx = bisect.bisect_right(dataset.cumulative_sizes, idx)
+            sample_idx = idx if dataset_idx == 0 else idx - dataset.cumulative_sizes[dataset_idx - 1]
+            per_dataset.setdefault(dataset_idx, []).append(sample_idx)
+
+        for dataset_idx, sample_indices in per_dataset.items():
+            prefetch(dataset.datasets[dataset_idx], sample_indices)
+    elif hasattr(dataset, "prefetch"):
+        dataset.prefetch(indices)
@@ -0,0 +1,272 @@
+import logging
+import os
+import re
+import shutil
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from hylfm import settings
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HASH_PATTERN = re.compile(r"([0-9a-f]{56})")
+LEASE_SUFFIX = ".lease"
+
+
+class CacheLease:
+    """shared lock on a '.lease' file next to the cache artifact at `path`, held while the artifact is in use.
+
+    `CacheManager.gc` never evicts an entry with a held lease. Taking a lease touches the lease file, which marks the
+    entry's last access. Leases are held by the process that took them (and processes forked from it) until
+    `release` or exit; unpickled copies do not hold the lease.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path.with_suffix(LEASE_SUFFIX)
+        self._fd: Optional[int] = None
+        while True:
+            self.path.touch()
+            fd = os.open(self.path, os.O_RDONLY)
+            if fcntl is None:
+                self._fd = fd
+                break
+
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                same_file = os.stat(self.path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                same_file = False
+
+            if same_file:
+                self._fd = fd
+                break
+            else:  # evicted while waiting for the lock
+                os.close(fd)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_fd"] = None
+        return state
+
+    def release(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def get_size(path: Path) -> int:
+    if path.is_dir():
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                try:
+                    size += os.stat(os.path.join(root, f)).st_size
+                except FileNotFoundError:
+                    pass
+
+        return size
+    else:
+        return path.stat().st_size
+
+
+@dataclass
+class CacheEntry:
+    """all cache artifacts sharing a description hash"""
+
+    key: str
+    paths: List[Path] = field(default_factory=list)
+    size: int = 0
+    last_access: float = 0.0
+    problems: List[str] = field(default_factory=list)
+
+    @property
+    def managed(self) -> bool:
+        """only artifacts named with a description hash are managed"""
+        return HASH_PATTERN.fullmatch(self.key) is not None
+
+    @property
+    def name(self) -> str:
+        for p in self.paths:
+            if p.suffix == ".txt":
+                return p.name[: -len(".txt")]
+
+        return self.paths[0].name
+
+    @property
+    def kind(self) -> str:
+        if any(p.name.endswith(".n5") for p in self.paths):
+            return "n5"
+        elif any(p.name.endswith(".index_mask.npy") for p in self.paths):
+            return "mask"
+        elif any(p.name.startswith("h5_index_") for p in self.paths):
+            return "h5_index"
+        elif any(".stat_v" in p.name for p in self.paths):
+            return "stat"
+        else:
+            return "other"
+
+
+class CacheManager:
+    """index artifacts in `settings.cache_dir` by description hash and evict least recently used entries.
+
+    Last access is the latest modification time of an entry's top level artifacts (the '.txt' description sidecars
+    are rewritten and the '.lease' files touched whenever a cached dataset is created). Entries leased by a running
+    process (see `CacheLease`) are never evicted.
+    """
+
+    def __init__(self, cache_dir: Optional[Path] = None):
+        self.cache_dir = settings.cache_dir if cache_dir is None else Path(cache_dir)
+
+    def scan(self) -> Dict[str, CacheEntry]:
+        entries: Dict[str, CacheEntry] = {}
+        for path in sorted(self.cache_dir.iterdir()):
+            match = HASH_PATTERN.search(path.name)
+            key = path.name if match is None else match.group(1)
+            entry = entries.setdefault(key, CacheEntry(key=key))
+            entry.paths.append(path)
+            entry.size += get_size(path)
+            entry.last_access = max(entry.last_access, path.stat().st_mtime)
+
+        for entry in entries.values():
+            self.check(entry)
+
+        return entries
+
+    @staticmethod
+    def check(entry: CacheEntry) -> None:
+        if not entry.managed:
+            return
+
+        names = [p.name for p in entry.paths]
+
+        has_description = any(n.endswith(".txt") for n in names)
+        for p in entry.paths:
+            if p.name.endswith((".n5.migrating", ".n5.old")):
+                entry.problems.append(f"interrupted migration: {p.name}")
+            elif p.name.endswith(".progress.npy"):
+                entry.problems.append(f"interrupted filter run: {p.name}")
+            elif p.name.endswith(".n5"):
+                if not (p / "attributes.json").exists():
+                    entry.problems.append(f"partial n5 store (no attributes.json): {p.name}")
+                else:
+                    for ds in p.iterdir():
+                        if ds.is_dir() and not (ds / "attributes.json").exists():
+                            entry.problems.append(f"partial n5 dataset: {p.name}/{ds.name}")
+            elif (
+                p.name.endswith((".yml", ".npz"))
+                and ".stat_v" in p.name
+                and not has_description  # datasets cached from source have no n5 store
+                and not any(n.endswith(".n5") for n in names)
+            ):
+                entry.problems.append(f"orphaned stat: {p.name}")
+            elif p.name.endswith(".txt") and len([n for n in names if not n.endswith(LEASE_SUFFIX)]) == 1:
+                entry.problems.append(f"orphaned description: {p.name}")
+
+        if not has_description and entry.kind in ("n5", "mask"):
+            entry.problems.append("missing description")
+
+    @staticmethod
+    def lock(entry: CacheEntry) -> Optional[List[int]]:
+        """exclusively lock the lease files of `entry`; returns their file descriptors or `None` if it is leased"""
+        fds = []
+        if fcntl is None:
+            return fds
+
+        for p in entry.paths:
+            if not p.name.endswith(LEASE_SUFFIX):
+                continue
+
+            try:
+                fd = os.open(p, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+
+            fds.append(fd)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                CacheManager.unlock(fds)
+                return None
+
+        return fds
+
+    @staticmethod
+    def unlock(fds: List[int]) -> None:
+        for fd in fds:
+            os.close(fd)
+
+    @staticmethod
+    def remove(entry: CacheEntry) -> None:
+        # lease files last: waiting leases notice the unlinked lease file once the entry is gone
+        for p in sorted(entry.paths, key=lambda p: p.name.endswith(LEASE_SUFFIX)):
+            logger.info("removing %s", p)
+            if p.is_dir():
+                shutil.rmtree(p, ignore_errors=True)
+            else:
+                p.unlink()
+
+    def gc(
+        self,
+        budget: Optional[int] = None,
+        keep_recent: float = 3600.0,
+        remove_broken: bool = True,
+        dry_run: bool = False,
+    ) -> List[CacheEntry]:
+        """remove broken entries and least recently used entries until the cache fits into `budget` bytes.
+
+        Leased entries and entries accessed within the last `keep_recent` seconds are never evicted.
+        """
+        budget = settings.cache_budget_bytes if budget is None else budget
+        entries = sorted([e for e in self.scan().values() if e.managed], key=lambda e: e.last_access)
+        now = time.time()
+        locks: Dict[str, List[int]] = {}
+
+        def evictable(entry: CacheEntry) -> bool:
+            if now - entry.last_access <= keep_recent:
+                return False
+
+            fds = self.lock(entry)
+            if fds is None:
+                logger.info("skipping leased %s", entry.name)
+                return False
+
+            locks[entry.key] = fds
+            return True
+
+        removed = []
+        if remove_broken:
+            for entry in entries:
+                if entry.problems and evictable(entry):
+                    removed.append(entry)
+
+        if budget is not None:
+            total = sum(e.size for e in entries if e not in removed)
+            for entry in entries:
+                if total <= budget:
+                    break
+
+                if entry in removed or not evictable(entry):
+                    continue
+
+                removed.append(entry)
+                total -= entry.size
+
+            if total > budget:
+                logger.warning(
+                    "cache size %d exceeds budget %d after evicting all but recent and leased entries", total, budget
+                )
+
+        for entry in removed:
+            if not dry_run:
+                self.remove(entry)
+
+            self.unlock(locks.pop(entry.key))
+
+        return removed
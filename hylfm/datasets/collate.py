@@ -1,22 +1,159 @@
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
 from functools import partial
 from itertools import chain
-from typing import Any, Collection, Dict, List, Optional, Union
+from typing import Any, Collection, Deque, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
 import torch
+import torch.utils.data
 
+from hylfm import settings
 from hylfm.hylfm_types import TransformLike
 
+logger = logging.getLogger(__name__)
+
 
 COMMON_BATCH_KEYS = {"batch_len", "epoch", "epoch_len", "iteration"}  # are shared across all samples in a batch
 SAMPLE_KEYS_EQUAL_IN_BATCH = {"crop_name"}  # each sample has it, but they need to equal to be batched together
 
 
-def sample_values_to_batch_value(values: List, *, sample_key: Optional = None):
+class BatchBufferPool:
+    """rings of reusable, preallocated torch batch buffers keyed by shape and dtype.
+
+    Buffers live in shared memory when allocated in a DataLoader worker (such that sending a batch to the main process
+    does not copy it again) and in pinned memory in the main process (if cuda is available and `pin_memory` is set).
+    A buffer is reused after `ring_size` further batches of the same shape and dtype, so `ring_size` has to exceed the
+    number of batches in flight per process (DataLoader prefetching + the batch in use + pending non-blocking copies).
+    """
+
+    def __init__(self, ring_size: int, pin_memory: bool):
+        assert ring_size > 1, ring_size
+        self.ring_size = ring_size
+        self.pin_memory = pin_memory
+        self._rings: Dict[Tuple[Tuple[int, ...], numpy.dtype], Deque[torch.Tensor]] = OrderedDict()
+        self._views: Dict[int, Tuple[numpy.ndarray, torch.Tensor]] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.allocated_bytes = 0
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():  # forked: buffers (and their pinned/shared state) belong to the parent
+            self._rings.clear()
+            self._views.clear()
+            self.allocated_bytes = 0
+            self._pid = os.getpid()
+
+    @staticmethod
+    def get_torch_dtype(dtype: numpy.dtype) -> Optional[torch.dtype]:
+        try:
+            return torch.from_numpy(numpy.empty(0, dtype=dtype)).dtype
+        except TypeError:  # e.g. uint16 is not supported by torch
+            return None
+
+    def _allocate(self, shape: Tuple[int, ...], dtype: torch.dtype) -> torch.Tensor:
+        buffer = torch.empty(shape, dtype=dtype)
+        if torch.utils.data.get_worker_info() is not None:
+            buffer.share_memory_()
+        elif self.pin_memory and torch.cuda.is_available():
+            buffer = buffer.pin_memory()
+
+        self.allocated_bytes += buffer.numel() * buffer.element_size()
+        logger.debug("allocated batch buffer %s %s (total %d bytes)", shape, dtype, self.allocated_bytes)
+        return buffer
+
+    def get(self, shape: Sequence[int], dtype: numpy.dtype) -> Optional[numpy.ndarray]:
+        """numpy view of the next buffer of `shape` and `dtype` (None if torch does not support `dtype`)"""
+        torch_dtype = self.get_torch_dtype(dtype)
+        if torch_dtype is None:
+            return None
+
+        shape = tuple(shape)
+        with self._lock:
+            self._check_pid()
+            ring = self._rings.setdefault((shape, numpy.dtype(dtype)), deque())
+            if len(ring) < self.ring_size:
+                buffer = self._allocate(shape, torch_dtype)
+            else:
+                buffer = ring.popleft()
+
+            ring.append(buffer)
+            view = buffer.numpy()
+            self._views[id(view)] = (view, buffer)
+
+        return view
+
+    def as_tensors(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """replace numpy arrays in `batch` by torch buffers. Arrays handed out by `get` (and not replaced by a batch
+        transformation) are converted without a copy, any other array is copied into a buffer once."""
+        with self._lock:
+            views = self._views
+            self._views = {}
+
+        for key, value in batch.items():
+            if not isinstance(value, numpy.ndarray):
+                continue
+
+            view, buffer = views.get(id(value), (None, None))
+            if view is value:
+                batch[key] = buffer
+                continue
+
+            out = self.get(value.shape, value.dtype)
+            if out is not None:
+                numpy.copyto(out, value)
+                batch[key] = self._views.pop(id(out))[1]
+
+        return batch
+
+
+_batch_buffer_pool: Optional[BatchBufferPool] = None
+
+
+def get_batch_buffer_pool() -> BatchBufferPool:
+    """per process batch buffer pool"""
+    global _batch_buffer_pool
+    if _batch_buffer_pool is None:
+        _batch_buffer_pool = BatchBufferPool(ring_size=settings.batch_buffer_ring_size, pin_memory=settings.pin_memory)
+
+    return _batch_buffer_pool
+
+
+def get_out_buffer(values: List[numpy.ndarray], *, concatenate: bool, buffer_pool: Optional[BatchBufferPool]):
+    if buffer_pool is None:
+        return None
+
+    v0 = values[0]
+    if any(v.dtype != v0.dtype for v in values):
+        return None
+
+    if concatenate:
+        if any(v.shape[1:] != v0.shape[1:] for v in values):
+            return None
+
+        shape = (sum(v.shape[0] for v in values),) + v0.shape[1:]
+    else:
+        if any(v.shape != v0.shape for v in values):
+            return None
+
+        shape = (len(values),) + v0.shape
+
+    return buffer_pool.get(shape, v0.dtype)
+
+
+def sample_values_to_batch_value(
+    values: List, *, sample_key: Optional = None, buffer_pool: Optional[BatchBufferPool] = None
+):
     v0 = values[0]
 
     if isinstance(v0, numpy.ndarray):
-        batch_value = numpy.ascontiguousarray(numpy.stack(values, axis=0))
+        out = get_out_buffer(values, concatenate=False, buffer_pool=buffer_pool)
+        if out is None:
+            batch_value = numpy.ascontiguousarray(numpy.stack(values, axis=0))
+        else:
+            batch_value = numpy.stack(values, axis=0, out=out)
     elif isinstance(v0, torch.Tensor):
         batch_value = torch.stack(values, dim=0)
     elif sample_key in COMMON_BATCH_KEYS:
@@ -30,14 +167,14 @@ def sample_values_to_batch_value(values: List, *, sample_key: Optional = None):
     return batch_value
 
 
-def collate(tensors: List[Dict[str, Any]]) -> Dict[str, Any]:
+def collate(tensors: List[Dict[str, Any]], *, buffer_pool: Optional[BatchBufferPool] = None) -> Dict[str, Any]:
     assert tensors
     if "batch_len" in tensors[0]:
         assert all("batch_len" in d for d in tensors)
-        return collate_batches(tensors)
+        return collate_batches(tensors, buffer_pool=buffer_pool)
     else:
         assert not any("batch_len" in d for d in tensors)
-        return collate_samples(tensors)
+        return collate_samples(tensors, buffer_pool=buffer_pool)
 
 
 def verify_keys(tensors: List[Dict[str, Any]], name: str) -> Collection[str]:
@@ -60,40 +197,56 @@ def condense_common_values(values: List[Any], key: str) -> Any:
         return value
 
 
-def collate_batches(batches: List[Dict[str, Any]]) -> Dict[str, Any]:
+def collate_batches(
+    batches: List[Dict[str, Any]], *, buffer_pool: Optional[BatchBufferPool] = None
+) -> Dict[str, Any]:
     keys = verify_keys(batches, "batches")
     listed_batches = {key: [b[key] for b in batches] for key in keys}
     batch = {
         key: condense_common_values(batch_values, key)
         if key in COMMON_BATCH_KEYS or key in SAMPLE_KEYS_EQUAL_IN_BATCH
-        else stack_batch_values(batch_values)
+        else stack_batch_values(batch_values, buffer_pool=buffer_pool)
         for key, batch_values in listed_batches.items()
     }
     return batch
 
 
-def stack_batch_values(batch_values: Union[list, numpy.ndarray, torch.Tensor]):
+def stack_batch_values(
+    batch_values: Union[list, numpy.ndarray, torch.Tensor], *, buffer_pool: Optional[BatchBufferPool] = None
+):
     assert batch_values
     if isinstance(batch_values[0], list):
         return sum(batch_values, [])
     elif isinstance(batch_values[0], numpy.ndarray):
-        return numpy.concatenate(batch_values, axis=0)
+        out = get_out_buffer(batch_values, concatenate=True, buffer_pool=buffer_pool)
+        return numpy.concatenate(batch_values, axis=0, out=out)
     elif isinstance(batch_values[0], torch.Tensor):
         return torch.cat(batch_values, dim=0)
     else:
         raise TypeError(type(batch_values[0]))
 
 
-def collate_samples(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+def collate_samples(
+    samples: List[Dict[str, Any]], *, buffer_pool: Optional[BatchBufferPool] = None
+) -> Dict[str, Any]:
     keys = verify_keys(samples, "samples")
-    batch = {key: sample_values_to_batch_value([s[key] for s in samples], sample_key=key) for key in keys}
+    batch = {
+        key: sample_values_to_batch_value([s[key] for s in samples], sample_key=key, buffer_pool=buffer_pool)
+        for key in keys
+    }
     batch["batch_len"] = len(samples)
     return batch
 
 
-def collate_and_batch_transform(samples, *, transform: TransformLike):
-    batch = collate(samples)
-    return transform(batch)
+def collate_and_batch_transform(samples, *, transform: TransformLike, into_buffers: bool = False):
+    if not into_buffers:
+        batch = collate(samples)
+        return transform(batch)
+
+    buffer_pool = get_batch_buffer_pool()
+    batch = collate(samples, buffer_pool=buffer_pool)
+    batch = transform(batch)
+    return buffer_pool.as_tensors(batch)
 
 
 def batch_value_to_sample_values(value: Any, *, sample_key: Optional = None) -> list:
@@ -111,8 +264,16 @@ def batch_value_to_sample_values(value: Any, *, sample_key: Optional = None) ->
     return sample_values
 
 
-def get_collate(batch_transformation: TransformLike):
-    return partial(collate_and_batch_transform, transform=batch_transformation)
+def get_collate(batch_transformation: TransformLike, into_buffers: Optional[bool] = None):
+    """collate function for a DataLoader.
+
+    With `into_buffers` (default: `settings.collate_into_buffers`) samples are stacked directly into reusable
+    pinned/shared memory buffers (see `BatchBufferPool`) and array values of the returned batch are torch tensors.
+    """
+    if into_buffers is None:
+        into_buffers = settings.collate_into_buffers
+
+    return partial(collate_and_batch_transform, transform=batch_transformation, into_buffers=into_buffers)
 
 
 def separate(batch: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy
+from tqdm import tqdm
+
+import hylfm.datasets.filters
+from hylfm import settings
+from hylfm.datasets.sample_summary import SampleSummary
+
+if typing.TYPE_CHECKING:
+    from hylfm.datasets import N5CachedDatasetFromInfo
+
+logger = logging.getLogger(__name__)
+
+NOT_EVALUATED = -1
+
+Filters = Sequence[Tuple[str, Dict[str, Any]]]
+
+
+def evaluate_filters(dataset: N5CachedDatasetFromInfo, idx: int, filters: Filters) -> bool:
+    """evaluate all filters on sample `idx`, loading it at most once"""
+    sample = None
+    for name, kwargs in filters:
+        if sample is None and name not in hylfm.datasets.filters.SAMPLE_FREE_FILTERS:
+            sample = dataset[idx]
+
+        if not getattr(hylfm.datasets.filters, name)(dataset=dataset, idx=idx, sample=sample, **kwargs):
+            return False
+
+    return True
+
+
+def can_use_summary(filters: Filters) -> bool:
+    """all filters can be evaluated (exactly, unless approximation is allowed) on the per sample summary table"""
+    if not settings.filters_on_summary:
+        return False
+
+    for name, kwargs in filters:
+        if not hasattr(hylfm.datasets.filters, f"{name}_on_summary"):
+            return False
+
+        if not settings.approximate_summary_filters and not all(
+            SampleSummary.is_exact(kwargs[k]) for k in hylfm.datasets.filters.SUMMARY_PERCENTILE_KWARGS.get(name, ())
+        ):
+            return False
+
+    return True
+
+
+def evaluate_filters_on_summary(dataset: N5CachedDatasetFromInfo, indices: numpy.ndarray, filters: Filters):
+    passed = numpy.ones(len(indices), dtype=bool)
+    for name, kwargs in filters:
+        passed &= getattr(hylfm.datasets.filters, f"{name}_on_summary")(dataset=dataset, indices=indices, **kwargs)
+
+    return passed
+
+
+def open_progress(path: Path, length: int) -> numpy.memmap:
+    if path.exists():
+        progress = numpy.lib.format.open_memmap(str(path), mode="r+")
+        if progress.shape == (length,):
+            return progress
+
+        logger.warning("discarding filter progress %s with unexpected shape %s", path, progress.shape)
+        del progress
+
+    progress = numpy.lib.format.open_memmap(str(path), mode="w+", dtype=numpy.int8, shape=(length,))
+    progress[:] = NOT_EVALUATED
+    progress.flush()
+    return progress
+
+
+def get_process_pool(max_workers: int, initializer: Callable[..., None], initargs: tuple) -> ProcessPoolExecutor:
+    """process pool (started with `settings.multiprocessing_start_method`) for per sample evaluations"""
+    mp_context = multiprocessing.get_context(settings.multiprocessing_start_method or None)
+    return ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=mp_context, initializer=initializer, initargs=initargs
+    )
+
+
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(dataset: N5CachedDatasetFromInfo, filters: Filters, progress_path: str) -> None:
+    _worker_state["dataset"] = dataset
+    _worker_state["filters"] = filters
+    _worker_state["progress"] = numpy.lib.format.open_memmap(progress_path, mode="r+")
+
+
+def _evaluate_in_worker(indices: numpy.ndarray) -> int:
+    dataset = _worker_state["dataset"]
+    filters = _worker_state["filters"]
+    progress = _worker_state["progress"]
+    for idx in indices:
+        # results go directly to the file backed progress array, shared with the main process
+        progress[idx] = evaluate_filters(dataset, int(idx), filters)
+
+    progress.flush()
+    return len(indices)
+
+
+def compute_filter_mask(
+    dataset: N5CachedDatasetFromInfo,
+    indices: Sequence[int],
+    filters: Filters,
+    progress_path: Path,
+    max_workers: Optional[int] = None,
+    chunk_size: int = 64,
+) -> numpy.ndarray:
+    """boolean mask of `indices` passing all `filters`.
+
+    If possible, filters are evaluated vectorized on the per sample summary table (see `can_use_summary`).
+    Results are written incrementally to `progress_path`, such that an interrupted run resumes where it left off.
+    The progress file is removed once the mask is complete.
+    """
+    max_workers = settings.max_workers_for_filters if max_workers is None else max_workers
+    n = len(dataset)
+    if not filters:
+        mask = numpy.zeros(n, dtype=bool)
+        mask[numpy.asarray(indices, dtype=int)] = True
+        return mask
+
+    indices = numpy.asarray(indices, dtype=int)
+    if can_use_summary(filters):
+        mask = numpy.zeros(n, dtype=bool)
+        mask[indices] = evaluate_filters_on_summary(dataset, indices, filters)
+        return mask
+
+    progress = open_progress(progress_path, n)
+    todo = indices[progress[indices] == NOT_EVALUATED]
+    if len(todo) < len(indices):
+        logger.warning("resuming filters with %d/%d indices left (%s)", len(todo), len(indices), progress_path)
+
+    chunks = [todo[i : i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    if max_workers and len(chunks) > 1:
+        progress.flush()
+        with get_process_pool(max_workers, _init_worker, (dataset, filters, str(progress_path))) as executor:
+            futs = [executor.submit(_evaluate_in_worker, chunk) for chunk in chunks]
+            for fut in tqdm(as_completed(futs), total=len(futs)):
+                fut.result()
+
+        # reopen to see the workers' results
+        del progress
+        progress = numpy.lib.format.open_memmap(str(progress_path), mode="r")
+    else:
+        for chunk in tqdm(chunks):
+            for idx in chunk:
+                progress[idx] = evaluate_filters(dataset, int(idx), filters)
+
+            progress.flush()
+
+    mask = numpy.zeros(n, dtype=bool)
+    mask[indices] = progress[indices] == 1
+    assert not (progress[indices] == NOT_EVALUATED).any()
+    del progress
+    progress_path.unlink()
+    return mask
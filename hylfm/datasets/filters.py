@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import typing
 import warnings
+from typing import Optional, Sequence, Tuple
 
 import numpy
 
@@ -10,12 +11,11 @@ from hylfm.transforms.affine_utils import get_ls_roi
 if typing.TYPE_CHECKING:
     from hylfm.datasets import N5CachedDatasetFromInfo
 
+# filters that do not need to load the sample
+SAMPLE_FREE_FILTERS = ("z_range",)
 
-def z_range(dataset: N5CachedDatasetFromInfo, idx: int, *, z_min: int = None, z_max: int = None) -> bool:
-    z_slice = dataset.dataset.get_z_slice(idx)
-    if z_slice is None:
-        return True
 
+def get_z_min_max(dataset: N5CachedDatasetFromInfo, z_min: Optional[int], z_max: Optional[int]) -> Tuple[int, int]:
     if z_min is None:
         assert z_max is None
         crop_name = dataset.dataset.info.meta["crop_name"]
@@ -32,6 +32,17 @@ def z_range(dataset: N5CachedDatasetFromInfo, idx: int, *, z_min: int = None, z_
     else:
         assert z_max is not None, "z_max is missing"
 
+    return z_min, z_max
+
+
+def z_range(
+    dataset: N5CachedDatasetFromInfo, idx: int, *, sample: Optional[dict] = None, z_min: int = None, z_max: int = None
+) -> bool:
+    z_slice = dataset.dataset.get_z_slice(idx)
+    if z_slice is None:
+        return True
+
+    z_min, z_max = get_z_min_max(dataset, z_min, z_max)
     return z_min <= z_slice < z_max
 
 
@@ -39,6 +50,7 @@ def instensity_range(
     dataset: N5CachedDatasetFromInfo,
     idx: int,
     *,
+    sample: Optional[dict] = None,
     apply_to: typing.Union[str, typing.Sequence[str]],
     min_below: typing.Optional[float] = None,
     max_above: typing.Optional[float] = None,
@@ -47,7 +59,9 @@ def instensity_range(
     if isinstance(apply_to, str):
         apply_to = [apply_to]
 
-    sample = dataset[idx]
+    if sample is None:
+        sample = dataset[idx]
+
     for name, tensor in sample.items():
         if name in apply_to:
             if min_below is not None and tensor.min() > min_below:
@@ -63,6 +77,7 @@ def signal2noise(
     dataset: N5CachedDatasetFromInfo,
     idx: int,
     *,
+    sample: Optional[dict] = None,
     apply_to: typing.Union[str, typing.Sequence[str]],
     signal_percentile: float,
     noise_percentile: float,
@@ -71,7 +86,9 @@ def signal2noise(
     if isinstance(apply_to, str):
         apply_to = [apply_to]
 
-    sample = dataset[idx]
+    if sample is None:
+        sample = dataset[idx]
+
     for name, tensor in sample.items():
         if name in apply_to:
             signal = numpy.percentile(tensor, signal_percentile)
@@ -84,3 +101,76 @@ def signal2noise(
                 return False
 
     return True
+
+
+# vectorized filters evaluated on the per sample summary table (see `SampleSummary`)
+# percentile kwargs are only exact for percentiles in `SUMMARY_PERCENTILES`
+SUMMARY_PERCENTILE_KWARGS = {"signal2noise": ("signal_percentile", "noise_percentile")}
+
+
+def _applies_to(dataset: N5CachedDatasetFromInfo, apply_to: typing.Union[str, typing.Sequence[str]]) -> bool:
+    if isinstance(apply_to, str):
+        apply_to = [apply_to]
+
+    return dataset.dataset.tensor_name in apply_to
+
+
+def z_range_on_summary(
+    dataset: N5CachedDatasetFromInfo, indices: Sequence[int], *, z_min: int = None, z_max: int = None
+) -> numpy.ndarray:
+    # z_slice does not depend on the data, no need to compute the summary table
+    z_slices = [dataset.dataset.get_z_slice(idx) for idx in indices]
+    if all(z is None for z in z_slices):
+        return numpy.ones(len(indices), dtype=bool)
+
+    z_min, z_max = get_z_min_max(dataset, z_min, z_max)
+    return numpy.array([z is None or z_min <= z < z_max for z in z_slices], dtype=bool)
+
+
+def instensity_range_on_summary(
+    dataset: N5CachedDatasetFromInfo,
+    indices: Sequence[int],
+    *,
+    apply_to: typing.Union[str, typing.Sequence[str]],
+    min_below: typing.Optional[float] = None,
+    max_above: typing.Optional[float] = None,
+) -> numpy.ndarray:
+    assert min_below is not None or max_above is not None, "What's the point?"
+    ret = numpy.ones(len(indices), dtype=bool)
+    if not _applies_to(dataset, apply_to):
+        return ret
+
+    phys_indices = numpy.asarray(indices, dtype=int) // dataset.repeat
+    summary = dataset.summary
+    summary.compute(phys_indices)
+    if min_below is not None:
+        ret &= summary["min"][phys_indices] <= min_below
+
+    if max_above is not None:
+        ret &= summary["max"][phys_indices] >= max_above
+
+    return ret
+
+
+def signal2noise_on_summary(
+    dataset: N5CachedDatasetFromInfo,
+    indices: Sequence[int],
+    *,
+    apply_to: typing.Union[str, typing.Sequence[str]],
+    signal_percentile: float,
+    noise_percentile: float,
+    ratio: float,
+) -> numpy.ndarray:
+    if not _applies_to(dataset, apply_to):
+        return numpy.ones(len(indices), dtype=bool)
+
+    phys_indices = numpy.asarray(indices, dtype=int) // dataset.repeat
+    summary = dataset.summary
+    summary.compute(phys_indices)
+    signal = summary.get_percentiles(phys_indices, signal_percentile)
+    noise = summary.get_percentiles(phys_indices, noise_percentile)
+    if not noise.all():
+        warnings.warn(f"encountered noise=0 for {(noise == 0).sum()} samples")
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return (noise != 0) & (signal / noise >= ratio)
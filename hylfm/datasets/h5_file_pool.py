@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import h5py
+import numpy
+
+from hylfm import settings
+
+logger = logging.getLogger(__name__)
+
+
+class H5FilePool:
+    """LRU pool of open, read-only h5py files.
+
+    Handles are bound to the process that opened them. After a fork (or when unpickled in a spawned DataLoader
+    worker) the pool starts out empty and files are reopened on first access.
+    """
+
+    def __init__(self, max_open_files: Optional[int] = None):
+        self.max_open_files = settings.max_open_h5_files if max_open_files is None else max_open_files
+        assert self.max_open_files > 0, self.max_open_files
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._files: "OrderedDict[Path, h5py.File]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        return {"max_open_files": self.max_open_files}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.max_open_files = state["max_open_files"]
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # inherited handles must not be used (or closed) in a forked child
+            self.lock = threading.RLock()
+            self._reset()
+
+    def get_file(self, path: Union[str, Path]) -> h5py.File:
+        """get an open file handle; hold `self.lock` while using the returned handle"""
+        self._check_pid()
+        path = Path(path)
+        with self.lock:
+            hf = self._files.get(path)
+            if hf is None or not hf.id.valid:
+                self.misses += 1
+                hf = h5py.File(path, mode="r")
+                self._files[path] = hf
+                while len(self._files) > self.max_open_files:
+                    _, evicted = self._files.popitem(last=False)
+                    evicted.close()
+            else:
+                self.hits += 1
+                self._files.move_to_end(path)
+
+            return hf
+
+    def read(self, path: Union[str, Path], within: str, selection: Any = slice(None)) -> numpy.ndarray:
+        self._check_pid()
+        with self.lock:
+            return self.get_file(path)[within][selection]
+
+    def close_all(self):
+        with self.lock:
+            if self._pid == os.getpid():
+                for hf in self._files.values():
+                    hf.close()
+
+            self._reset()
+
+    @property
+    def open_files(self) -> int:
+        return len(self._files)
+
+    def get_stats(self) -> Dict[str, Union[int, float]]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else float("nan"),
+            "open_files": self.open_files,
+        }
+
+
+_pool: Optional[H5FilePool] = None
+
+
+def get_h5_file_pool() -> H5FilePool:
+    """get the pool of the current process"""
+    global _pool
+    if _pool is None:
+        _pool = H5FilePool()
+
+    return _pool
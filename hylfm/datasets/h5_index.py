@@ -0,0 +1,160 @@
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha224 as hash_algorithm
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import h5py
+
+from hylfm import settings
+from hylfm.datasets.h5_file_pool import get_h5_file_pool
+
+logger = logging.getLogger(__name__)
+
+
+def scan_h5_file(path: Path, within_pattern: str, use_pool: bool = True) -> List[Dict[str, Any]]:
+    """find all h5 datasets in `path` whose name matches `within_pattern`"""
+    found = []
+
+    def ds_resolver(name: str, obj):
+        if isinstance(obj, h5py.Dataset) and re.match(within_pattern, name):
+            found.append({"name": name, "shape": list(obj.shape), "dtype": str(obj.dtype)})
+
+    if use_pool:
+        pool = get_h5_file_pool()
+        with pool.lock:
+            pool.get_file(path)["/"].visititems(ds_resolver)
+    else:
+        with h5py.File(path, mode="r") as hf:
+            hf["/"].visititems(ds_resolver)
+
+    return sorted(found, key=lambda ds: ds["name"])
+
+
+def _scan_h5_file_for_index(path: str, within_pattern: str):
+    # executed in a separate process; do not pollute its file pool
+    return scan_h5_file(Path(path), within_pattern, use_pool=False)
+
+
+class H5Index:
+    """persisted mapping of h5 files to their matching internal datasets (name, shape, dtype).
+
+    Entries are keyed by file path and invalidated if a file's mtime or size changes. Files are resolved lazily;
+    `resolve_many` scans all unresolved files in parallel (cold start).
+    """
+
+    version = 1
+
+    def __init__(self, file_path_glob: Path, within_pattern: str, autosave_every: int = 64):
+        self.within_pattern = within_pattern
+        self.autosave_every = autosave_every
+        description = f"{file_path_glob.as_posix()}\n{within_pattern}\nv{self.version}"
+        self.path = settings.cache_dir / f"h5_index_{hash_algorithm(description.encode()).hexdigest()}.json"
+        self.entries: Dict[str, Dict[str, Any]] = self._load()
+        self._unsaved = 0
+        self._lock = threading.RLock()  # files are resolved from concurrent cache fill threads
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+
+        try:
+            with self.path.open() as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("could not load h5 index %s: %s", self.path, e)
+            return {}
+
+    def save(self):
+        with self._lock:
+            if not self._unsaved:
+                return
+
+            # merge with entries saved by other processes in the meantime
+            entries = self._load()
+            entries.update(self.entries)
+            self.entries = entries
+            with tempfile.NamedTemporaryFile(
+                "w", dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp", delete=False
+            ) as f:
+                try:
+                    json.dump(entries, f)
+                except BaseException:
+                    os.unlink(f.name)
+                    raise
+
+            os.replace(f.name, self.path)
+            self._unsaved = 0
+
+    @staticmethod
+    def _file_key(path: Path) -> Dict[str, int]:
+        stat = path.stat()
+        return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    def _get_valid_entry(self, path: Path) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.entries.get(path.as_posix())
+
+        if entry is None or entry["key"] != self._file_key(path):
+            return None
+
+        return entry
+
+    def _add(self, path: Path, datasets: List[Dict[str, Any]]):
+        with self._lock:
+            self.entries[path.as_posix()] = {"key": self._file_key(path), "datasets": datasets}
+            self._unsaved += 1
+            if self._unsaved >= self.autosave_every:
+                self.save()
+
+    def resolve(self, path: Path) -> List[Dict[str, Any]]:
+        entry = self._get_valid_entry(path)
+        if entry is None:
+            datasets = scan_h5_file(path, self.within_pattern)
+            self._add(path, datasets)
+            return datasets
+
+        return entry["datasets"]
+
+    def resolve_many(self, paths: Sequence[Path]) -> List[List[Dict[str, Any]]]:
+        missing = [p for p in paths if self._get_valid_entry(p) is None]
+        if missing:
+            logger.info("scanning %d/%d h5 files for %s", len(missing), len(paths), self.within_pattern)
+            max_workers = min(settings.max_workers_for_h5_index, len(missing))
+            if max_workers > 1:
+                mp_context = multiprocessing.get_context(settings.multiprocessing_start_method or None)
+                with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as executor:
+                    all_datasets = list(
+                        executor.map(
+                            _scan_h5_file_for_index,
+                            [p.as_posix() for p in missing],
+                            [self.within_pattern] * len(missing),
+                            chunksize=max(1, len(missing) // (4 * max_workers)),
+                        )
+                    )
+            else:
+                all_datasets = [scan_h5_file(p, self.within_pattern) for p in missing]
+
+            with self._lock:
+                for p, datasets in zip(missing, all_datasets):
+                    self._add(p, datasets)
+
+                self.save()
+
+        with self._lock:
+            return [self.entries[p.as_posix()]["datasets"] for p in paths]
@@ -0,0 +1,134 @@
+"""DataLoader configuration: persistent, prefetching workers with per worker seeding and optional cpu pinning.
+
+Batches may be collated into a ring of shared memory buffers in the workers (see `BatchBufferPool`), which are
+handed to the trainer without another copy.
+"""
+import logging
+import os
+import random
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy
+import torch
+import torch.utils.data
+
+from hylfm import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_cpus(worker_id: int, num_workers: int, cpus: List[int]) -> List[int]:
+    """disjoint subset of `cpus` for each worker (shared round robin if there are more workers than cpus)"""
+    return cpus[worker_id::num_workers] or [cpus[worker_id % len(cpus)]]
+
+
+def seed_worker(worker_id: int) -> None:
+    """DataLoader worker_init_fn: seeds numpy's and python's global random state (used e.g. by RandomlyFlipAxis and
+    RandomRotate90) from the worker's torch seed, which torch derives from the main process' random state per worker.
+    Generators of random transforms are created lazily in each worker from these (see `get_process_seed`)."""
+    seed = torch.initial_seed() % 2 ** 32
+    numpy.random.seed(seed)
+    random.seed(seed)
+
+    worker_info = torch.utils.data.get_worker_info()
+    if settings.pin_worker_cpus and hasattr(os, "sched_setaffinity") and worker_info is not None:
+        cpus = sorted(os.sched_getaffinity(0))
+        worker_cpus = get_worker_cpus(worker_id, worker_info.num_workers, cpus)
+        os.sched_setaffinity(0, worker_cpus)
+        logger.debug("pinned DataLoader worker %s to cpus %s", worker_id, worker_cpus)
+
+
+@dataclass
+class DataLoaderConfig:
+    num_workers: int
+    pin_memory: bool
+    persistent_workers: bool
+    prefetch_factor: int
+    into_buffers: bool
+
+    @classmethod
+    def from_settings(cls, dataset_part: str, persistent_workers: bool = False) -> "DataLoaderConfig":
+        """`persistent_workers` overwrites `settings.persistent_workers` if True"""
+        return cls(
+            num_workers=settings.num_workers_data_loader[dataset_part],
+            pin_memory=settings.pin_memory,
+            persistent_workers=persistent_workers or settings.persistent_workers,
+            prefetch_factor=settings.prefetch_factor,
+            into_buffers=settings.collate_into_buffers,
+        )
+
+    def __post_init__(self):
+        if self.prefetch_factor < 1:
+            raise ValueError(f"prefetch_factor should be a positive integer, but got {self.prefetch_factor}")
+
+        # batches of one worker in flight: prefetched + in use by the trainer + pending non-blocking copy
+        in_flight = (self.prefetch_factor if self.num_workers else 1) + 2
+        if self.into_buffers and settings.batch_buffer_ring_size <= in_flight:
+            raise ValueError(
+                f"batch_buffer_ring_size={settings.batch_buffer_ring_size} has to exceed the {in_flight} batches in "
+                f"flight per process with prefetch_factor={self.prefetch_factor}"
+            )
+
+    def get_dataloader_kwargs(self) -> Dict[str, Any]:
+        kwargs = {"num_workers": self.num_workers, "pin_memory": self.pin_memory}
+        if self.num_workers:
+            kwargs.update(
+                persistent_workers=self.persistent_workers,
+                prefetch_factor=self.prefetch_factor,
+                worker_init_fn=seed_worker,
+            )
+
+        return kwargs
+
+
+class DataWaitMonitor:
+    """measures how long a consumer waits for the next batch vs. how long it processes a batch to tell whether a run
+    is input-bound or compute-bound"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+        self.batches = 0
+
+    def reset(self) -> None:
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+        self.batches = 0
+
+    def __call__(self, batches: Iterable) -> Iterator:
+        start = perf_counter()
+        for batch in batches:
+            received = perf_counter()
+            self.wait_time += received - start
+            self.batches += 1
+            yield batch
+            start = perf_counter()
+            self.compute_time += start - received
+
+    @property
+    def wait_fraction(self) -> float:
+        total = self.wait_time + self.compute_time
+        return self.wait_time / total if total else 0.0
+
+    @property
+    def input_bound(self) -> bool:
+        return self.wait_fraction > settings.input_bound_threshold
+
+    def report(self) -> Dict[str, Any]:
+        report = {
+            f"{self.name}_data_wait_fraction": self.wait_fraction,
+            f"{self.name}_data_wait_per_batch": self.wait_time / max(1, self.batches),
+            f"{self.name}_compute_per_batch": self.compute_time / max(1, self.batches),
+        }
+        logger.info(
+            "%s is %s: waited for data %.1f%% of the time (%.3fs per batch, %.3fs compute per batch)",
+            self.name,
+            "input-bound" if self.input_bound else "compute-bound",
+            100 * self.wait_fraction,
+            report[f"{self.name}_data_wait_per_batch"],
+            report[f"{self.name}_compute_per_batch"],
+        )
+        return report
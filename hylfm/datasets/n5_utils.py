@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+import numpy
+import z5py
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_COMPRESSIONS = (None, "raw", "gzip", "lz4", "zstd")
+FILL_MARKERS_NAME = "hylfm_filled"
+
+
+class FillMarkers:
+    """per sample completion markers of a cached N5 dataset: one byte per sample in a file next to its chunks.
+
+    A marker is set only after all chunks of its sample are written, so samples of an interrupted fill are filled
+    again. `lock` serializes filling a sample across processes (within a process the cached dataset does not submit
+    a sample twice).
+    """
+
+    def __init__(self, path: Path, n: int):
+        self.path = path
+        self.n = n
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+
+    @classmethod
+    def of(cls, dataset_path: Path, n: int) -> "FillMarkers":
+        return cls(dataset_path / FILL_MARKERS_NAME, n)
+
+    @property
+    def fd(self) -> int:
+        if self._fd is None or self._pid != os.getpid():
+            # forked processes open their own file descriptor; record locks are not inherited anyway
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            if os.fstat(fd).st_size < self.n:
+                os.ftruncate(fd, self.n)
+
+            self._fd, self._pid = fd, os.getpid()
+
+        return self._fd
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_fd"] = None
+        state["_pid"] = None
+        return state
+
+    def close(self) -> None:
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+
+        self._fd = None
+
+    def is_set(self, idx: int) -> bool:
+        return os.pread(self.fd, 1, idx) == b"\x01"
+
+    def set(self, idx: int) -> None:
+        os.pwrite(self.fd, b"\x01", idx)
+
+    @contextmanager
+    def lock(self, idx: int) -> Iterator[None]:
+        """exclusive lock on sample `idx` (only within this process where fcntl is not available)"""
+        if fcntl is None:
+            yield
+            return
+
+        fd = self.fd
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, idx, os.SEEK_SET)
+        try:
+            yield
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, idx, os.SEEK_SET)
+
+
+def get_z5_compression_kwargs(compression: Optional[str], compression_opts: Dict[str, Any]) -> Dict[str, Any]:
+    """map a cache compression name to z5py `create_dataset` kwargs; `None` uses the z5py default"""
+    if compression is None:
+        assert not compression_opts, compression_opts
+        return {}
+    elif compression in ("raw", "gzip"):
+        return {"compression": compression, **compression_opts}
+    elif compression in ("lz4", "zstd"):
+        return {"compression": "blosc", "codec": compression, **compression_opts}
+    else:
+        raise NotImplementedError(compression)
+
+
+def read_z5_compression_kwargs(dataset_path: Path) -> Dict[str, Any]:
+    """z5py `create_dataset` kwargs reproducing the compression of the existing N5 dataset at `dataset_path`"""
+    attributes = json.loads((dataset_path / "attributes.json").read_text())
+    compression = attributes.get("compression", {"type": attributes.get("compressionType", "raw")})
+    kind = compression["type"]
+    if kind == "raw":
+        return {"compression": "raw"}
+    elif kind in ("gzip", "bzip2", "xz"):
+        kwargs = {"compression": kind}
+        if "level" in compression:
+            kwargs["level"] = compression["level"]
+
+        if compression.get("useZlib"):
+            kwargs["use_zlib"] = True
+
+        return kwargs
+    elif kind == "blosc":
+        kwargs = {"compression": "blosc", "codec": compression.get("cname", "lz4")}
+        for n5_key, z5_key in (("clevel", "level"), ("shuffle", "shuffle")):
+            if n5_key in compression:
+                kwargs[z5_key] = compression[n5_key]
+
+        return kwargs
+    else:
+        raise NotImplementedError(kind)
+
+
+def migrate_n5_cache(
+    path: Path,
+    *,
+    chunks: Optional[Sequence[int]] = None,
+    compression: Optional[str] = None,
+    compression_opts: Optional[Dict[str, Any]] = None,
+    dtype: Optional[str] = None,
+) -> None:
+    """rewrite a cached N5 tensor store with new chunks/compression/dtype.
+
+    Chunks, compression and dtype that are not given are kept from the existing store.
+    Only completely cached samples are copied (caches written before fill markers existed are judged by their
+    chunks). The new store is written next to the old one and swapped in once complete.
+    """
+    compression_opts = compression_opts or {}
+    tmp_path = path.with_suffix(".n5.migrating")
+    if tmp_path.exists():
+        logger.warning("removing incomplete migration %s", tmp_path)
+        shutil.rmtree(tmp_path)
+
+    old_file = z5py.File(path=str(path), mode="r", use_zarr_format=False)
+    new_file = z5py.File(path=str(tmp_path), mode="w", use_zarr_format=False)
+    for tensor_name in old_file.keys():
+        old = old_file[tensor_name]
+        source_dtype = old.attrs.get("source_dtype", str(old.dtype))
+        new_chunks = old.chunks if chunks is None else tuple(chunks)
+        assert new_chunks[0] == 1, "cache chunks may not span multiple samples"
+        assert len(new_chunks) == len(old.shape), (new_chunks, old.shape)
+        new = new_file.create_dataset(
+            tensor_name,
+            shape=old.shape,
+            chunks=new_chunks,
+            dtype=dtype or old.dtype,
+            **(
+                read_z5_compression_kwargs(path / tensor_name)
+                if compression is None
+                else get_z5_compression_kwargs(compression, compression_opts)
+            ),
+        )
+        new.attrs["source_dtype"] = source_dtype
+
+        old_markers = (
+            FillMarkers.of(path / tensor_name, old.shape[0])
+            if (path / tensor_name / FILL_MARKERS_NAME).exists()
+            else None
+        )
+        new_markers = FillMarkers.of(tmp_path / tensor_name, old.shape[0])
+        chunk_grid = tuple(-(-s // c) for s, c in zip(old.shape[1:], old.chunks[1:]))
+        copied = 0
+        for idx in range(old.shape[0]):
+            if (
+                old_markers.is_set(idx)
+                if old_markers is not None
+                else all(old.chunk_exists((idx,) + c) for c in numpy.ndindex(*chunk_grid))
+            ):
+                new[idx : idx + 1] = old[idx : idx + 1].astype(new.dtype, copy=False)
+                new_markers.set(idx)
+                copied += 1
+
+        for markers in (old_markers, new_markers):
+            if markers is not None:
+                markers.close()
+
+        logger.info("migrated %d/%d samples of %s in %s", copied, old.shape[0], tensor_name, path)
+
+    old_path = path.with_suffix(".n5.old")
+    path.rename(old_path)
+    tmp_path.rename(path)
+    shutil.rmtree(old_path)
@@ -1,6 +1,6 @@
 import collections
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
 import torch.utils.data
@@ -60,6 +60,23 @@ def get_dataset_subsection(
     )
 
 
+COMBINED_DATASETS = {
+    DatasetChoice.heart_static_mix1_sliced: [
+        DatasetChoice.heart_static_fish2_sliced,
+        DatasetChoice.heart_2020_02_fish2_static,
+    ],
+    DatasetChoice.heart_static_mix2_sliced: [
+        DatasetChoice.heart_static_fish2_sliced,
+        DatasetChoice.heart_2020_02_fish2_static,
+        DatasetChoice.heart_2020_02_fish1_static,
+    ],
+    DatasetChoice.heart_static_mix3_sliced: [
+        DatasetChoice.heart_static_fish5_sliced,
+        DatasetChoice.heart_2020_02_fish1_static_sliced,
+    ],
+}
+
+
 def get_dataset(
     name: DatasetChoice,
     part: DatasetPart,
@@ -75,22 +92,7 @@ def get_dataset(
     # subsections are grouped together to form mini-batches, thus their size needs to match
     sections: List[List[torch.utils.data.Dataset]] = []
 
-    combined_datasets = {
-        DatasetChoice.heart_static_mix1_sliced: [
-            DatasetChoice.heart_static_fish2_sliced,
-            DatasetChoice.heart_2020_02_fish2_static,
-        ],
-        DatasetChoice.heart_static_mix2_sliced: [
-            DatasetChoice.heart_static_fish2_sliced,
-            DatasetChoice.heart_2020_02_fish2_static,
-            DatasetChoice.heart_2020_02_fish1_static,
-        ],
-        DatasetChoice.heart_static_mix3_sliced: [
-            DatasetChoice.heart_static_fish5_sliced,
-            DatasetChoice.heart_2020_02_fish1_static_sliced,
-        ],
-    }
-    for subname in combined_datasets.get(name, [name]):
+    for subname in COMBINED_DATASETS.get(name, [name]):
         transforms_pipeline = get_transforms_pipeline(
             dataset_name=name,
             dataset_part=part,
@@ -108,8 +110,13 @@ def get_dataset(
 
 
 def get_dataset_sections(
-    name: DatasetChoice, part: DatasetPart, transforms_pipeline: TransformsPipeline, load_lfd_and_care: bool
+    name: DatasetChoice,
+    part: DatasetPart,
+    transforms_pipeline: TransformsPipeline,
+    load_lfd_and_care: bool,
+    get_subsection: Callable[..., Any] = get_dataset_subsection,
 ):
+    """get_subsection may be replaced to defer creating (most) subsections, e.g. to create them in parallel"""
     sliced = name.value.endswith("_sliced") and part == DatasetPart.train
 
     # sections will not be sampled across, which allows differentely sized images in the same dataset
@@ -119,7 +126,7 @@ def get_dataset_sections(
     if name == DatasetChoice.beads_sample0:
         sections.append(
             [
-                get_dataset_subsection(
+                get_subsection(
                     tensors={
                         "lf": "local.beads.b01highc_0",
                         "ls_reg": "local.beads.b01highc_0",
@@ -144,7 +151,7 @@ def get_dataset_sections(
 
         sections.append(
             [
-                get_dataset_subsection(
+                get_subsection(
                     tensors=tensors,
                     filters=[],
                     indices=None,
@@ -170,7 +177,7 @@ def get_dataset_sections(
         sections.append([])
         for tag in ["2019-12-08_06.35.52"]:  # fish5
             sections[-1].append(
-                get_dataset_subsection(
+                get_subsection(
                     tensors=get_tensors(tag),
                     filters=[],
                     indices=indices,
@@ -211,7 +218,7 @@ def get_dataset_sections(
         sections.append([])
         for tag in tags[part]:
             sections[-1].append(
-                get_dataset_subsection(
+                get_subsection(
                     tensors=get_tensors(tag),
                     filters=filters,
                     indices=None,
@@ -255,7 +262,7 @@ def get_dataset_sections(
                 "2019-12-10_06.25.14",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=filters,
                         indices=None,
@@ -275,7 +282,7 @@ def get_dataset_sections(
                 "2019-12-09_02.54.46",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=filters,
                         indices=None,
@@ -299,7 +306,7 @@ def get_dataset_sections(
                 "2019-12-08_06.30.40",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=filters,
                         indices=slice(idx_first_vol, None, None),
@@ -324,7 +331,7 @@ def get_dataset_sections(
                 "2019-12-08_06.30.40",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=filters,
                         indices=[0],
@@ -355,7 +362,7 @@ def get_dataset_sections(
                 # "2019-12-09_07.50.24",  # no lr or bad quality
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=filters,
                         indices=None,
@@ -385,7 +392,7 @@ def get_dataset_sections(
                 "2019-12-09_02.54.46",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=slice(1, None, None),
@@ -411,7 +418,7 @@ def get_dataset_sections(
                 "2019-12-09_07.50.24",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=slice(1, None, None),
@@ -430,7 +437,7 @@ def get_dataset_sections(
                 "2019-12-10_06.25.14",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=slice(1, None, None),
@@ -451,7 +458,7 @@ def get_dataset_sections(
                 "2019-12-09_02.54.46",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=[0],
@@ -477,7 +484,7 @@ def get_dataset_sections(
                 "2019-12-09_07.50.24",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=[0],
@@ -496,7 +503,7 @@ def get_dataset_sections(
                 "2019-12-10_06.25.14",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=[0],
@@ -521,7 +528,7 @@ def get_dataset_sections(
                 "2019-12-08_06.30.40",
             ]:
                 sections[-1].append(
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=get_tensors(tag),
                         filters=[],
                         indices=None,
@@ -686,7 +693,7 @@ def get_dataset_sections(
         if name in [DatasetChoice.heart_dyn_refine, DatasetChoice.heart_dyn_test]:
             sections.append(
                 [
-                    get_dataset_subsection(
+                    get_subsection(
                         tensors=tensors,
                         filters=filters,
                         indices=indices,
@@ -800,7 +807,7 @@ def get_dataset_sections(
 
         sections.append(
             [
-                get_dataset_subsection(
+                get_subsection(
                     tensors=get_tensors(tag),
                     filters=filters,
                     indices=indices,
@@ -828,7 +835,7 @@ def get_dataset_sections(
 
         sections.append(
             [
-                get_dataset_subsection(
+                get_subsection(
                     tensors=tensors,
                     filters=filters,
                     indices=indices,
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import logging
+import os
+import typing
+from concurrent.futures import as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+from tqdm import tqdm
+
+from hylfm import settings
+from hylfm.stat_ import iter_prefetching
+
+if typing.TYPE_CHECKING:
+    from hylfm.datasets import N5CachedDatasetFromInfo
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PERCENTILES = numpy.array([0.0, 0.1, 1.0, 5.0, 10.0, 25.0, 50.0, 75.0, 90.0, 95.0, 99.0, 99.5, 99.9, 100.0])
+
+
+def summarize_sample(dataset: N5CachedDatasetFromInfo, idx: int) -> Tuple[int, numpy.ndarray, float, int]:
+    """percentiles, mean and z_slice (-1 if None) of physical sample `idx`"""
+    tensor = dataset[idx * dataset.repeat][dataset.dataset.tensor_name]
+    z_slice = dataset.dataset.get_z_slice(idx)
+    return (
+        idx,
+        numpy.percentile(tensor, SUMMARY_PERCENTILES),
+        float(numpy.mean(tensor, dtype=numpy.float64)),
+        -1 if z_slice is None else z_slice,
+    )
+
+
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(dataset: N5CachedDatasetFromInfo) -> None:
+    _worker_state["dataset"] = dataset
+
+
+def _summarize_in_worker(indices: numpy.ndarray) -> List[Tuple[int, numpy.ndarray, float, int]]:
+    return [summarize_sample(_worker_state["dataset"], int(idx)) for idx in indices]
+
+
+class SampleSummary:
+    """persistent table of per sample min, max, mean, percentiles (on a fixed grid) and z_slice of a cached tensor.
+
+    Rows are only valid where `computed`; `compute` summarizes the samples that are needed.
+    """
+
+    def __init__(self, path: Path, dataset: N5CachedDatasetFromInfo, save_every: int = 256, chunk_size: int = 64):
+        assert path.suffix == ".npz", path
+        self.path = path
+        self.dataset = dataset
+        self.save_every = save_every
+        self.chunk_size = chunk_size
+        n = len(dataset.dataset)  # physical samples, without repeat
+        if path.exists():
+            with numpy.load(str(path)) as npz:
+                data = {k: npz[k] for k in npz.files}
+
+            if data["computed"].shape != (n,) or not numpy.array_equal(data["percentile_levels"], SUMMARY_PERCENTILES):
+                logger.warning("discarding outdated sample summary %s", path)
+                data = None
+        else:
+            data = None
+
+        if data is None:
+            data = {
+                "computed": numpy.zeros(n, dtype=bool),
+                "min": numpy.full(n, numpy.nan),
+                "max": numpy.full(n, numpy.nan),
+                "mean": numpy.full(n, numpy.nan),
+                "percentiles": numpy.full((n, len(SUMMARY_PERCENTILES)), numpy.nan),
+                "percentile_levels": SUMMARY_PERCENTILES,
+                "z_slice": numpy.full(n, -1, dtype=numpy.int64),
+            }
+
+        self.data = data
+
+    def __getitem__(self, key: str) -> numpy.ndarray:
+        return self.data[key]
+
+    def compute(self, indices: Optional[Sequence[int]] = None, max_workers: Optional[int] = None) -> None:
+        """summarize missing samples of physical `indices` (default: all), in a process pool of `max_workers`
+        (default: `settings.max_workers_for_filters`) like per sample filter evaluation"""
+        max_workers = settings.max_workers_for_filters if max_workers is None else max_workers
+        if indices is None:
+            todo = numpy.flatnonzero(~self.data["computed"])
+        else:
+            indices = numpy.unique(numpy.asarray(indices, dtype=int))
+            todo = indices[~self.data["computed"][indices]]
+
+        if not len(todo):
+            return
+
+        logger.info("summarize %d/%d samples of %s", len(todo), len(self.data["computed"]), self.path)
+        chunks = [todo[i : i + self.chunk_size] for i in range(0, len(todo), self.chunk_size)]
+        unsaved = 0
+        if max_workers and len(chunks) > 1:
+            from hylfm.datasets.filter_engine import get_process_pool
+
+            with get_process_pool(max_workers, _init_worker, (self.dataset,)) as executor:
+                futs = [executor.submit(_summarize_in_worker, chunk) for chunk in chunks]
+                for fut in tqdm(as_completed(futs), total=len(futs)):
+                    unsaved += self.add(fut.result())
+                    if unsaved >= self.save_every:
+                        self.save()
+                        unsaved = 0
+        else:
+            # let the cached dataset fill its cache a bounded window ahead
+            for idx in tqdm(iter_prefetching(self.dataset, todo * self.dataset.repeat), total=len(todo)):
+                unsaved += self.add([summarize_sample(self.dataset, idx // self.dataset.repeat)])
+                if unsaved >= self.save_every:
+                    self.save()
+                    unsaved = 0
+
+        if unsaved:
+            self.save()
+
+    def add(self, rows: List[Tuple[int, numpy.ndarray, float, int]]) -> int:
+        for idx, percentiles, mean, z_slice in rows:
+            self.data["percentiles"][idx] = percentiles
+            self.data["min"][idx] = percentiles[0]
+            self.data["max"][idx] = percentiles[-1]
+            self.data["mean"][idx] = mean
+            self.data["z_slice"][idx] = z_slice
+            self.data["computed"][idx] = True
+
+        return len(rows)
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp.npz")
+        numpy.savez(str(tmp_path), **self.data)
+        os.replace(tmp_path, self.path)
+
+    def get_percentiles(self, indices: Sequence[int], percentile: float) -> numpy.ndarray:
+        """per sample percentile, linearly interpolated between the summarized percentile levels"""
+        table = self.data["percentiles"][numpy.asarray(indices, dtype=int)]
+        j = numpy.searchsorted(SUMMARY_PERCENTILES, percentile, side="right") - 1
+        j = int(numpy.clip(j, 0, len(SUMMARY_PERCENTILES) - 2))
+        lower, upper = SUMMARY_PERCENTILES[j], SUMMARY_PERCENTILES[j + 1]
+        weight = (percentile - lower) / (upper - lower)
+        return table[:, j] * (1 - weight) + table[:, j + 1] * weight
+
+    @staticmethod
+    def is_exact(percentile: float) -> bool:
+        return bool(numpy.isin(percentile, SUMMARY_PERCENTILES))
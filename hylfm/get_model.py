@@ -9,6 +9,7 @@ import torch
 import typer
 
 from hylfm.model import HyLFM_Net
+from hylfm.utils.distributed import get_device, is_distributed
 
 app = typer.Typer()
 
@@ -122,7 +123,7 @@ def get_model(
         c33_3d,
         c34_3d,
     ]
-    if torch.cuda.device_count() > 1:
+    if torch.cuda.device_count() > 1 and not is_distributed():
         raise RuntimeError(f"Set CUDA_VISIBLE_DEVICES!")
 
     model = HyLFM_Net(
@@ -137,5 +138,5 @@ def get_model(
         init_fn=init_fn,
         final_activation=final_activation,
     )
-    model = model.cuda()
+    model = model.to(get_device())  # this process' device in distributed mode
     return model
@@ -129,6 +129,12 @@ class PeriodUnit(str, Enum):
     iteration = "iteration"
 
 
+class PrecisionChoice(str, Enum):
+    fp32 = "fp32"
+    fp16 = "fp16"  # autocast to float16 with gradient scaling (cuda)
+    bf16 = "bf16"  # autocast to bfloat16 (cuda and cpu)
+
+
 @dataclass
 class TransformsPipeline:
     sample_precache_trf: Optional[List[Dict[str, Dict[str, Any]]]]
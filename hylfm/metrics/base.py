@@ -8,6 +8,7 @@ import torch.nn
 from torch import no_grad
 
 from hylfm.hylfm_types import Array
+from hylfm.utils.distributed import all_gather_object
 
 logger = logging.getLogger(__name__)
 
@@ -77,15 +78,88 @@ class Metric:
     def compute(self) -> Dict[str, Any]:
         raise NotImplementedError
 
+    def reduce_across_ranks(self) -> None:
+        """combine the accumulated state of all ranks (in distributed mode), such that `compute` covers all samples"""
+        raise NotImplementedError(self)
+
+
+def as_tensor(value: Array) -> torch.Tensor:
+    return torch.from_numpy(value) if isinstance(value, numpy.ndarray) else value
+
+
+def mean_per_sample(pixelwise: torch.Tensor) -> torch.Tensor:
+    return pixelwise.reshape(pixelwise.shape[0], -1).mean(1)
+
 
 class SimpleSingleValueMetric(Metric):
-    _accumulated: Optional[Union[float, numpy.ndarray]]
+    """metric with a single value per sample (or per sample and plane `along_dim`), averaged over samples.
+
+    Subclasses that implement `get_batch_values` are evaluated for all samples (and planes) of a batch at once, and
+    accumulate on the batch's device.
+    """
+
+    _accumulated: Optional[Union[float, numpy.ndarray, torch.Tensor]]
     _n: int
 
     def reset(self):
         self._accumulated = None
         self._n = 0
 
+    @property
+    def batched(self) -> bool:
+        return type(self).get_batch_values is not SimpleSingleValueMetric.get_batch_values
+
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        """values of shape (N,) for N samples (= the value of each sample with a leading singleton dimension)"""
+        raise NotImplementedError
+
+    def _accumulate(self, value: Union[float, numpy.ndarray, torch.Tensor], n: int) -> None:
+        if self._accumulated is None:
+            self._accumulated = value
+        elif isinstance(self._accumulated, torch.Tensor) or isinstance(value, torch.Tensor):
+            device = (self._accumulated if isinstance(self._accumulated, torch.Tensor) else value).device
+            accumulated = torch.as_tensor(self._accumulated, dtype=torch.float64, device=device)
+            self._accumulated = accumulated + torch.as_tensor(value, dtype=torch.float64, device=device)
+        else:
+            self._accumulated = self._accumulated + value
+
+        self._n += n
+
+    @no_grad()
+    def update_with_batch_on_device(self, prediction: Array, target: Array) -> torch.Tensor:
+        """accumulate a batch and return its values of shape (B,) or (B, dim_len) `along_dim` (on the batch's device)"""
+        prediction = as_tensor(prediction)
+        target = as_tensor(target)
+        batch_len = prediction.shape[0]
+        if self.along_dim is None:
+            values = self.get_batch_values(prediction, target)
+        else:
+            # evaluate each plane along dim as a sample
+            prediction = prediction.movedim(1 + self.along_dim, 1)
+            target = target.movedim(1 + self.along_dim, 1)
+            dim_len = target.shape[1]
+            values = self.get_batch_values(
+                prediction.reshape(batch_len * dim_len, *prediction.shape[2:]),
+                target.reshape(batch_len * dim_len, *target.shape[2:]),
+            ).reshape(batch_len, dim_len)
+
+        self._accumulate(values.sum(0, dtype=torch.float64), batch_len)
+        return values
+
+    def update_with_batch(self, prediction: Array, target: Array) -> Dict[str, Any]:
+        if not self.batched:
+            return super().update_with_batch(prediction=prediction, target=target)
+
+        values = self.update_with_batch_on_device(prediction, target)
+        return {self.name: self.values_to_list(values.cpu().numpy())}
+
+    def values_to_list(self, values: numpy.ndarray) -> list:
+        """per sample values of a batch as returned by `update_with_sample`"""
+        if self.along_dim is None:
+            return [float(v) for v in values]
+        else:
+            return list(values.astype(numpy.float32))
+
     @no_grad()
     def update_with_sample(self, prediction: Array, target: Array) -> Dict[str, Any]:
         if self.along_dim is None:
@@ -95,9 +169,6 @@ class SimpleSingleValueMetric(Metric):
 
         else:
             dim_len = target.shape[self.along_dim]
-            if self._accumulated is None:
-                self._accumulated = numpy.zeros(dim_len, dtype=numpy.float32)
-
             value = numpy.empty(dim_len, dtype=numpy.float32)
             for d in range(dim_len):
                 slice_tuple = (slice(None),) * self.along_dim + (d,)
@@ -107,16 +178,30 @@ class SimpleSingleValueMetric(Metric):
 
                 value[d] = val
 
-        self._n += 1
-        if self._accumulated is None:
-            self._accumulated = value
-        else:
-            self._accumulated += value
-
+        self._accumulate(value, 1)
         return {self.name: value}
 
     def compute(self) -> Dict[str, Any]:
-        return {self.name: self._accumulated / self._n}
+        accumulated = self._accumulated
+        if isinstance(accumulated, torch.Tensor):
+            accumulated = accumulated.cpu().numpy()  # the only host transfer of batched accumulation
+            if self.along_dim is None:
+                accumulated = accumulated.item()
+            else:
+                accumulated = accumulated.astype(numpy.float32)
+
+        return {self.name: accumulated / self._n}
+
+    def reduce_across_ranks(self) -> None:
+        accumulated = self._accumulated
+        if isinstance(accumulated, torch.Tensor):
+            accumulated = accumulated.cpu()
+
+        # gathered as objects: a rank without samples does not know the shape of `_accumulated`
+        gathered = [(acc, n) for acc, n in all_gather_object((accumulated, self._n)) if n]
+        self.reset()
+        for acc, n in gathered:
+            self._accumulate(acc, n)
 
 
 class MetricGroup(Metric):
@@ -129,9 +214,29 @@ class MetricGroup(Metric):
             metric.reset()
 
     def update_with_batch(self, **batch: Any) -> Dict[str, Any]:
-        res = {}
+        # batched metrics stay on the device, their values are transferred to the host together
+        on_device = {}
+        results = []
         for metric in self.metrics:
-            for key, val in metric.update_with_batch(**batch).items():
+            if isinstance(metric, SimpleSingleValueMetric) and metric.batched:
+                on_device[metric] = metric.update_with_batch_on_device(**batch)
+                results.append(metric)
+            else:
+                results.append(metric.update_with_batch(**batch))
+
+        if on_device:
+            flat = torch.cat([v.reshape(-1).to(torch.float64) for v in on_device.values()]).cpu().numpy()
+            start = 0
+            for metric, values in on_device.items():
+                on_device[metric] = flat[start : start + values.numel()].reshape(values.shape)
+                start += values.numel()
+
+        res = {}
+        for r in results:
+            if isinstance(r, SimpleSingleValueMetric):
+                r = {r.name: r.values_to_list(on_device[r])}
+
+            for key, val in r.items():
                 assert key not in res, key
                 assert isinstance(val, list), key
                 res[key] = val
@@ -141,6 +246,10 @@ class MetricGroup(Metric):
     def update_with_sample(self, **sample: Any) -> None:
         raise NotImplementedError
 
+    def reduce_across_ranks(self) -> None:
+        for metric in self.metrics:
+            metric.reduce_across_ranks()
+
     def compute(self) -> Dict[str, Any]:
         res = {}
         for metric in self.metrics:
@@ -5,6 +5,7 @@ from typing import Any, DefaultDict, Dict, List, Optional, Tuple, Union
 import numpy
 
 from hylfm.detect_beads import match_beads
+from hylfm.utils.distributed import all_gather_object
 from .base import Metric
 
 logger = logging.getLogger(__name__)
@@ -108,6 +109,17 @@ class BeadPrecisionRecall(Metric):
     def compute(self) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
         return self._compute(self.found_missing_extra, self.found_missing_extra_alongdim)
 
+    def reduce_across_ranks(self) -> None:
+        alongdim = {dim: dict(fme_per_p) for dim, fme_per_p in self.found_missing_extra_alongdim.items()}
+        gathered = all_gather_object((self.found_missing_extra, alongdim, self.max_shape))
+        self.reset()
+        for fme, fme_alongdim, max_shape in gathered:
+            self.found_missing_extra += fme
+            self.max_shape = numpy.maximum(self.max_shape, max_shape)
+            for dim, fme_per_p in fme_alongdim.items():
+                for p, fme_pp in fme_per_p.items():
+                    self.found_missing_extra_alongdim[dim][p] += fme_pp
+
     def _compute(self, found_missing_extra, found_missing_extra_alongdim):
         ret = {
             "bead_precision": self.get_precision(found_missing_extra),
@@ -1,24 +1,43 @@
+import torch.nn.functional
+
 from hylfm import criteria
-from hylfm.metrics.base import SimpleSingleValueMetric
+from hylfm.metrics.base import SimpleSingleValueMetric, mean_per_sample
 
 
 class L1(SimpleSingleValueMetric, criteria.L1):
-    pass
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        return mean_per_sample(torch.nn.functional.l1_loss(prediction, target, reduction="none"))
 
 
 class MSE(SimpleSingleValueMetric, criteria.MSE):
-    pass
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        return mean_per_sample(torch.nn.functional.mse_loss(prediction, target, reduction="none"))
 
 
 class SmoothL1(SimpleSingleValueMetric, criteria.SmoothL1):
-    pass
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        return mean_per_sample(
+            torch.nn.functional.smooth_l1_loss(prediction, target, reduction="none", beta=self.beta)
+        )
+
+
+class NoSizeAverage:
+    """(MS-)SSIM per sample instead of averaged over the batch"""
+
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        size_average = self.size_average
+        self.size_average = False
+        try:
+            return self(prediction, target)
+        finally:
+            self.size_average = size_average
 
 
-class SSIM(SimpleSingleValueMetric, criteria.SSIM):
+class SSIM(NoSizeAverage, SimpleSingleValueMetric, criteria.SSIM):
     pass
 
 
-class MS_SSIM(SimpleSingleValueMetric, criteria.MS_SSIM):
+class MS_SSIM(NoSizeAverage, SimpleSingleValueMetric, criteria.MS_SSIM):
     pass
 
 
@@ -8,7 +8,8 @@ from torch import no_grad
 
 from hylfm.hylfm_types import Array
 from hylfm.metrics import Metric
-from hylfm.metrics.base import SimpleSingleValueMetric
+from hylfm.metrics.base import SimpleSingleValueMetric, mean_per_sample
+from hylfm.utils.distributed import all_gather_object
 
 try:
     from typing import Literal
@@ -47,6 +48,13 @@ class NRMSE_SkImage(Metric):
         tgt = torch.stack(self.tgts).numpy()
         return {self.name: nrmse_skimage(pred, tgt, norm_type=self.norm_type)}
 
+    def reduce_across_ranks(self) -> None:
+        gathered = all_gather_object((self.preds, self.tgts))
+        self.reset()
+        for preds, tgts in gathered:
+            self.preds += preds
+            self.tgts += tgts
+
 
 class NRMSE(SimpleSingleValueMetric):
     """
@@ -58,3 +66,7 @@ class NRMSE(SimpleSingleValueMetric):
         prediction = torch.from_numpy(prediction) if isinstance(prediction, numpy.ndarray) else prediction
         target = torch.from_numpy(target) if isinstance(target, numpy.ndarray) else target
         return torch.sqrt(torch.nn.functional.mse_loss(prediction, target) / torch.mean(target ** 2)).item()
+
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        mse = mean_per_sample(torch.nn.functional.mse_loss(prediction, target, reduction="none"))
+        return torch.sqrt(mse / mean_per_sample(target ** 2))
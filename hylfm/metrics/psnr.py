@@ -4,6 +4,7 @@ import numpy
 import torch.nn.functional
 
 from hylfm.metrics import SimpleSingleValueMetric
+from hylfm.metrics.base import mean_per_sample
 
 
 # class PSNR_SkImage(Metric):
@@ -53,3 +54,7 @@ class PSNR(SimpleSingleValueMetric):
             )
             / n
         )
+
+    def get_batch_values(self, prediction: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+        mse = mean_per_sample(torch.nn.functional.mse_loss(prediction, target, reduction="none"))
+        return self.log10dr20 - 10 * torch.log10(mse)
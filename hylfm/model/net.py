@@ -10,6 +10,7 @@ except ImportError:
     from typing_extensions import Literal
 
 
+import torch
 import torch.nn as nn
 
 from hylfm.model.conv_layers import Conv2D, ResnetBlock, ValidConv3D
@@ -152,9 +153,25 @@ class HyLFM_Net(nn.Module):
         else:
             raise NotImplementedError(final_activation)
 
+        self.channels_last = False
+
+    def set_channels_last(self, channels_last: bool = True) -> "HyLFM_Net":
+        """use channels last memory format for the 2d part (res2d and conv2d)"""
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.res2d.to(memory_format=memory_format)
+        self.conv2d.to(memory_format=memory_format)
+        self.channels_last = channels_last
+        return self
+
     def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+
         x = self.res2d(x)
         x = self.conv2d(x)
+        if self.channels_last:
+            x = x.contiguous()  # c2z is a view of the default (contiguous) memory format
+
         x = self.c2z(x)
         x = self.res3d(x)
         x = self.conv3d(x)
@@ -16,7 +16,7 @@ from hylfm.hylfm_types import (
     OptimizerChoice,
     PeriodUnit,
 )
-from hylfm.train import train_from_checkpoint
+from hylfm.train import init_wandb_run, train_from_checkpoint
 
 app = typer.Typer()
 logger = logging.getLogger(__name__)
@@ -133,13 +133,9 @@ def resume(
     config = checkpoint.config.as_dict(for_logging=False)
     config["resumed_from"] = checkpoint.training_run_name
 
-    import wandb
-
-    wandb_run = wandb.init(
+    wandb_run, checkpoint.training_run_name, checkpoint.training_run_id = init_wandb_run(
         project="HyLFM-train", dir=str(settings.cache_dir), config=config, resume="allow", notes=note
     )
-    checkpoint.training_run_name = wandb_run.name
-    checkpoint.training_run_id = wandb_run.id
 
     train_from_checkpoint(wandb_run, checkpoint)
 
@@ -1,7 +1,7 @@
 import logging
 import os
 import warnings
-from typing import Any, Dict, Iterable, Optional
+from typing import Any, Dict, Iterable, Iterator, Optional
 
 import torch
 from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
@@ -9,13 +9,15 @@ from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
 from hylfm import __version__, metrics, settings
 from hylfm.checkpoint import RunConfig
 from hylfm.datasets import get_collate
+from hylfm.datasets.loading import DataLoaderConfig, DataWaitMonitor
 from hylfm.datasets.named import get_dataset
 from hylfm.hylfm_types import DatasetPart, TransformsPipeline
 from hylfm.metrics.base import MetricGroup
 from hylfm.model import HyLFM_Net
 from hylfm.run.run_logger import WandbLogger
-from hylfm.sampler import NoCrossBatchSampler
+from hylfm.sampler import BlockShuffleSampler, NoCrossBatchSampler
 from hylfm.transform_pipelines import get_transforms_pipeline
+from hylfm.utils.distributed import get_device, main_process_first
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +26,7 @@ class Run:
     name: str
 
     load_lfd_and_care: bool = False
+    persistent_workers: bool = False  # keep dataloader workers alive across iterations over the dataloader
 
     def __init__(
         self,
@@ -73,7 +76,7 @@ class Run:
             scale = model.get_scale()
             shrink = model.get_shrink()
             if torch.cuda.is_available():
-                self.model = self.model.cuda(0)
+                self.model = self.model.to(get_device())  # this process' device in distributed mode
 
         self.scale = scale
         self.shrink = shrink
@@ -88,21 +91,36 @@ class Run:
         if spatial_dims_overwrite is not None:
             self.transforms_pipeline.spatial_dims = int(spatial_dims_overwrite)  # todo: remove gorilla patch
 
-        self.dataset = self.get_dataset()
+        with main_process_first():  # other ranks reuse the caches, stats and masks computed by rank 0
+            self.dataset = self.get_dataset()
 
+        if self.dataset_part != DatasetPart.train:
+            sampler_class = SequentialSampler
+        elif settings.sampler_block_size:
+            sampler_class = BlockShuffleSampler
+        else:
+            sampler_class = RandomSampler
+
+        self.dataloader_config = DataLoaderConfig.from_settings(
+            dataset_part.name, persistent_workers=self.persistent_workers
+        )
         self.dataloader: DataLoader = DataLoader(
             dataset=self.dataset,
             batch_sampler=NoCrossBatchSampler(
                 self.dataset,
-                sampler_class=RandomSampler if self.dataset_part == DatasetPart.train else SequentialSampler,
+                sampler_class=sampler_class,
                 batch_sizes=[cfg.batch_size if self.dataset_part == DatasetPart.train else cfg.batch_size]
                 * len(self.dataset.cumulative_sizes),
                 drop_last=self.dataset_part == DatasetPart.train,
             ),
-            collate_fn=get_collate(batch_transformation=self.transforms_pipeline.batch_preprocessing),
-            num_workers=settings.num_workers_data_loader[dataset_part.name],
-            pin_memory=settings.pin_memory,
+            collate_fn=get_collate(
+                batch_transformation=self.transforms_pipeline.batch_preprocessing,
+                into_buffers=self.dataloader_config.into_buffers,
+            ),
+            **self.dataloader_config.get_dataloader_kwargs(),
         )
+        self._prefetched_batches: Optional[Iterator] = None
+        self.data_wait_monitor = DataWaitMonitor(f"{name}_{dataset_part.name}")
         self.epoch_len = len(self.dataloader)
         assert self.epoch_len
         assert self.epoch_len < 100000 or not self.save_output_to_disk
@@ -212,6 +230,22 @@ class Run:
         else:
             raise NotImplementedError(self.dataset_part)
 
+    def prefetch(self) -> None:
+        """let the dataloader workers start loading the first batches of the next iteration over the dataloader"""
+        if self._prefetched_batches is None:
+            self._prefetched_batches = iter(self.dataloader)
+
+    def iter_dataloader(self) -> Iterator:
+        """iterate over the dataloader (prefetched batches first) and report the time spent waiting for batches"""
+        if self._prefetched_batches is None:
+            batches = iter(self.dataloader)
+        else:
+            batches, self._prefetched_batches = self._prefetched_batches, None
+
+        self.data_wait_monitor.reset()
+        yield from self.data_wait_monitor(batches)
+        self.run_logger.update_summary(**self.data_wait_monitor.report())
+
     def __iter__(self):
         for batch in self._run():
             yield batch
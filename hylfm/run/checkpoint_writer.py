@@ -0,0 +1,102 @@
+import logging
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Optional, Tuple
+
+from hylfm import settings
+from hylfm.checkpoint import Checkpoint
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointWriter:
+    """writes checkpoints in a background thread.
+
+    State is snapshotted to the cpu on `submit`, such that training can continue while the checkpoint is serialized.
+    Checkpoints are written atomically (see `Checkpoint.save`). The `keep_best` most recent best checkpoints are kept,
+    older ones are only deleted after the new best checkpoint is durable. Checkpoints submitted with `keep_anyway` are
+    never deleted.
+    """
+
+    def __init__(self, keep_best: Optional[int] = None, asynchronous: Optional[bool] = None):
+        self.keep_best = settings.keep_best_checkpoints if keep_best is None else keep_best
+        if self.keep_best < 1:
+            raise ValueError(f"keep_best should be a positive integer, but got {self.keep_best}")
+
+        self.asynchronous = settings.write_checkpoints_async if asynchronous is None else asynchronous
+        self.best_on_disk: Deque[Tuple[Path, bool]] = deque()  # (path, deletable)
+        self._error: Optional[BaseException] = None
+        # at most one snapshot waits to be written, to bound host memory
+        self._queue: "queue.Queue[Optional[Tuple[Checkpoint, bool, bool]]]" = queue.Queue(maxsize=1)
+        if self.asynchronous:
+            self._thread: Optional[threading.Thread] = threading.Thread(
+                target=self._work, name="CheckpointWriter", daemon=True
+            )
+            self._thread.start()
+        else:
+            self._thread = None
+
+    def submit(self, checkpoint: Checkpoint, *, best: bool, keep_anyway: bool) -> Path:
+        """schedule writing `checkpoint`, returns its (future) path"""
+        self._raise_error()
+        snapshot = checkpoint.snapshot()
+        if self._thread is None:
+            self._write(snapshot, best, keep_anyway)
+        else:
+            self._queue.put((snapshot, best, keep_anyway))
+
+        return snapshot.path
+
+    def flush(self) -> None:
+        """wait for all submitted checkpoints to be written"""
+        if self._thread is not None:
+            self._queue.join()
+
+        self._raise_error()
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("failed to write checkpoint") from error
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+
+                if self._error is None:
+                    self._write(*item)
+            except BaseException as e:
+                logger.exception("failed to write checkpoint")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, checkpoint: Checkpoint, best: bool, keep_anyway: bool) -> None:
+        path = checkpoint.save(best=best)
+        logger.debug("saved checkpoint %s", path)
+        if not best:
+            return
+
+        self.best_on_disk.append((path, not keep_anyway))
+        while len(self.best_on_disk) > self.keep_best:
+            old_path, deletable = self.best_on_disk.popleft()
+            if not deletable:
+                continue
+
+            try:
+                old_path.unlink()
+            except Exception as e:
+                logger.warning("Could not remove old best checkpoint %s, due to %s", old_path, e)
@@ -1,4 +1,5 @@
 import collections
+import logging
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, Dict, Iterable, Optional
@@ -18,14 +19,19 @@ from hylfm.checkpoint import (
 )
 from hylfm.datasets import ConcatDataset, TensorInfo, ZipDataset, get_dataset_from_info
 from hylfm.get_model import get_model
-from hylfm.hylfm_types import DatasetChoice, DatasetPart, MetricChoice
+from hylfm.hylfm_types import DatasetChoice, DatasetPart, MetricChoice, PrecisionChoice
 from hylfm.model import HyLFM_Net
+from hylfm.utils.distributed import is_distributed
 from hylfm.utils.for_log import get_max_projection_img
 from hylfm.utils.io import save_pandas_df, save_tensor
+from hylfm.utils.precision import autocast
 from .base import Run
 from .run_logger import WandbLogger, WandbValidationLogger
 from ..datasets.named import get_dataset
 from ..transform_pipelines import get_transforms_pipeline
+from ..transforms.affine_resample import get_affine_grid_cache
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -47,6 +53,7 @@ class EvalRun(Run):
         run_logger: WandbLogger,
         scale: Optional[int] = None,
         shrink: Optional[int] = None,
+        precision: PrecisionChoice = PrecisionChoice.fp32,
     ):
         super().__init__(
             config=config,
@@ -58,6 +65,7 @@ class EvalRun(Run):
             shrink=shrink,
         )
         self.log_level_wandb = log_level_wandb
+        self.precision = precision
 
     @staticmethod
     def progress_tqdm(iterable, desc: str, total: int):
@@ -65,7 +73,10 @@ class EvalRun(Run):
 
     @no_grad()
     def get_pred(self, batch) -> dict:
-        return self.model(batch["lfc"])
+        with autocast(self.precision, batch["lfc"].device):
+            pred = self.model(batch["lfc"])
+
+        return pred.float()
 
     @no_grad()
     def _run(self) -> Iterable[EvalYield]:
@@ -83,7 +94,7 @@ class EvalRun(Run):
                 file_path = root / f"{sample_idx + batch_idx:05}.tif"
                 save_tensor(file_path, tensor)
 
-        for it, batch in self.progress_tqdm(enumerate(self.dataloader), desc=self.name, total=self.epoch_len):
+        for it, batch in self.progress_tqdm(enumerate(self.iter_dataloader()), desc=self.name, total=self.epoch_len):
             assert "epoch" not in batch
             batch["epoch"] = 0
             assert "iteration" not in batch
@@ -160,7 +171,11 @@ class EvalRun(Run):
             sample_idx += batch["batch_len"]
             yield EvalYield(batch=batch, step_metrics=step_metrics)
 
+        if is_distributed():
+            self.metric_group.reduce_across_ranks()
+
         summary_metrics = self.metric_group.compute()
+        logger.info("affine grid cache: %s", get_affine_grid_cache().stats())
         if "metrics" in self.save_output_to_disk:
             df = pandas.DataFrame.from_dict(tab_data_per_step)
             df_path = self.save_output_to_disk["metrics"]
@@ -174,7 +189,17 @@ class EvalRun(Run):
 
 
 class ValidationRun(EvalRun):
-    def __init__(self, *, config: ValidationRunConfig, model: HyLFM_Net, score_metric: MetricChoice, name: str):
+    persistent_workers = True  # validation iterates repeatedly over the same data
+
+    def __init__(
+        self,
+        *,
+        config: ValidationRunConfig,
+        model: HyLFM_Net,
+        score_metric: MetricChoice,
+        name: str,
+        precision: PrecisionChoice = PrecisionChoice.fp32,
+    ):
         scale = model.get_scale()
         self.minimize = getattr(hylfm.metrics, score_metric.replace("-", "_")).minimize
         super().__init__(
@@ -189,6 +214,7 @@ class ValidationRun(EvalRun):
                 score_metric=score_metric,
                 minimize=self.minimize,
             ),
+            precision=precision,
         )
         self.score_metric = score_metric
 
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import collections
 import logging
-from typing import Any, Callable, Dict, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
 
 import matplotlib.cm
 import numpy
@@ -52,6 +52,9 @@ class RunLogger:
     def log_summary(self, *, step: int, **metrics):
         raise NotImplementedError
 
+    def update_summary(self, **summary):
+        raise NotImplementedError
+
 
 class WandbLogger(RunLogger):
     def __init__(self, *, point_cloud_threshold: float, zyx_scaling: Tuple[float, float, float], **super_kwargs):
@@ -219,9 +222,21 @@ class WandbLogger(RunLogger):
         wandb.log(final_log, step=step)
         wandb.summary.update(summary)
 
+    def update_summary(self, **summary):
+        wandb.summary.update(summary)
+
 
 class WandbValidationLogger(WandbLogger):
-    def __init__(self, *, score_metric: MetricChoice, minimize: bool, step: int = 0, **super_kwargs):
+    """logs validation summaries at the (training) step the validated model was trained to.
+
+    If `deferred` (asynchronous validation), nothing is logged from the validation thread: wandb drops logs at steps
+    below its current step, so summaries are kept until `flush` logs them from the training thread at the current
+    training step. Validation metrics are plotted against 'val_step', the step of the validated model.
+    """
+
+    def __init__(
+        self, *, score_metric: MetricChoice, minimize: bool, step: int = 0, deferred: bool = False, **super_kwargs
+    ):
         super().__init__(
             **super_kwargs, step=step
         )  # no optional step, overwrite with training step to log validation at correct step
@@ -229,6 +244,9 @@ class WandbValidationLogger(WandbLogger):
         self.minimize = minimize
         self.best_score = None
         self.val_it = 0
+        self.deferred = deferred
+        self.pending: Deque[Callable[[int], None]] = collections.deque()  # called with the step to log at
+        self._defined_val_step = False
 
     def log_metrics(self, *, step: int, **metrics):
         # don't log metrics per step when validating
@@ -239,8 +257,32 @@ class WandbValidationLogger(WandbLogger):
             step = self.step
 
         self.val_it += 1
+        val_it = self.val_it
+        if self.deferred:
+            self.pending.append(lambda log_step: self._log_summary(log_step, val_step=step, val_it=val_it, **metrics))
+        else:
+            self._log_summary(step, val_step=step, val_it=val_it, **metrics)
+
+    def update_summary(self, **summary):
+        if self.deferred:
+            self.pending.append(lambda log_step: wandb.summary.update(summary))
+        else:
+            super().update_summary(**summary)
+
+    def flush(self, step: int) -> None:
+        """log deferred validation summaries (from the thread owning the wandb run) at the current `step`"""
+        while self.pending:
+            self.pending.popleft()(step)
+
+    def _log_summary(self, step: int, *, val_step: int, val_it: int, **metrics):
+        if not self._defined_val_step:
+            wandb.define_metric("val_step")
+            wandb.define_metric("val_*", step_metric="val_step")
+            self._defined_val_step = True
+
         final_log, summary = self._get_final_log_and_summary(metrics)
-        final_log["it"] = self.val_it
+        final_log["it"] = val_it
+        final_log["step"] = val_step
 
         final_log.update(summary)
         metrics = {"val_" + k: v for k, v in final_log.items()}
@@ -252,5 +294,5 @@ class WandbValidationLogger(WandbLogger):
 
         if self.best_score is None or self.best_score < score:
             self.best_score = score
-            summary["it"] = self.val_it
+            summary["it"] = val_it
             wandb.summary.update({"val_" + k: v for k, v in summary.items()})
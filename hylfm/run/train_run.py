@@ -1,20 +1,25 @@
 import logging
-from pathlib import Path
-from typing import Any, Dict, Iterable, Optional, Type
+from contextlib import nullcontext
+from typing import Any, Dict, Iterable, List, Optional, Type
 
 import torch.utils.data
 from tqdm import tqdm
 
 import hylfm.metrics
+from hylfm import settings
 from hylfm.checkpoint import Checkpoint, TrainRunConfig, ValidationRunConfig
 from hylfm.get_criterion import get_criterion
 from hylfm.get_model import get_model
 from hylfm.hylfm_types import DatasetPart, LRScheduler, LRSchedulerChoice, Optimizer, OptimizerChoice
 from hylfm.model import HyLFM_Net
+from hylfm.utils.distributed import any_rank, get_device, get_local_rank, is_distributed, is_main_process
 from hylfm.utils.general import Period
+from hylfm.utils.precision import autocast, get_grad_scaler
 from .base import Run
+from .checkpoint_writer import CheckpointWriter
 from .eval_run import ValidationRun
 from .run_logger import WandbLogger
+from .validation_scheduler import ValidationScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +33,11 @@ class TrainRun(Run):
         if checkpoint.model_weights is not None:
             model.load_state_dict(checkpoint.model_weights, strict=True)
 
+        if cfg.channels_last:
+            model.set_channels_last()
+
         self.wandb_run = wandb_run
-        assert wandb_run.name == checkpoint.training_run_name
+        assert wandb_run.name == checkpoint.training_run_name or not is_main_process()  # wandb is disabled on others
         scale = model.get_scale()
         super().__init__(
             config=checkpoint.config,
@@ -41,7 +49,14 @@ class TrainRun(Run):
             ),
         )
 
-        self.current_best_checkpoint_on_disk: Optional[Path] = None
+        self.checkpoint_writer = CheckpointWriter()
+
+        if is_distributed():
+            self.train_model = torch.nn.parallel.DistributedDataParallel(
+                self.model, device_ids=[get_local_rank()] if torch.cuda.is_available() else None
+            )
+        else:
+            self.train_model = self.model
 
         self.criterion = get_criterion(config=self.config, transforms_pipeline=self.transforms_pipeline)
 
@@ -56,6 +71,10 @@ class TrainRun(Run):
         if checkpoint.optimizer_state_dict is not None:
             self.optimizer.load_state_dict(checkpoint.optimizer_state_dict)
 
+        self.grad_scaler = get_grad_scaler(self.config.precision, get_device())
+        if checkpoint.grad_scaler_state_dict is not None and self.grad_scaler.is_enabled():
+            self.grad_scaler.load_state_dict(checkpoint.grad_scaler_state_dict)
+
         if self.config.lr_scheduler is None:
             assert checkpoint.lr_scheduler_state_dict is None
             self.lr_scheduler = None
@@ -93,7 +112,9 @@ class TrainRun(Run):
             model=model,
             score_metric=cfg.score_metric,
             name=self.name,
+            precision=cfg.precision,
         )
+        self.validation_scheduler = ValidationScheduler(self.validator, self.model)
         self.validate_every = Period(cfg.validate_every_value, cfg.validate_every_unit)
         self.epoch_len = len(self.dataloader)
 
@@ -103,6 +124,7 @@ class TrainRun(Run):
         self.iteration = checkpoint.iteration
         self.training_run_id = checkpoint.training_run_id
         self.validation_iteration = checkpoint.validation_iteration
+        self.sampler_state_dict = checkpoint.sampler_state_dict
 
     def get_checkpoint(self):
         return Checkpoint(
@@ -115,55 +137,76 @@ class TrainRun(Run):
             iteration=self.iteration,
             model_weights=self.model.state_dict(),
             optimizer_state_dict=self.optimizer.state_dict(),
+            grad_scaler_state_dict=self.grad_scaler.state_dict() if self.grad_scaler.is_enabled() else None,
             lr_scheduler_state_dict=None if self.lr_scheduler is None else self.lr_scheduler.state_dict(),
+            sampler_state_dict=self.dataloader.batch_sampler.state_dict(position=self.iteration),
             validation_iteration=self.validation_iteration,
         )
 
-    def save_a_checkpoint(self, best: bool, keep_anyway: bool):
-        if not (best or keep_anyway):
+    def save_a_checkpoint(self, best: bool, keep_anyway: bool, checkpoint: Optional[Checkpoint] = None):
+        if not (best or keep_anyway) or not is_main_process():
             return
 
-        if best and self.current_best_checkpoint_on_disk is not None:
-            # remove old best
-            try:
-                self.current_best_checkpoint_on_disk.unlink()
-            except Exception as e:
-                logger.warning(
-                    "Could not remove old best checkpoint %s, due to %s", self.current_best_checkpoint_on_disk, e
-                )
-
-        path = self.get_checkpoint().save(best=best)
+        if checkpoint is None:
+            checkpoint = self.get_checkpoint()
+        else:  # snapshot taken for an asynchronous validation
+            checkpoint.best_validation_score = self.best_validation_score
+            checkpoint.impatience = self.impatience
 
-        # remember current best to delete on finding new best
-        self.current_best_checkpoint_on_disk = None if keep_anyway else path
+        self.checkpoint_writer.submit(checkpoint, best=best, keep_anyway=keep_anyway)
 
     def fit(self):
         for _ in self:
             pass
 
-    def _validate(self, last: bool = False) -> float:
+    def get_step(self) -> int:
+        """training step (in samples) of the current iteration"""
+        return (self.epoch * self.epoch_len + self.iteration) * self.config.batch_size
+
+    def _validate(self, last: bool = False) -> List[float]:
+        """validate (or start an asynchronous validation) and return the validation scores that became available"""
         self.validation_iteration += 1
-        validation_score = self.validator.get_validation_score(
-            step=(self.epoch * self.epoch_len + self.iteration) * self.config.batch_size
+        self.validation_scheduler.submit(
+            step=self.get_step(),
+            validation_iteration=self.validation_iteration,
+            checkpoint=self.get_checkpoint().snapshot() if self.validation_scheduler.asynchronous else None,
         )
         self.model.train()
+        return self._apply_validation_results(last=last)
+
+    def _apply_validation_results(self, last: bool = False, wait: bool = False) -> List[float]:
+        scores = []
+        for result in self.validation_scheduler.poll(step=self.get_step(), wait=last or wait):
+            validation_score = result.score
+            best = self.best_validation_score is None or self.best_validation_score < validation_score
+            val_it_is_power_of_two = result.validation_iteration & (result.validation_iteration - 1) == 0
+
+            if best:
+                self.best_validation_score = validation_score
+                self.impatience = 0
+            else:
+                self.impatience += 1
 
-        best = self.best_validation_score is None or self.best_validation_score < validation_score
-        val_it_is_power_of_two = self.validation_iteration & (self.validation_iteration - 1) == 0
+            keep_anyway = (
+                (last and result.validation_iteration == self.validation_iteration)
+                or val_it_is_power_of_two
+                or result.validation_iteration in self.config.save_after_validation_iterations
+            )
+            if keep_anyway or best:
+                self.save_a_checkpoint(best=best, keep_anyway=keep_anyway, checkpoint=result.checkpoint)
 
-        if best:
-            self.best_validation_score = validation_score
-            self.impatience = 0
-        else:
-            self.impatience += 1
+            scores.append(validation_score)
 
-        keep_anyway = (
-            last or val_it_is_power_of_two or self.validation_iteration in self.config.save_after_validation_iterations
-        )
-        if keep_anyway or best:
-            self.save_a_checkpoint(best=best, keep_anyway=keep_anyway)
+        return scores
+
+    def _validation_is_due_within(self, iterations: int) -> bool:
+        for i in range(self.iteration + 1, self.iteration + 1 + iterations):
+            if self.validate_every.match(
+                epoch=self.epoch + i // self.epoch_len, iteration=i % self.epoch_len, epoch_len=self.epoch_len
+            ):
+                return True
 
-        return validation_score
+        return False
 
     def _step(self, batch: dict):
         ep = self.epoch
@@ -179,25 +222,33 @@ class TrainRun(Run):
         assert "batch_len" in batch
 
         batch = self.transforms_pipeline.batch_preprocessing_in_step(batch)
-        batch["pred"] = self.model(batch["lfc"])
-        batch = self.transforms_pipeline.batch_postprocessing(batch)
-
-        loss = (
-            self.criterion(
-                batch["pred"],
-                batch[self.transforms_pipeline.tgt_name],
-                epoch=ep,
-                iteration=it,
-                epoch_len=self.epoch_len,
+        optimizer_step = (it + 1) % self.config.batch_multiplier == 0
+        # only synchronize gradients across processes before an optimizer step
+        with nullcontext() if optimizer_step or not is_distributed() else self.train_model.no_sync():
+            with autocast(self.config.precision, batch["lfc"].device):
+                pred = self.train_model(batch["lfc"])
+
+            batch["pred"] = pred.float()  # postprocessing, loss and metrics in full precision
+            batch = self.transforms_pipeline.batch_postprocessing(batch)
+
+            loss = (
+                self.criterion(
+                    batch["pred"],
+                    batch[self.transforms_pipeline.tgt_name],
+                    epoch=ep,
+                    iteration=it,
+                    epoch_len=self.epoch_len,
+                )
+                / self.config.batch_multiplier
             )
-            / self.config.batch_multiplier
-        )
-        if not self.criterion.minimize:
-            loss *= -1
+            if not self.criterion.minimize:
+                loss *= -1
+
+            self.grad_scaler.scale(loss).backward()
 
-        loss.backward()
-        if (it + 1) % self.config.batch_multiplier == 0:
-            self.optimizer.step()
+        if optimizer_step:
+            self.grad_scaler.step(self.optimizer)  # equals self.optimizer.step() if gradient scaling is disabled
+            self.grad_scaler.update()
             self.optimizer.zero_grad()
 
         batch = self.transforms_pipeline.batch_premetric_trf(batch)
@@ -213,11 +264,17 @@ class TrainRun(Run):
         opt_param_groups = self.optimizer.state_dict()["param_groups"]
 
         if self.validate_every.match(epoch=ep, iteration=it, epoch_len=self.epoch_len):
-            validation_score = self._validate()
+            validation_scores = self._validate()
+        else:
+            validation_scores = self._apply_validation_results()  # of asynchronous validations
 
-            step_metrics[self.validator.score_metric + "_val-score"] = validation_score
+        if validation_scores:
+            step_metrics[self.validator.score_metric + "_val-score"] = validation_scores[-1]
             if self.lr_scheduler is not None:
-                self.lr_scheduler.step(validation_score)
+                for validation_score in validation_scores:
+                    self.lr_scheduler.step(validation_score)
+        elif self._validation_is_due_within(settings.validation_prefetch_lead):
+            self.validation_scheduler.prefetch()
 
         step_metrics["lr"] = opt_param_groups[0]["lr"]
         step = (ep * self.epoch_len + it) * self.config.batch_size
@@ -232,21 +289,33 @@ class TrainRun(Run):
         zero_max_patience = self.config.zero_max_patience
         zero_max_impatience = 0
 
+        sampler_state = self.sampler_state_dict
         if self.iteration + 1 >= self.epoch_len:
             self.epoch += 1
             self.iteration = 0
+            if sampler_state is not None:
+                sampler_state = dict(sampler_state, position=self.epoch_len)  # start the epoch after
 
-        catch_up_to_iteration = self.iteration
+        if sampler_state is None:
+            catch_up_to_iteration = self.iteration  # checkpoint without sampler state
+            start_iteration = 0
+        else:
+            # fast forward without loading the skipped batches
+            self.dataloader.batch_sampler.load_state_dict(sampler_state)
+            self.sampler_state_dict = None
+            catch_up_to_iteration = 0
+            start_iteration = self.iteration
 
         for epoch in range(self.epoch, self.config.max_epochs):
             self.epoch = epoch
             for it, batch in tqdm(
-                enumerate(self.dataloader),
+                enumerate(self.iter_dataloader(), start=start_iteration),
                 desc=f"{self.name}|ep {epoch + 1:3}/{self.config.max_epochs}",
                 total=self.epoch_len,
+                initial=start_iteration,
             ):
                 if it < catch_up_to_iteration:
-                    # catch up with loaded state  # todo: improve speed by not loading batch data in this case
+                    # catch up with loaded state
                     logger.warning("skipping iteration %s to resume at %s", it, self.iteration)
                     continue
 
@@ -260,7 +329,7 @@ class TrainRun(Run):
                     logger.warning("stopping early after %s non-improving validations", self.impatience)
                     break
 
-                if batch["pred"].max() < zero_max_threshold:
+                if any_rank(bool(batch["pred"].max() < zero_max_threshold)):
                     zero_max_impatience += 1
                     if zero_max_impatience > zero_max_patience:
                         self.iteration += 1
@@ -275,8 +344,18 @@ class TrainRun(Run):
             if stop_early:
                 break
 
-        if not stop_early:
+            catch_up_to_iteration = start_iteration = 0  # only the resumed epoch is partial
+
+        if stop_early:
+            self._apply_validation_results(wait=True)  # of a running asynchronous validation
+        else:
             self._validate(last=True)
 
+        self.validation_scheduler.close()
+
+        if is_distributed():
+            self.metric_group.reduce_across_ranks()
+
         self.run_logger.log_summary(step=self.epoch * self.epoch_len + self.iteration, **self.metric_group.compute())
         self.metric_group.reset()
+        self.checkpoint_writer.close()  # wait for the last checkpoints to be written
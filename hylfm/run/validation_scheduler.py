@@ -0,0 +1,107 @@
+import copy
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Deque, List, Optional
+
+import torch
+
+from hylfm import settings
+from hylfm.checkpoint import Checkpoint
+from hylfm.model import HyLFM_Net
+from hylfm.utils.distributed import is_distributed
+from .eval_run import ValidationRun
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ValidationResult:
+    validation_iteration: int
+    score: float
+    checkpoint: Optional[Checkpoint] = None  # snapshot of the validated training state (asynchronous validation only)
+
+
+class ValidationScheduler:
+    """runs the validations of a training run.
+
+    The validator keeps its dataloader workers alive across validations, and `prefetch` lets them start loading the
+    first validation batches before a validation is due.
+    If `asynchronous`, a snapshot of the model weights is validated in a background thread (on a separate cuda stream)
+    while training continues, and results are returned by `poll` once they are available. At most one validation runs
+    at a time; submitting another one waits for the running validation to finish. The validator's logs are deferred
+    and written by `poll` on the calling (training) thread.
+    """
+
+    def __init__(self, validator: ValidationRun, model: HyLFM_Net, asynchronous: Optional[bool] = None):
+        self.asynchronous = settings.validate_async if asynchronous is None else asynchronous
+        if self.asynchronous and is_distributed():
+            logger.warning("asynchronous validation is not supported in distributed mode, validating synchronously")
+            self.asynchronous = False
+
+        self.validator = validator
+        self.model = model
+        self.results: Deque[ValidationResult] = deque()
+        self.running: Optional[Future] = None
+        if self.asynchronous:
+            self.validator.model = copy.deepcopy(model)  # validated weights are copied into it on submit
+            self.validator.run_logger.deferred = True
+            self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="validation"
+            )
+        else:
+            self._executor = None
+
+    def prefetch(self) -> None:
+        if self.running is None:  # the validator's dataloader is in use otherwise
+            self.validator.prefetch()
+
+    def submit(self, *, step: int, validation_iteration: int, checkpoint: Optional[Checkpoint] = None) -> None:
+        if self._executor is None:
+            score = self.validator.get_validation_score(step=step)
+            self.results.append(ValidationResult(validation_iteration=validation_iteration, score=score))
+            return
+
+        self._wait_for_running()
+        self.validator.model.load_state_dict(self.model.state_dict())
+        if torch.cuda.is_available():
+            stream = torch.cuda.Stream()
+            stream.wait_stream(torch.cuda.current_stream())  # weights are copied on the current stream
+        else:
+            stream = None
+
+        self.running = self._executor.submit(self._validate, step, validation_iteration, checkpoint, stream)
+
+    def _validate(
+        self, step: int, validation_iteration: int, checkpoint: Optional[Checkpoint], stream
+    ) -> ValidationResult:
+        with nullcontext() if stream is None else torch.cuda.stream(stream):
+            score = self.validator.get_validation_score(step=step)
+
+        return ValidationResult(validation_iteration=validation_iteration, score=score, checkpoint=checkpoint)
+
+    def _wait_for_running(self) -> None:
+        if self.running is not None:
+            running, self.running = self.running, None
+            self.results.append(running.result())  # raises exceptions of the validation thread
+
+    def poll(self, *, step: int, wait: bool = False) -> List[ValidationResult]:
+        """results that became available (in order), `wait` for the running validation.
+        Logs of asynchronous validations are written at the current training `step`."""
+        if self.running is not None and (wait or self.running.done()):
+            self._wait_for_running()
+
+        if self.asynchronous:
+            self.validator.run_logger.flush(step)
+
+        results = list(self.results)
+        self.results.clear()
+        return results
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._wait_for_running()
+            self._executor.shutdown()
+            self._executor = None
@@ -1,14 +1,30 @@
+import itertools
 import logging
-from collections import defaultdict
-from typing import DefaultDict, List, Type
+from collections import defaultdict, deque
+from typing import Any, DefaultDict, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Sized, Type
 
 import numpy
 import torch.utils.data.sampler
 from torch.utils.data import ConcatDataset
 
+from hylfm import settings
+from hylfm.utils.distributed import get_rank, get_shared_seed, get_world_size
+
 logger = logging.getLogger(__name__)
 
 
+class BatchIndices(list):
+    """sample indices of a mini-batch, annotated with the `upcoming` batches the sampler yields after it.
+
+    Datasets may use `upcoming` to fill their caches ahead of time in the process that loads the batch (see
+    `hylfm.datasets.base.ConcatDataset.__getitems__`).
+    """
+
+    def __init__(self, indices: Iterable[int] = (), upcoming: Sequence[List[int]] = ()):
+        super().__init__(indices)
+        self.upcoming = list(upcoming)
+
+
 class NoCrossBatchSampler(torch.utils.data.sampler.BatchSampler):
     """Wraps another sampler to yield a mini-batch of indices,
         while never mixing mini batches across datasets of the given (ConcatDataset's) cumulative indices.
@@ -19,6 +35,11 @@ class NoCrossBatchSampler(torch.utils.data.sampler.BatchSampler):
         batch_size (int): Size of mini-batch.
         drop_last (bool): If ``True``, the sampler will drop the last batch if
             its size would be less than ``batch_size``
+        num_replicas (int): Number of processes in distributed training (default: world size).
+            The batches of each dataset are distributed evenly across processes; with ``drop_last`` all processes
+            get the same number of batches.
+        rank (int): Rank of this process (default: current rank).
+        seed (int): Seed for the wrapped sampler, which has to be equal for all processes (default: drawn on rank 0).
 
     """
 
@@ -28,6 +49,9 @@ class NoCrossBatchSampler(torch.utils.data.sampler.BatchSampler):
         sampler_class: Type[torch.utils.data.sampler.Sampler],
         batch_sizes: List[int],
         drop_last: bool,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        seed: Optional[int] = None,
     ):
         if not issubclass(sampler_class, torch.utils.data.sampler.Sampler):
             raise ValueError(f"sampler_class should inherite from torch.utils.data.Sampler, but got {sampler_class}")
@@ -42,31 +66,216 @@ class NoCrossBatchSampler(torch.utils.data.sampler.BatchSampler):
         if not isinstance(drop_last, bool):
             raise ValueError(f"drop_last should be a boolean value, but got drop_last={drop_last}")
 
-        self.sampler = sampler_class(concat_dataset)
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+        if not 0 <= self.rank < self.num_replicas:
+            raise ValueError(f"invalid rank {self.rank} for {self.num_replicas} replicas")
+
+        if self.num_replicas > 1 and seed is None:
+            seed = get_shared_seed()  # all processes need to draw the same indices to shard them
+
+        if issubclass(sampler_class, torch.utils.data.RandomSampler):
+            # an explicit generator (instead of a new seed per epoch) makes the order resumable, see `state_dict`
+            if seed is None:
+                seed = int(torch.empty((), dtype=torch.int64).random_().item())
+
+            self.sampler = sampler_class(concat_dataset, generator=torch.Generator().manual_seed(seed))
+        elif issubclass(sampler_class, BlockShuffleSampler):
+            self.sampler = sampler_class(concat_dataset, seed=seed)
+        elif issubclass(sampler_class, torch.utils.data.SequentialSampler) or self.num_replicas == 1:
+            self.sampler = sampler_class(concat_dataset)
+        else:
+            raise NotImplementedError(f"distributed {sampler_class}")
+
         self.batch_sizes = batch_sizes
         self.drop_last = drop_last
 
         logger.warning("assuming that `len(datasource)=len(sampler_class(datasource))`!")
-        self._len = 0
+        self.batches_per_dataset = []
         for i, ds in enumerate(concat_dataset.datasets):
             if self.drop_last:
-                self._len += len(ds) // self.batch_sizes[i]
+                self.batches_per_dataset.append(len(ds) // self.batch_sizes[i])
             else:
-                self._len += (len(ds) + self.batch_sizes[i] - 1) // self.batch_sizes[i]
+                self.batches_per_dataset.append((len(ds) + self.batch_sizes[i] - 1) // self.batch_sizes[i])
 
+        self._len = sum(self.get_batches_of_rank(n) for n in self.batches_per_dataset)
         self.cumsum = concat_dataset.cumulative_sizes
+        self._epoch_state = self.get_sampler_state()
+        self._skip = 0
 
-    def __iter__(self):
+    def get_batches_of_rank(self, n_batches: int) -> int:
+        if self.drop_last:
+            return n_batches // self.num_replicas
+        else:
+            return len(range(self.rank, n_batches, self.num_replicas))
+
+    def _is_batch_of_rank(self, ds: int, counter: DefaultDict[int, int]) -> bool:
+        """batches of each dataset are assigned to ranks round robin"""
+        c = counter[ds]
+        counter[ds] += 1
+        if self.drop_last and c >= self.batches_per_dataset[ds] // self.num_replicas * self.num_replicas:
+            return False
+
+        return c % self.num_replicas == self.rank
+
+    def get_sampler_state(self) -> Any:
+        if isinstance(self.sampler, torch.utils.data.RandomSampler):
+            return self.sampler.generator.get_state()
+        elif isinstance(self.sampler, BlockShuffleSampler):
+            return {"seed": self.sampler.seed, "epoch": self.sampler.epoch}
+        else:
+            return None
+
+    def set_sampler_state(self, state: Any) -> None:
+        if isinstance(self.sampler, torch.utils.data.RandomSampler):
+            self.sampler.generator.set_state(state)
+        elif isinstance(self.sampler, BlockShuffleSampler):
+            self.sampler.seed = state["seed"]
+            self.sampler.set_epoch(state["epoch"])
+        else:
+            assert state is None, state
+
+    def state_dict(self, position: int) -> Dict[str, Any]:
+        """state to resume the current epoch at batch `position` (the sampler itself runs ahead of the consumed
+        batches by the DataLoader's prefetched batches, so `position` has to be given)"""
+        return {"sampler": self._epoch_state, "position": position}
+
+    def load_state_dict(self, state: Dict[str, Any]) -> None:
+        """the next epoch repeats the epoch of `state`, but skips its first `position` batches without loading them.
+        If `position` is at or beyond the end of the epoch, the epoch after it starts from the beginning."""
+        self.set_sampler_state(state["sampler"])
+        position = state["position"]
+        if position >= len(self):
+            for _ in self.sampler:  # advance random state by one epoch
+                pass
+
+            position = 0
+
+        self._skip = position
+
+    def _iter_batches(self) -> Iterator[List[int]]:
         batches: DefaultDict[int, List[int]] = defaultdict(list)
+        counter: DefaultDict[int, int] = defaultdict(int)
         for idx in self.sampler:
             ds = numpy.searchsorted(self.cumsum, idx, side="right")
             batches[ds].append(idx)
             if len(batches[ds]) == self.batch_sizes[ds]:
-                yield batches.pop(ds)
+                batch = batches.pop(ds)
+                if self._is_batch_of_rank(ds, counter):
+                    yield batch
 
         if batches and not self.drop_last:
-            for batch in batches.values():
-                yield batch
+            for ds, batch in batches.items():
+                if self._is_batch_of_rank(ds, counter):
+                    yield batch
+
+    def __iter__(self):
+        self._epoch_state = self.get_sampler_state()
+        skip, self._skip = self._skip, 0
+        # skipped batches only consist of indices, the dataset is not touched
+        yield from self._iter_with_upcoming(itertools.islice(self._iter_batches(), skip, None))
+
+    @staticmethod
+    def _iter_with_upcoming(batches: Iterable[List[int]]) -> Iterator[BatchIndices]:
+        """annotate each batch with the batches following it, up to `settings.cache_prefetch_lookahead` indices"""
+        lookahead = settings.cache_prefetch_lookahead
+        if lookahead <= 0:
+            yield from map(BatchIndices, batches)
+            return
+
+        window: Deque[List[int]] = deque()
+        n_upcoming = 0  # indices in window after its first batch
+        for batch in batches:
+            if window:
+                n_upcoming += len(batch)
+
+            window.append(batch)
+            while len(window) > 1 and n_upcoming >= lookahead:
+                current = window.popleft()
+                yield BatchIndices(current, window)
+                n_upcoming -= len(window[0])
+
+        while window:
+            yield BatchIndices(window.popleft(), window)
 
     def __len__(self):
         return self._len
+
+
+class BlockShuffleSampler(torch.utils.data.sampler.Sampler):
+    """Shuffles blocks of consecutive indices instead of single indices.
+
+    Consecutive indices of a dataset tend to share files, volumes and N5 chunks, so reading a block at a time keeps
+    page cache and file handles warm. Blocks are fixed size index ranges that never cross the datasets of a
+    `ConcatDataset`; they are not aligned to the actual file or chunk layout (which subsets, filters and repeats hide),
+    choose `block_size` accordingly. Indices are shuffled within each block, and a shuffle buffer additionally mixes
+    indices of consecutively drawn blocks.
+
+    Args:
+        data_source: dataset to sample from (its `cumulative_sizes` are respected if it has them).
+        block_size: number of consecutive indices per block (default: `settings.sampler_block_size`).
+        shuffle_buffer: size of the shuffle buffer; 0 disables it (default: `settings.sampler_shuffle_buffer`).
+        seed: the order of an epoch is determined by (seed, epoch); drawn from torch's RNG if not given.
+    """
+
+    def __init__(
+        self,
+        data_source: Sized,
+        block_size: Optional[int] = None,
+        shuffle_buffer: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        self.block_size = settings.sampler_block_size if block_size is None else block_size
+        self.shuffle_buffer = settings.sampler_shuffle_buffer if shuffle_buffer is None else shuffle_buffer
+        if self.block_size <= 0:
+            raise ValueError(f"block_size should be a positive integer, but got {self.block_size}")
+
+        if self.shuffle_buffer < 0:
+            raise ValueError(f"shuffle_buffer should be a non-negative integer, but got {self.shuffle_buffer}")
+
+        if isinstance(data_source, ConcatDataset):
+            self.cumulative_sizes = list(data_source.cumulative_sizes)
+        else:
+            self.cumulative_sizes = [len(data_source)]
+
+        self._len = self.cumulative_sizes[-1] if self.cumulative_sizes else 0
+        if seed is None:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def get_blocks(self) -> List[range]:
+        blocks = []
+        start = 0
+        for stop in self.cumulative_sizes:
+            blocks += [range(b, min(b + self.block_size, stop)) for b in range(start, stop, self.block_size)]
+            start = stop
+
+        return blocks
+
+    def __iter__(self) -> Iterator[int]:
+        rng = numpy.random.default_rng([self.seed, self.epoch])
+        self.epoch += 1
+        blocks = self.get_blocks()
+        buffer: List[int] = []
+        for b in rng.permutation(len(blocks)):
+            block = blocks[b]
+            for idx in (rng.permutation(len(block)) + block.start).tolist():
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(idx)
+                elif buffer:
+                    i = rng.integers(len(buffer))
+                    yield buffer[i]
+                    buffer[i] = idx
+                else:
+                    yield idx
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __len__(self) -> int:
+        return self._len
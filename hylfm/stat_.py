@@ -5,7 +5,7 @@ import typing
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Set, TYPE_CHECKING, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Set, TYPE_CHECKING, Tuple, Type
 
 import numpy
 import yaml
@@ -14,13 +14,421 @@ from tqdm import tqdm
 from hylfm import settings
 
 if TYPE_CHECKING:
-    from numpy.lib.npyio import NpzFile
     import torch.utils.data
 
 logger = logging.getLogger(__name__)
 
 
+class RunningMoments:
+    """mergeable count, mean and sum of squared deviations (Welford/Chan)"""
+
+    def __init__(self, n: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.n = n
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, array: numpy.ndarray) -> None:
+        n = array.size
+        if n == 0:
+            return
+
+        mean = numpy.mean(array, dtype=numpy.float64).item()
+        m2 = numpy.var(array, dtype=numpy.float64).item() * n
+        self.merge(RunningMoments(n, mean, m2))
+
+    def merge(self, other: RunningMoments) -> None:
+        n = self.n + other.n
+        if n == 0:
+            return
+
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+
+    @property
+    def std(self) -> float:
+        return float(numpy.sqrt(self.m2 / self.n)) if self.n else float("nan")
+
+    def to_dict(self) -> Dict[str, numpy.ndarray]:
+        return {"n": numpy.asarray(self.n), "mean": numpy.asarray(self.mean), "m2": numpy.asarray(self.m2)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, numpy.ndarray]) -> RunningMoments:
+        return cls(n=int(data["n"]), mean=float(data["mean"]), m2=float(data["m2"]))
+
+
+def iter_finite_blocks(array: numpy.ndarray, block_size: int = 2 ** 20) -> typing.Iterator[numpy.ndarray]:
+    """iterate over flat blocks of finite values as float32 (or float64) to bound temporary memory"""
+    flat = array.reshape(-1)  # view for contiguous arrays
+    for start in range(0, flat.size, block_size):
+        block = flat[start : start + block_size]
+        if block.dtype.kind != "f" or block.dtype.itemsize < 4:
+            block = block.astype(numpy.float32)
+
+        finite = numpy.isfinite(block)
+        if not finite.all():
+            block = block[finite]
+
+        if block.size:
+            yield block
+
+
+def iter_prefetching(dataset: torch.utils.data.Dataset, indices: typing.Iterable[int]) -> typing.Iterator[int]:
+    """iterate `indices`, scheduling background caching of a (cached) `dataset` a bounded window ahead"""
+    indices = [int(i) for i in indices]
+    prefetch = getattr(dataset, "prefetch", None)
+    window = settings.cache_prefetch_lookahead
+    if prefetch is None or window <= 0:
+        yield from indices
+        return
+
+    prefetch(indices[:window])
+    for i, idx in enumerate(indices):
+        if i + window < len(indices):
+            prefetch(indices[i + window : i + window + 1])
+
+        yield idx
+
+
+class Sketch:
+    """mergeable summary of a value distribution, represented by sorted (value, count) pairs"""
+
+    kind: str
+    n: int
+
+    def update(self, array: numpy.ndarray) -> None:
+        raise NotImplementedError
+
+    def merge(self, other: Sketch) -> None:
+        raise NotImplementedError
+
+    def values_and_counts(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        raise NotImplementedError
+
+    def to_dict(self) -> Dict[str, numpy.ndarray]:
+        raise NotImplementedError
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, numpy.ndarray]) -> Sketch:
+        raise NotImplementedError
+
+    def _nonzero_values_and_counts(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        values, counts = self.values_and_counts()
+        nonzero = counts > 0
+        return values[nonzero], counts[nonzero]
+
+    def get_percentiles(self, percentiles: Sequence[float]) -> List[float]:
+        values, counts = self._nonzero_values_and_counts()
+        cumsum = numpy.cumsum(counts)
+        ranks = numpy.asarray(percentiles, dtype=numpy.float64) * cumsum[-1] / 100
+        idx = numpy.clip(numpy.searchsorted(cumsum, ranks, side="left"), 0, len(values) - 1)
+        return values[idx].tolist()
+
+    def get_clipped_mean_std(self, lower: Optional[float], upper: Optional[float]) -> Tuple[float, float]:
+        values, counts = self._nonzero_values_and_counts()
+        if lower is not None or upper is not None:
+            values = numpy.clip(values, a_min=lower, a_max=upper)
+
+        mean = numpy.average(values, weights=counts)
+        var = numpy.average((values - mean) ** 2, weights=counts)
+        return float(mean), float(numpy.sqrt(var))
+
+
+class IntegerHistogram(Sketch):
+    """exact histogram for integer data of at most 16 bit"""
+
+    kind = "int_hist"
+
+    def __init__(self, dtype: numpy.dtype, counts: Optional[numpy.ndarray] = None):
+        self.dtype = numpy.dtype(dtype)
+        assert self.dtype.kind in "biu" and self.dtype.itemsize <= 2, self.dtype
+        if self.dtype.kind == "b":
+            self.offset = 0
+            size = 2
+        else:
+            self.offset = int(numpy.iinfo(self.dtype).min)
+            size = 2 ** (8 * self.dtype.itemsize)
+
+        self.counts = numpy.zeros(size, dtype=numpy.int64) if counts is None else counts
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def update(self, array: numpy.ndarray) -> None:
+        flat = array.ravel()
+        if self.offset:
+            flat = flat.astype(numpy.int32) - self.offset
+
+        self.counts += numpy.bincount(flat, minlength=len(self.counts))
+
+    def merge(self, other: IntegerHistogram) -> None:
+        assert self.dtype == other.dtype, (self.dtype, other.dtype)
+        self.counts += other.counts
+
+    def values_and_counts(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        return numpy.arange(len(self.counts), dtype=numpy.float64) + self.offset, self.counts
+
+    def to_dict(self) -> Dict[str, numpy.ndarray]:
+        return {"dtype": numpy.asarray(str(self.dtype)), "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, numpy.ndarray]) -> IntegerHistogram:
+        return cls(dtype=numpy.dtype(str(data["dtype"])), counts=data["counts"])
+
+
+class DDSketch(Sketch):
+    """relative error quantile sketch for float data (Masson et al. 2019, 'DDSketch')
+
+    Values are counted in logarithmically spaced buckets, such that any value represented by its bucket has a relative
+    error of at most `relative_accuracy`. Magnitudes below `zero_threshold` are counted as zero.
+    """
+
+    kind = "ddsketch"
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.005,
+        zero_threshold: float = 1e-12,
+        min_value: float = numpy.inf,
+        max_value: float = -numpy.inf,
+        zero_count: int = 0,
+        stores: Optional[Dict[str, Tuple[int, numpy.ndarray]]] = None,
+    ):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = numpy.log(self.gamma)
+        self.zero_threshold = zero_threshold
+        self.min_value = min_value
+        self.max_value = max_value
+        self.zero_count = zero_count
+        # dense bucket counts with key offset for positive and negative values
+        self.stores: Dict[str, Tuple[int, numpy.ndarray]] = stores or {
+            "pos": (0, numpy.zeros(0, dtype=numpy.int64)),
+            "neg": (0, numpy.zeros(0, dtype=numpy.int64)),
+        }
+
+    @property
+    def n(self) -> int:
+        return self.zero_count + sum(int(counts.sum()) for _, counts in self.stores.values())
+
+    def _add_to_store(self, store: str, offset: int, counts: numpy.ndarray) -> None:
+        old_offset, old_counts = self.stores[store]
+        if not len(old_counts):
+            self.stores[store] = (offset, counts.astype(numpy.int64))
+            return
+
+        new_offset = min(old_offset, offset)
+        new_end = max(old_offset + len(old_counts), offset + len(counts))
+        new_counts = numpy.zeros(new_end - new_offset, dtype=numpy.int64)
+        new_counts[old_offset - new_offset : old_offset - new_offset + len(old_counts)] += old_counts
+        new_counts[offset - new_offset : offset - new_offset + len(counts)] += counts
+        self.stores[store] = (new_offset, new_counts)
+
+    def _add_magnitudes(self, store: str, magnitudes: numpy.ndarray) -> None:
+        if not magnitudes.size:
+            return
+
+        keys = numpy.ceil(numpy.log(magnitudes) / self.log_gamma).astype(numpy.int64)
+        offset = int(keys.min())
+        self._add_to_store(store, offset, numpy.bincount(keys - offset))
+
+    def update(self, array: numpy.ndarray) -> None:
+        for flat in iter_finite_blocks(array):
+            self._update_block(flat)
+
+    def _update_block(self, flat: numpy.ndarray) -> None:
+        self.min_value = min(self.min_value, float(flat.min()))
+        self.max_value = max(self.max_value, float(flat.max()))
+        positive = flat > self.zero_threshold
+        negative = flat < -self.zero_threshold
+        self.zero_count += flat.size - int(positive.sum()) - int(negative.sum())
+        self._add_magnitudes("pos", flat[positive])
+        self._add_magnitudes("neg", -flat[negative])
+
+    def merge(self, other: DDSketch) -> None:
+        assert self.relative_accuracy == other.relative_accuracy, (self.relative_accuracy, other.relative_accuracy)
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        self.zero_count += other.zero_count
+        for store, (offset, counts) in other.stores.items():
+            if len(counts):
+                self._add_to_store(store, offset, counts)
+
+    def _bucket_values(self, store: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        offset, counts = self.stores[store]
+        keys = numpy.arange(offset, offset + len(counts), dtype=numpy.float64)
+        return 2 * self.gamma ** keys / (self.gamma + 1), counts
+
+    def values_and_counts(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        pos_values, pos_counts = self._bucket_values("pos")
+        neg_values, neg_counts = self._bucket_values("neg")
+        values = numpy.concatenate([-neg_values[::-1], [0.0], pos_values])
+        counts = numpy.concatenate([neg_counts[::-1], [self.zero_count], pos_counts])
+        return numpy.clip(values, self.min_value, self.max_value), counts
+
+    def to_dict(self) -> Dict[str, numpy.ndarray]:
+        ret = {
+            "relative_accuracy": numpy.asarray(self.relative_accuracy),
+            "zero_threshold": numpy.asarray(self.zero_threshold),
+            "min_value": numpy.asarray(self.min_value),
+            "max_value": numpy.asarray(self.max_value),
+            "zero_count": numpy.asarray(self.zero_count),
+        }
+        for store, (offset, counts) in self.stores.items():
+            ret[f"{store}_offset"] = numpy.asarray(offset)
+            ret[f"{store}_counts"] = counts
+
+        return ret
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, numpy.ndarray]) -> DDSketch:
+        return cls(
+            relative_accuracy=float(data["relative_accuracy"]),
+            zero_threshold=float(data["zero_threshold"]),
+            min_value=float(data["min_value"]),
+            max_value=float(data["max_value"]),
+            zero_count=int(data["zero_count"]),
+            stores={store: (int(data[f"{store}_offset"]), data[f"{store}_counts"]) for store in ("pos", "neg")},
+        )
+
+
+class AdaptiveHistogram(Sketch):
+    """histogram over a given value range with linear or logarithmic bins.
+
+    Values outside of the range are counted in the first/last bin, but the exact min/max is kept.
+    """
+
+    kind = "adaptive_hist"
+
+    def __init__(
+        self,
+        lower: float,
+        upper: float,
+        nbins: int = 2 ** 16,
+        log: bool = False,
+        min_value: float = numpy.inf,
+        max_value: float = -numpy.inf,
+        counts: Optional[numpy.ndarray] = None,
+    ):
+        if log and lower <= 0:
+            raise ValueError(f"log bins require a positive lower bound, not {lower}")
+
+        if upper <= lower:
+            upper = lower + max(abs(lower), 1.0) * 1e-6
+
+        self.lower = float(lower)
+        self.upper = float(upper)
+        self.nbins = nbins
+        self.log = log
+        self.min_value = min_value
+        self.max_value = max_value
+        self.counts = numpy.zeros(nbins, dtype=numpy.int64) if counts is None else counts
+        if log:
+            self._lower = numpy.log(self.lower)
+            self._scale = nbins / (numpy.log(self.upper) - self._lower)
+        else:
+            self._lower = self.lower
+            self._scale = nbins / (self.upper - self.lower)
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def update(self, array: numpy.ndarray) -> None:
+        for block in iter_finite_blocks(array):
+            self.min_value = min(self.min_value, float(block.min()))
+            self.max_value = max(self.max_value, float(block.max()))
+            if self.log:
+                block = numpy.log(numpy.maximum(block, self.lower))
+                block -= self._lower
+            else:
+                block = block - self._lower  # never modify a view of the data
+
+            block *= self._scale
+            idx = numpy.clip(block, 0, self.nbins - 1).astype(numpy.intp)
+            self.counts += numpy.bincount(idx, minlength=self.nbins)
+
+    def merge(self, other: AdaptiveHistogram) -> None:
+        assert (self.lower, self.upper, self.nbins, self.log) == (other.lower, other.upper, other.nbins, other.log)
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        self.counts += other.counts
+
+    def values_and_counts(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        centers = self._lower + (numpy.arange(self.nbins, dtype=numpy.float64) + 0.5) / self._scale
+        if self.log:
+            centers = numpy.exp(centers)
+
+        centers = numpy.clip(centers, self.min_value, self.max_value)
+        nonzero = numpy.flatnonzero(self.counts)
+        if len(nonzero):
+            # extreme bins hold the exact min/max
+            centers[nonzero[0]] = self.min_value
+            centers[nonzero[-1]] = self.max_value
+
+        return centers, self.counts
+
+    def to_dict(self) -> Dict[str, numpy.ndarray]:
+        return {
+            "lower": numpy.asarray(self.lower),
+            "upper": numpy.asarray(self.upper),
+            "log": numpy.asarray(self.log),
+            "min_value": numpy.asarray(self.min_value),
+            "max_value": numpy.asarray(self.max_value),
+            "counts": self.counts,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, numpy.ndarray]) -> AdaptiveHistogram:
+        return cls(
+            lower=float(data["lower"]),
+            upper=float(data["upper"]),
+            nbins=len(data["counts"]),
+            log=bool(data["log"]),
+            min_value=float(data["min_value"]),
+            max_value=float(data["max_value"]),
+            counts=data["counts"],
+        )
+
+
+SKETCH_CLASSES: Dict[str, Type[Sketch]] = {cls.kind: cls for cls in [IntegerHistogram, DDSketch, AdaptiveHistogram]}
+
+
+def get_sketch_for(array: numpy.ndarray, value_range: Optional[Tuple[float, float]] = None) -> Sketch:
+    if array.dtype.kind in "biu" and array.dtype.itemsize <= 2:
+        return IntegerHistogram(array.dtype)
+    elif value_range is None or settings.float_stat_sketch == "ddsketch":
+        return DDSketch()
+    elif settings.float_stat_sketch in ("linear", "log"):
+        lower, upper = value_range
+        log = settings.float_stat_sketch == "log"
+        if log and lower <= 0:
+            logger.warning("cannot use log bins for range (%s, %s), falling back to linear bins", lower, upper)
+            log = False
+
+        return AdaptiveHistogram(lower, upper, nbins=settings.float_stat_bins, log=log)
+    else:
+        raise NotImplementedError(settings.float_stat_sketch)
+
+
+def get_sketch_key() -> str:
+    """identifies the settings float sketches are computed with"""
+    if settings.float_stat_sketch == "ddsketch":
+        return "ddsketch"
+    else:
+        return f"{settings.float_stat_sketch}{settings.float_stat_bins}"
+
+
 class DatasetStat:
+    """dataset statistics from a single pass over the data.
+
+    Each tensor is summarized by a mergeable sketch (percentiles and clipped mean/std) and its exact moments.
+    Sketches and the statistics computed from them are stored per sketch setting (see `get_sketch_key`) next to
+    `path`.
+    """
+
     computed: dict
     requested: dict
 
@@ -32,12 +440,12 @@ class DatasetStat:
         means: Optional[Dict[str, Set[Tuple[float, float]]]] = None,
     ):
         assert path.suffix == ".yml", path.suffix
-        self.path = path
+        self.path = path.with_suffix(f".{get_sketch_key()}.yml")
         self.dataset = dataset
         self.computed = defaultdict(dict)
-        if path.exists():
-            logger.debug(f"restoring computed stat from {path}")
-            with path.open() as f:
+        if self.path.exists():
+            logger.debug(f"restoring computed stat from {self.path}")
+            with self.path.open() as f:
                 data = yaml.safe_load(f)
                 data = data or {}  # may restore 'None'
 
@@ -49,76 +457,133 @@ class DatasetStat:
 
         means = means or {}
         percentiles = percentiles or {}
-        percentiles_in_means = {name: {p for range_ in ranges_ for p in range_} for name, ranges_ in means.items()}
-        percentiles = {name: percentiles_in_means.get(name, set()) + p for name, p in percentiles.items()}
-        self.compute_hist()
-        if percentiles:
-            self.compute_many_percentiles(percentiles)
-
-        if means:
-            self.compute_many_mean_std(means)
-
-    def compute_hist(self):
-        nbins = numpy.iinfo(numpy.uint16).max // 5
-        hist_min = 0.0
-        hist_max = numpy.iinfo(numpy.uint16).max  # todo: hist for float data
-        self.bin_width = (hist_max - hist_min) / nbins
-
-        hist_path = self.path.with_suffix(".hist.npz").absolute()
-        if hist_path.exists():
-            hist_npz: NpzFile = numpy.load(str(hist_path))
-            hist = {name: hist_npz[name] for name in hist_npz.files}
-        else:
-            sample = self.dataset[0]
-
-            hist = {
-                name: numpy.zeros(nbins, numpy.float64)
-                for name in sample.keys()
-                if isinstance(sample[name], numpy.ndarray)
-            }
-            logger.info("Compute histograms for %s", list(hist.keys()))
-
-            logger.info(f"compute hist with {settings.max_workers_for_hist} workers")
-            if settings.max_workers_for_hist:
+        self.compute_sketches()
+        for name, pers in percentiles.items():
+            self.get_percentiles(name, list(pers))
 
-                def _compute_hist(i: int):
-                    ret = {}
-                    for name, tensor in self.dataset[i].items():
-                        if isinstance(tensor, numpy.ndarray):
-                            ret[name] = numpy.histogram(tensor, bins=nbins, range=(hist_min, hist_max))[0]
+        for name, ranges in means.items():
+            for range_ in ranges:
+                self.get_mean_std(name, range_)
 
-                    return ret
+    def compute_sketches(self) -> None:
+        sketch_path = self.path.with_suffix(".sketch.npz").absolute()
+        if sketch_path.exists():
+            self.sketches, self.moments = self.load_sketches(sketch_path)
+            return
 
-                with ThreadPoolExecutor(max_workers=settings.max_workers_for_hist) as executor:
-                    futs = [executor.submit(_compute_hist, i) for i in range(len(self.dataset))]
-                    for fut in tqdm(as_completed(futs), total=len(futs)):
-                        for name, h in fut.result().items():
-                            hist[name] += h
-            else:
-                for sample in tqdm(self.dataset):
-                    for name, tensor in sample.items():
-                        if isinstance(tensor, numpy.ndarray):
-                            hist[name] += numpy.histogram(tensor, bins=nbins, range=(hist_min, hist_max))[0]
-
-            hist = {name: h.astype(numpy.uint64) for name, h in hist.items()}
-            numpy.savez_compressed(hist_path, **hist)
+        n = len(self.dataset)
+        max_workers = min(settings.max_workers_for_hist, n)
+        logger.info(f"compute sketches with {max_workers} workers")
+        if settings.float_stat_sketch == "ddsketch":
+            value_ranges = {}
+        else:
+            value_ranges = self.discover_value_ranges()
+
+        if max_workers:
+            # contiguous index blocks (for cache locality); partial sketches are merged
+            blocks = numpy.array_split(numpy.arange(n), max_workers * 4)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futs = [executor.submit(self.sketch_indices, block, value_ranges) for block in blocks if len(block)]
+                sketches, moments = {}, {}
+                for fut in tqdm(as_completed(futs), total=len(futs)):
+                    self.merge_sketches(sketches, moments, *fut.result())
+        else:
+            sketches, moments = self.sketch_indices(tqdm(range(n)), value_ranges)
 
-        self.hist = hist
-        self.cumsums = {name: h.cumsum() for name, h in hist.items()}
+        self.sketches = sketches
+        self.moments = moments
+        self.save_sketches(sketch_path)
 
-    def compute_many_percentiles(self, percentiles: Dict[str, Set[float]]) -> None:
-        for name, pers in percentiles.items():
-            pers = numpy.array(list(pers))
-            per_values = numpy.searchsorted(self.cumsums[name], pers * self.cumsums[name][-1] / 100) * self.bin_width
-            self.computed[name].update(dict(zip(pers.tolist(), per_values.tolist())))
+    def discover_value_ranges(self) -> Dict[str, Tuple[float, float]]:
+        """estimate value ranges from a few evenly spaced samples (for adaptive histogram bins)"""
+        n = len(self.dataset)
+        indices = numpy.unique(numpy.linspace(0, n - 1, min(n, settings.stat_range_samples)).astype(int))
+        ranges: Dict[str, Tuple[float, float]] = {}
+        positive_mins: Dict[str, float] = {}
+        for i in indices:
+            for name, tensor in self.dataset[int(i)].items():
+                if isinstance(tensor, numpy.ndarray) and tensor.dtype.kind == "f":
+                    lower, upper = ranges.get(name, (numpy.inf, -numpy.inf))
+                    ranges[name] = (min(lower, float(numpy.nanmin(tensor))), max(upper, float(numpy.nanmax(tensor))))
+                    if settings.float_stat_sketch == "log":
+                        positive = tensor[tensor > 0]
+                        if positive.size:
+                            positive_mins[name] = min(positive_mins.get(name, numpy.inf), float(positive.min()))
+
+        if settings.float_stat_sketch == "log":
+            # log bins start at the smallest positive value; non-positive values go to the first bin
+            ranges = {
+                name: (positive_mins[name] if lower <= 0 and name in positive_mins else lower, upper)
+                for name, (lower, upper) in ranges.items()
+            }
 
-        self.save_computed()
+        logger.info("discovered value ranges from %d samples: %s", len(indices), ranges)
+        return ranges
+
+    def sketch_indices(
+        self, indices: typing.Iterable[int], value_ranges: Dict[str, Tuple[float, float]]
+    ) -> Tuple[Dict[str, Sketch], Dict[str, RunningMoments]]:
+        sketches: Dict[str, Sketch] = {}
+        moments: Dict[str, RunningMoments] = {}
+        # overlap filling the cache with computing the statistics
+        for i in iter_prefetching(self.dataset, indices):
+            for name, tensor in self.dataset[i].items():
+                if isinstance(tensor, numpy.ndarray):
+                    if name not in sketches:
+                        sketches[name] = get_sketch_for(tensor, value_ranges.get(name))
+                        moments[name] = RunningMoments()
+
+                    sketches[name].update(tensor)
+                    moments[name].update(tensor)
+
+        return sketches, moments
+
+    @staticmethod
+    def merge_sketches(
+        sketches: Dict[str, Sketch],
+        moments: Dict[str, RunningMoments],
+        other_sketches: Dict[str, Sketch],
+        other_moments: Dict[str, RunningMoments],
+    ) -> None:
+        for name, sketch in other_sketches.items():
+            if name in sketches:
+                sketches[name].merge(sketch)
+                moments[name].merge(other_moments[name])
+            else:
+                sketches[name] = sketch
+                moments[name] = other_moments[name]
+
+    def save_sketches(self, path: Path) -> None:
+        data = {}
+        for name, sketch in self.sketches.items():
+            data[f"{name}/kind"] = numpy.asarray(sketch.kind)
+            data.update({f"{name}/sketch/{k}": v for k, v in sketch.to_dict().items()})
+            data.update({f"{name}/moments/{k}": v for k, v in self.moments[name].to_dict().items()})
+
+        numpy.savez_compressed(path, **data)
+
+    @staticmethod
+    def load_sketches(path: Path) -> Tuple[Dict[str, Sketch], Dict[str, RunningMoments]]:
+        grouped: Dict[str, Dict[str, Dict[str, Any]]] = defaultdict(lambda: defaultdict(dict))
+        with numpy.load(str(path)) as npz:
+            for key in npz.files:
+                name, *field = key.split("/")
+                if field == ["kind"]:
+                    grouped[name]["kind"] = str(npz[key])
+                else:
+                    grouped[name][field[0]][field[1]] = npz[key]
+
+        sketches = {name: SKETCH_CLASSES[g["kind"]].from_dict(g["sketch"]) for name, g in grouped.items()}
+        moments = {name: RunningMoments.from_dict(g["moments"]) for name, g in grouped.items()}
+        return sketches, moments
 
     def get_percentiles(self, name: str, percentiles: Sequence[float]) -> List[float]:
         ret = [self.computed[name].get(p, None) for p in percentiles]
         if None in ret:
-            self.compute_many_percentiles({name: {p for p, ret in zip(percentiles, ret) if ret is None}})
-            ret = [self.computed[name].get(p, None) for p in percentiles]
+            missing = [p for p, r in zip(percentiles, ret) if r is None]
+            self.computed[name].update(dict(zip(missing, self.sketches[name].get_percentiles(missing))))
+            self.save_computed()
+            ret = [self.computed[name][p] for p in percentiles]
 
         return ret
 
@@ -131,58 +596,19 @@ class DatasetStat:
             assert len(mean_std) == 2, mean_std
             return tuple(mean_std)
 
-        self.get_percentiles(name, percentile_range)
-        self.compute_many_mean_std({name: {percentile_range}})
-        return self.computed[name][percentile_range]
-
-    def compute_many_mean_std(self, percentile_ranges: Dict[str, Set[Tuple[float, float]]]):
-        n = len(self.dataset)
-        all_new_means_vars = {
-            name: {
-                range_: {
-                    "means": numpy.empty((n,), dtype=numpy.float64),
-                    "vars": numpy.empty((n,), dtype=numpy.float64),
-                }
-                for range_ in ranges
-            }
-            for name, ranges in percentile_ranges.items()
-        }
-
-        def compute_clipped_means_vars(i: int) -> None:
-            for name, array in enumerate(self.dataset[i]):
-                for range_ in percentile_ranges.get(name, []):
-                    lower, upper = range_
-                    if lower is not None or upper is not None:
-                        array = numpy.clip(
-                            array,
-                            a_min=None if lower is None else self.computed[name][lower],
-                            a_max=None if upper is None else self.computed[name][upper],
-                        )
-
-                    all_new_means_vars[name][range_]["means"][i] = numpy.mean(array, dtype=numpy.float64).item()
-                    all_new_means_vars[name][range_]["vars"][i] = numpy.var(array, dtype=numpy.float64).item()
-
-        logger.info(f"compute mean/var with {settings.max_workers_for_stat} workers")
-        if settings.max_workers_for_stat:
-            with ThreadPoolExecutor(max_workers=settings.max_workers_for_stat) as executor:
-                futs = [executor.submit(compute_clipped_means_vars, i=i) for i in range(n)]
-
-                for fut in tqdm(as_completed(futs), total=len(futs)):
-                    exc = fut.exception()
-                    if exc is not None:
-                        raise exc
+        lower, upper = percentile_range
+        if lower is None and upper is None:
+            moments = self.moments[name]
+            mean_std = (moments.mean, moments.std)
         else:
-            [compute_clipped_means_vars(i=i) for i in range(n)]
-
-        for name, ranges in all_new_means_vars.items():
-            for range_, means_vars in ranges.items():
-                means = means_vars["means"]
-                mean = numpy.mean(means, dtype=numpy.float64)
-                vars = means_vars["vars"]
-                var = numpy.mean((vars + (means - mean) ** 2))
-                self.computed[name][range_] = (float(mean), float(numpy.sqrt(var)))
+            mean_std = self.sketches[name].get_clipped_mean_std(
+                lower=None if lower is None else self.get_percentile(name, lower),
+                upper=None if upper is None else self.get_percentile(name, upper),
+            )
 
+        self.computed[name][percentile_range] = mean_std
         self.save_computed()
+        return mean_std
 
     def save_computed(self):
         def tuple2str(val: typing.Any) -> typing.Any:
@@ -4,7 +4,7 @@ import logging
 import subprocess
 import sys
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy
 import torch.optim
@@ -21,8 +21,10 @@ from hylfm.hylfm_types import (
     LRSchedulerChoice,
     MetricChoice,
     OptimizerChoice,
+    PrecisionChoice,
 )
 from hylfm.run.train_run import TrainRun
+from hylfm.utils.distributed import broadcast_object, init_distributed, is_main_process
 from hylfm.utils.general import PeriodUnit
 
 app = typer.Typer()
@@ -69,6 +71,8 @@ def train_cli(
     win_sigma: float = typer.Option(1.5, "--win_sigma"),
     win_size: int = typer.Option(11, "--win_size"),
     save_after_validation_iterations: List[int] = typer.Option([], "--save_after_validation_iterations"),
+    precision: PrecisionChoice = typer.Option(PrecisionChoice.fp32, "--precision"),
+    channels_last: bool = typer.Option(False, "--channels_last"),
     **model_kwargs,
 ):
     return train(
@@ -107,6 +111,8 @@ def train_cli(
         win_sigma=win_sigma,
         win_size=win_size,
         save_after_validation_iterations=save_after_validation_iterations,
+        precision=precision,
+        channels_last=channels_last,
         **model_kwargs,
     )
 
@@ -152,6 +158,8 @@ def train(
     save_output_to_disk: Optional[Dict[str, Path]] = None,
     note: str = "",
     zero_max_patience: int = 10,
+    precision: Union[PrecisionChoice, str] = PrecisionChoice.fp32,
+    channels_last: bool = False,
     **model_kwargs,
 ):
     if isinstance(crit_decay_weight_every_unit, str):
@@ -169,6 +177,9 @@ def train(
     if isinstance(optimizer, str):
         optimizer = OptimizerChoice(optimizer)
 
+    if isinstance(precision, str):
+        precision = PrecisionChoice(precision)
+
     if isinstance(score_metric, str):
         score_metric = MetricChoice(score_metric)
 
@@ -215,10 +226,12 @@ def train(
         point_cloud_threshold=point_cloud_threshold,
         save_after_validation_iterations=save_after_validation_iterations,
         zero_max_patience=zero_max_patience,
+        precision=precision,
+        channels_last=channels_last,
         hylfm_version=__version__,
     )
 
-    wandb_run = wandb.init(
+    wandb_run, run_name, run_id = init_wandb_run(
         project="HyLFM-train", dir=str(settings.cache_dir), config=config.as_dict(for_logging=True), notes=note
     )
 
@@ -226,12 +239,24 @@ def train(
         model_weights = Checkpoint.load(model_weights).model_weights
 
     checkpoint = Checkpoint(
-        model_weights=model_weights, config=config, training_run_name=wandb_run.name, training_run_id=wandb_run.id
+        model_weights=model_weights, config=config, training_run_name=run_name, training_run_id=run_id
     )
 
     train_from_checkpoint(wandb_run, checkpoint=checkpoint)
 
 
+def init_wandb_run(**wandb_kwargs) -> Tuple[Any, str, str]:
+    """init wandb (on rank 0 only in distributed mode) and return the run with its name and id (of rank 0)"""
+    init_distributed()
+    if is_main_process():
+        wandb_run = wandb.init(**wandb_kwargs)
+    else:
+        wandb_run = wandb.init(mode="disabled", **wandb_kwargs)
+
+    run_name, run_id = broadcast_object((wandb_run.name, wandb_run.id))
+    return wandb_run, run_name, run_id
+
+
 def train_from_checkpoint(wandb_run, checkpoint: Checkpoint):
     cfg = checkpoint.config
     if cfg.seed is not None:
@@ -243,6 +268,8 @@ def train_from_checkpoint(wandb_run, checkpoint: Checkpoint):
 
     del train_run
     torch.cuda.empty_cache()
+    if not is_main_process():
+        return
 
     test_cmd = [
         sys.executable,
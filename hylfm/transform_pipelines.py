@@ -1,5 +1,6 @@
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
+from hylfm import settings
 from hylfm.datasets.named import DatasetPart
 from hylfm.hylfm_types import DatasetChoice, TransformsPipeline
 from hylfm.transforms import (
@@ -20,6 +21,46 @@ from hylfm.transforms import (
     RandomRotate90,
     RandomlyFlipAxis,
 )
+from hylfm.transforms.base import Transform
+
+# random augmentations with torch implementations, see `move_augmentations_to_device`
+DEVICE_AUGMENTATIONS = (AdditiveGaussianNoise, PoissonNoise, RandomIntensityScale, RandomRotate90, RandomlyFlipAxis)
+
+
+def get_keys_to_cast(transforms: Sequence[Transform]) -> List[str]:
+    """keys `transforms` read before any of them writes them (transforms applied in place read and write a key)"""
+    to_cast = []
+    written = set()
+    for t in transforms:
+        for key in t.input_mapping:
+            if key not in written and key not in to_cast and key not in ("stat", "crop_name"):
+                to_cast.append(key)
+
+        written.update(t.output_mapping.get(name, name) for name in t.input_mapping.values())
+
+    return to_cast
+
+
+def move_augmentations_to_device(
+    sample_preprocessing: ComposedTransform,
+    batch_preprocessing: ComposedTransform,
+    batch_preprocessing_in_step: Transform,
+) -> Tuple[ComposedTransform, ComposedTransform, ComposedTransform]:
+    """move random augmentations (and everything after them in `batch_preprocessing`) from the data workers to the
+    step, right after casting their inputs to the device"""
+    augmentations = [t for t in sample_preprocessing.transforms if isinstance(t, DEVICE_AUGMENTATIONS)]
+    if not augmentations:
+        return sample_preprocessing, batch_preprocessing, batch_preprocessing_in_step
+
+    sample_preprocessing = ComposedTransform(
+        *[t for t in sample_preprocessing.transforms if not isinstance(t, DEVICE_AUGMENTATIONS)]
+    )
+    moved = augmentations + batch_preprocessing.transforms
+    device_stage = ComposedTransform(
+        Cast(apply_to=get_keys_to_cast(moved), dtype="float32", non_blocking=True),
+        *moved,
+    )
+    return sample_preprocessing, ComposedTransform(), device_stage + batch_preprocessing_in_step
 
 
 def get_transforms_pipeline(
@@ -95,7 +136,7 @@ def get_transforms_pipeline(
             sample_preprocessing += ComposedTransform(ChannelFromLightField(apply_to={"lf": "lfc"}, nnum=nnum))
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -154,10 +195,10 @@ def get_transforms_pipeline(
             batch_preprocessing = ComposedTransform()
 
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+            Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         )
         if load_lfd_and_care:
-            batch_preprocessing_in_step += Cast(apply_to=["lfd"], dtype="float32", device="cuda", non_blocking=True)
+            batch_preprocessing_in_step += Cast(apply_to=["lfd"], dtype="float32", non_blocking=True)
 
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
@@ -203,7 +244,7 @@ def get_transforms_pipeline(
             )
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -248,7 +289,7 @@ def get_transforms_pipeline(
             )
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -317,10 +358,10 @@ def get_transforms_pipeline(
             batch_preprocessing = ComposedTransform()
 
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+            Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         )
         if load_lfd_and_care:
-            batch_preprocessing_in_step += Cast(apply_to=["lfd"], dtype="float32", device="cuda", non_blocking=True)
+            batch_preprocessing_in_step += Cast(apply_to=["lfd"], dtype="float32", non_blocking=True)
 
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
@@ -342,7 +383,7 @@ def get_transforms_pipeline(
         #     sample_preprocessing += ComposedTransform(ChannelFromLightField(apply_to={"lf": "lfc"}, nnum=nnum))
         #     batch_preprocessing = ComposedTransform()
         #
-        # batch_preprocessing_in_step = Cast(apply_to=["lfc", spim], dtype="float32", device="cuda", non_blocking=True)
+        # batch_preprocessing_in_step = Cast(apply_to=["lfc", spim], dtype="float32", non_blocking=True)
         # batch_postprocessing = ComposedTransform(
         #     Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         # )
@@ -385,7 +426,7 @@ def get_transforms_pipeline(
             sample_preprocessing += ComposedTransform(ChannelFromLightField(apply_to={"lf": "lfc"}, nnum=nnum))
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -458,7 +499,7 @@ def get_transforms_pipeline(
             sample_preprocessing += ComposedTransform(ChannelFromLightField(apply_to={"lf": "lfc"}, nnum=nnum))
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -472,7 +513,7 @@ def get_transforms_pipeline(
         )
         batch_preprocessing = ComposedTransform()
         batch_preprocessing_in_step = Cast(
-            apply_to=["lfd", "care", tgt], dtype="float32", device="cuda", non_blocking=True
+            apply_to=["lfd", "care", tgt], dtype="float32", non_blocking=True
         )
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
@@ -504,7 +545,7 @@ def get_transforms_pipeline(
 
         batch_preprocessing = ComposedTransform()
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to=["lfc", "lfd", "care", tgt], dtype="float32", device="cuda", non_blocking=True)
+            Cast(apply_to=["lfc", "lfd", "care", tgt], dtype="float32", non_blocking=True)
         )
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
@@ -532,7 +573,7 @@ def get_transforms_pipeline(
 
         batch_preprocessing = ComposedTransform()
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to=["lfd", "care", tgt], dtype="float32", device="cuda", non_blocking=True)
+            Cast(apply_to=["lfd", "care", tgt], dtype="float32", non_blocking=True)
         )
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, 1, None, None))
@@ -570,7 +611,7 @@ def get_transforms_pipeline(
             sample_preprocessing += ComposedTransform(ChannelFromLightField(apply_to={"lf": "lfc"}, nnum=nnum))
             batch_preprocessing = ComposedTransform()
 
-        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", device="cuda", non_blocking=True)
+        batch_preprocessing_in_step = Cast(apply_to=["lfc", tgt], dtype="float32", non_blocking=True)
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
         )
@@ -586,7 +627,7 @@ def get_transforms_pipeline(
 
         batch_preprocessing = ComposedTransform()
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to="lfc", dtype="float32", device="cuda", non_blocking=True)
+            Cast(apply_to="lfc", dtype="float32", non_blocking=True)
         )
         batch_postprocessing = ComposedTransform(
             Assert(apply_to="pred", expected_tensor_shape=(None, 1, z_out, None, None))
@@ -597,8 +638,8 @@ def get_transforms_pipeline(
         sample_preprocessing = ComposedTransform()
         batch_preprocessing = ComposedTransform()
         batch_preprocessing_in_step = ComposedTransform(
-            Cast(apply_to=trgt_name_for_from_path, dtype="float32", device="cuda", non_blocking=True),
-            Cast(apply_to=pred_name_for_from_path, dtype="float32", device="cuda", non_blocking=True),
+            Cast(apply_to=trgt_name_for_from_path, dtype="float32", non_blocking=True),
+            Cast(apply_to=pred_name_for_from_path, dtype="float32", non_blocking=True),
         )
         batch_postprocessing = ComposedTransform()
     else:
@@ -643,6 +684,11 @@ def get_transforms_pipeline(
             "pred", tgt
         )  # transform pred and sample only the z_slice of ls_slice
 
+    if settings.augment_on_device and dataset_part == DatasetPart.train:
+        sample_preprocessing, batch_preprocessing, batch_preprocessing_in_step = move_augmentations_to_device(
+            sample_preprocessing, batch_preprocessing, batch_preprocessing_in_step
+        )
+
     if tgt is not None:
         batch_postprocessing += Assert(apply_to="pred", expected_shape_like_tensor=tgt)
         batch_premetric_trf = ComposedTransform(NormalizeMSE(apply_to="pred", target_name=tgt, return_alpha_beta=True))
@@ -3,9 +3,17 @@ from typing import Any, Collection, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
 import torch.nn.functional
-import torch.nn.functional
-from scipy.ndimage import affine_transform
 
+from hylfm import settings
+from hylfm.transforms.affine_resample import (
+    affine_transform_chunked,
+    affine_transform_planes,
+    get_affine_grid_cache,
+    get_affine_grid_planes,
+    get_input_box,
+    get_output_roi,
+    grid_sample_chunked,
+)
 from hylfm.transforms.affine_utils import (
     MAX_SRHINK_IN_LENSLETS,
     get_bdv_affine_transformations_by_name,
@@ -153,8 +161,6 @@ class AffineTransformation(torch.nn.Module):
         for m in trf_matrices[1:]:
             trf_matrix = trf_matrix.dot(m)
 
-        self.affine_grids = {}
-
         self.forward = self._inverted if inverted else self._forward
 
         if ref_crop_in is None:
@@ -177,32 +183,8 @@ class AffineTransformation(torch.nn.Module):
         trf_matrix = crop_shift_in.dot(trf_matrix)
 
         if ref_crop_out is None:
-            self.order = 0
-            self.padding_mode = "zeros"
-            ones_out = self._impl(
-                ipt=numpy.ones((1, 1) + self.input_shape, dtype=numpy.uint8),
-                matrix=trf_matrix,
-                trf_in_shape=tuple(self.cropped_input_shape),
-                trf_out_shape=tuple(self.output_shape),
-                order=0,
-            )[0, 0]
-            ones_out = ones_out.astype(bool)
-            dims = []
-            roi_method = "max"
-            if roi_method == "tight":
-                raise NotImplementedError
-            elif roi_method == "max":
-                if len(ones_out.shape) == 3:
-                    dims.append(ones_out.max(1).max(1))
-                    ones_out_2d = ones_out.max(0)
-                    dims.append(ones_out_2d.max(1))
-                    dims.append(ones_out_2d.max(0))
-                else:
-                    raise NotImplementedError
-                ref_crop_out = [(numpy.argmax(dim), -numpy.argmax(dim[::-1])) for dim in dims]
-            else:
-                raise NotImplementedError(roi_method)
-
+            in_scaling = [ins / cins for ins, cins in zip(self.input_shape, self.cropped_input_shape)] + [1.0]
+            ref_crop_out = get_output_roi(numpy.diag(in_scaling).dot(trf_matrix), self.input_shape, self.output_shape)
             logger.warning("determined crop_out: %s", ref_crop_out)
         elif len(ref_crop_out) == len(ref_output_shape) + 1:
             assert ref_crop_out[0][0] == 0 and ref_crop_out[0][1] is None or ref_crop_out[0][1] == 0, ref_crop_out
@@ -269,23 +251,14 @@ class AffineTransformation(torch.nn.Module):
         matrix = matrix.astype("float32")
         if isinstance(ipt, numpy.ndarray):
             assert len(ipt.shape) in [4, 5], ipt.shape
-            ret = numpy.stack(
-                [
-                    numpy.stack(
-                        [
-                            affine_transform(
-                                ipt_woc,
-                                matrix,
-                                output_shape=output_sampling_shape,
-                                order=order,
-                                mode=self.scipy_padding_mode[self.padding_mode],
-                            )
-                            for ipt_woc in ipt_wc
-                        ]
-                    )
-                    for ipt_wc in ipt
-                ]
-            )
+            mode = self.scipy_padding_mode[self.padding_mode]
+            if z_slices is not None and any([zs is not None for zs in z_slices]) and settings.affine_slices_only:
+                planes = [zs - self.z_offset for zs in z_slices]
+                return affine_transform_planes(
+                    ipt, matrix, output_shape=output_sampling_shape, planes=planes, order=order, mode=mode
+                )
+
+            ret = affine_transform_chunked(ipt, matrix, output_shape=output_sampling_shape, order=order, mode=mode)
             if z_slices is None or all([zs is None for zs in z_slices]):
                 return ret
             else:
@@ -299,14 +272,27 @@ class AffineTransformation(torch.nn.Module):
                 else:
                     ipt = ipt.to(torch.device("cpu"))
 
-            affine_grid_key = (matrix.tostring(), ipt.shape[2:], output_sampling_shape)
-            affine_grid = self.affine_grids.get(affine_grid_key, None)
-            if affine_grid is None:
-                affine_grid = self.get_affine_grid(matrix, ipt.shape[2:], output_sampling_shape, self.align_corners)
-                affine_grid.to(ipt)
-                self.affine_grids[affine_grid_key] = affine_grid
+            if not ipt.is_cuda and (z_slices is None or all([zs is None for zs in z_slices])):
+                return grid_sample_chunked(
+                    ipt,
+                    scipy_form2torch_theta(matrix, ipt.shape[2:], output_sampling_shape),
+                    output_shape=output_sampling_shape,
+                    align_corners=self.align_corners,
+                    mode=self.mode,
+                    padding_mode=self.padding_mode,
+                )
+
+            if z_slices is not None and any([zs is not None for zs in z_slices]) and settings.affine_slices_only:
+                assert all([zs is not None for zs in z_slices]), z_slices
+                assert len(z_slices) == ipt.shape[0], (z_slices, ipt.shape)
+                assert all(self.z_offset <= z_slice for z_slice in z_slices), (self.z_offset, z_slices)
+                return self._sample_planes(ipt, matrix, output_sampling_shape, [zs - self.z_offset for zs in z_slices])
 
-            affine_grid = affine_grid.to(ipt)
+            affine_grid = get_affine_grid_cache().get(
+                ("full", matrix.tobytes(), tuple(ipt.shape[2:]), tuple(output_sampling_shape), self.align_corners),
+                like=ipt,
+                create=lambda: self.get_affine_grid(matrix, ipt.shape[2:], output_sampling_shape, self.align_corners),
+            )
 
             if z_slices is None or all([zs is None for zs in z_slices]):
                 affine_grid = affine_grid.expand(ipt.shape[0], *([-1] * (len(ipt.shape) - 1)))
@@ -332,6 +318,35 @@ class AffineTransformation(torch.nn.Module):
         else:
             raise TypeError(type(ipt))
 
+    def _sample_planes(
+        self, ipt: torch.Tensor, matrix: numpy.ndarray, output_sampling_shape: Tuple[int, ...], planes: List[int]
+    ) -> torch.Tensor:
+        """grid sample one output plane per sample, reading only the input box it maps to"""
+        ret = []
+        for b, plane in enumerate(planes):
+            if self.align_corners:  # the input box is only exact for align_corners=False (see scipy_form2torch_theta)
+                box = tuple(slice(None) for _ in ipt.shape[2:])
+                box_matrix = matrix
+            else:
+                box, box_matrix = get_input_box(matrix, ipt.shape[2:], output_sampling_shape, plane)
+
+            ipt_box = ipt[(slice(b, b + 1), slice(None)) + box]
+            theta = scipy_form2torch_theta(box_matrix, ipt_box.shape[2:], output_sampling_shape)
+            affine_grid = get_affine_grid_planes(
+                theta, output_sampling_shape, [plane], self.align_corners, device=ipt.device
+            ).to(dtype=ipt.dtype)
+            ret.append(
+                torch.nn.functional.grid_sample(
+                    ipt_box,
+                    affine_grid,
+                    align_corners=self.align_corners,
+                    mode=self.mode,
+                    padding_mode=self.padding_mode,
+                )
+            )
+
+        return torch.cat(ret)
+
     def _inverted(self, batch: Dict[str, Any]) -> Dict[str, Any]:
         if isinstance(self.target_to_compare_to, str):
             z_slices = batch["z_slice"]
@@ -0,0 +1,358 @@
+"""chunked, multi-threaded resampling for `AffineTransformation` on the CPU.
+
+Only the requested planes are resampled if each sample needs just one (`affine_transform_planes`, `get_input_box`).
+Otherwise the output is resampled in chunks of `settings.affine_chunk_size` planes (along the first spatial axis):
+ - numpy: each chunk only reads the input sub-volume its output planes map to (plus a margin for the spline prefilter)
+   and is resampled with `scipy.ndimage.affine_transform`. The per chunk plans (input box and chunk matrix) are cached
+   per (matrix, in_shape, out_shape, order).
+ - torch (cpu): the sampling grid is computed chunk by chunk (see `get_affine_grid_planes`) instead of materializing
+   the full grid, which for a (241, 2048, 2060) volume alone takes 12 GB.
+Chunks are processed by a thread pool of `settings.max_workers_for_affine` threads (both scipy and torch release the
+GIL), which is the only parallelism available on the CPU while `OMP_NUM_THREADS` is set to 1.
+"""
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy
+import torch
+import torch.nn.functional
+from scipy.ndimage import affine_transform
+
+from hylfm import settings
+
+logger = logging.getLogger(__name__)
+
+SPLINE_PREFILTER_MARGIN = 16  # influence of the (global) spline prefilter decays below 1e-6 for order <= 5
+
+
+def get_output_roi(
+    matrix: numpy.ndarray, in_shape: Sequence[int], out_shape: Sequence[int]
+) -> List[Tuple[int, int]]:
+    """range of output indices per axis that map into the input, as ref_crop_out `(start, -n_end)`
+
+    `matrix` maps output to input coordinates (scipy form). The output region mapping into the input is a convex
+    polytope (the transformed input box intersected with the output box); its bounding box is determined from the
+    polytope's vertices, which are intersections of `ndim` of its bounding hyperplanes. Compared to transforming a
+    volume of ones this may include one more boundary plane, if the polytope touches it only between voxel centers.
+    """
+    ndim = len(in_shape)
+    assert matrix.shape == (ndim + 1, ndim + 1), (matrix.shape, in_shape)
+    assert len(out_shape) == ndim, (in_shape, out_shape)
+    a = matrix[:-1, :-1].astype(numpy.float64)
+    t = matrix[:-1, -1].astype(numpy.float64)
+    eye = numpy.eye(ndim)
+    # polytope as g @ o <= h
+    g = numpy.concatenate([a, -a, eye, -eye])
+    h = numpy.concatenate([numpy.asarray(in_shape) - 1 - t, t, numpy.asarray(out_shape) - 1, numpy.zeros(ndim)])
+
+    vertices = []
+    for rows in itertools.combinations(range(len(g)), ndim):
+        rows = list(rows)
+        try:
+            vertex = numpy.linalg.solve(g[rows], h[rows])
+        except numpy.linalg.LinAlgError:
+            continue
+
+        if (g.dot(vertex) <= h + 1e-6).all():
+            vertices.append(vertex)
+
+    if not vertices:
+        raise ValueError(f"no output voxel maps into input of shape {in_shape}")
+
+    vertices = numpy.stack(vertices)
+    start = numpy.ceil(vertices.min(0) - 1e-6).astype(int)
+    stop = numpy.floor(vertices.max(0) + 1e-6).astype(int) + 1
+    return [(int(s), -int(out - e)) for s, e, out in zip(start, stop, out_shape)]
+
+
+def get_translation(shift: Sequence[float]) -> numpy.ndarray:
+    trf = numpy.eye(len(shift) + 1)
+    trf[:-1, -1] = shift
+    return trf
+
+
+Chunk = Tuple[slice, Tuple[slice, ...], numpy.ndarray]
+
+
+@lru_cache(maxsize=2 ** 14)
+def _get_chunk(
+    matrix_bytes: bytes, in_shape: Tuple[int, ...], out_shape: Tuple[int, ...], order: int, z0: int, z1: int
+) -> Chunk:
+    ndim = len(in_shape)
+    matrix = numpy.frombuffer(matrix_bytes, dtype=numpy.float64).reshape(ndim + 1, ndim + 1)
+    margin = 1 if order < 2 else SPLINE_PREFILTER_MARGIN
+    corners = numpy.array(list(itertools.product([z0, z1 - 1], *[[0, s - 1] for s in out_shape[1:]])))
+    mapped = corners.dot(matrix[:-1, :-1].T) + matrix[:-1, -1]
+    lower = numpy.clip(numpy.floor(mapped.min(0)).astype(int) - margin, 0, numpy.asarray(in_shape) - 1)
+    upper = numpy.clip(numpy.ceil(mapped.max(0)).astype(int) + margin + 1, lower + 1, in_shape)
+    in_box = tuple(slice(int(lo), int(up)) for lo, up in zip(lower, upper))
+    chunk_matrix = get_translation(-lower).dot(matrix).dot(get_translation([z0] + [0] * (ndim - 1)))
+    return slice(z0, z1), in_box, chunk_matrix
+
+
+def get_chunk(
+    matrix: numpy.ndarray, in_shape: Sequence[int], out_shape: Sequence[int], order: int, z0: int, z1: int
+) -> Chunk:
+    """output planes [z0, z1) with the input box they map to and the matrix relative to both"""
+    return _get_chunk(
+        numpy.ascontiguousarray(matrix, dtype=numpy.float64).tobytes(),
+        tuple(in_shape),
+        tuple(out_shape),
+        order,
+        z0,
+        z1,
+    )
+
+
+def get_chunk_plan(
+    matrix: numpy.ndarray, in_shape: Sequence[int], out_shape: Sequence[int], order: int, chunk_size: int
+) -> List[Chunk]:
+    return [
+        get_chunk(matrix, in_shape, out_shape, order, z0, min(z0 + chunk_size, out_shape[0]))
+        for z0 in range(0, out_shape[0], chunk_size)
+    ]
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def run_all(tasks: List[Callable[[], None]]) -> None:
+    """run tasks on the (lazily created) affine resampling thread pool"""
+    global _executor
+    if settings.max_workers_for_affine == 0 or len(tasks) == 1:
+        for task in tasks:
+            task()
+
+        return
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.max_workers_for_affine, thread_name_prefix="AffineResample"
+            )
+
+    for future in [_executor.submit(task) for task in tasks]:
+        future.result()
+
+
+def _resample_chunks(ipt: numpy.ndarray, out: numpy.ndarray, chunks: Sequence[Sequence[Chunk]], order: int, mode: str):
+    def resample(ipt_woc: numpy.ndarray, out_woc: numpy.ndarray, out_chunk: slice, in_box, chunk_matrix):
+        affine_transform(
+            ipt_woc[in_box],
+            chunk_matrix,
+            output_shape=out_woc[out_chunk].shape,
+            output=out_woc[out_chunk],
+            order=order,
+            mode=mode,
+        )
+
+    run_all(
+        [
+            lambda args=(ipt[b, c], out[b, c]) + chunk: resample(*args)
+            for b, sample_chunks in enumerate(chunks)
+            for c in range(ipt.shape[1])
+            for chunk in sample_chunks
+        ]
+    )
+
+
+def affine_transform_chunked(
+    ipt: numpy.ndarray,
+    matrix: numpy.ndarray,
+    *,
+    output_shape: Sequence[int],
+    order: int,
+    mode: str,
+    chunk_size: Optional[int] = None,
+) -> numpy.ndarray:
+    """`scipy.ndimage.affine_transform` over the spatial axes of `ipt` (batch, channel, *spatial)"""
+    output_shape = tuple(output_shape)
+    plan = get_chunk_plan(matrix, ipt.shape[2:], output_shape, order, chunk_size or settings.affine_chunk_size)
+    out = numpy.empty(ipt.shape[:2] + output_shape, dtype=ipt.dtype)
+    _resample_chunks(ipt, out, [plan] * ipt.shape[0], order, mode)
+    return out
+
+
+def affine_transform_planes(
+    ipt: numpy.ndarray,
+    matrix: numpy.ndarray,
+    *,
+    output_shape: Sequence[int],
+    planes: Sequence[int],
+    order: int,
+    mode: str,
+) -> numpy.ndarray:
+    """equals `affine_transform_chunked(...)[b, :, plane : plane + 1]` for each sample b and its plane"""
+    assert len(planes) == ipt.shape[0], (planes, ipt.shape)
+    assert all(0 <= p < output_shape[0] for p in planes), (planes, output_shape)
+    out = numpy.empty(ipt.shape[:2] + (1,) + tuple(output_shape[1:]), dtype=ipt.dtype)
+    chunks = []
+    for p in planes:
+        _, in_box, chunk_matrix = get_chunk(matrix, ipt.shape[2:], output_shape, order, p, p + 1)
+        chunks.append([(slice(0, 1), in_box, chunk_matrix)])  # each sample's plane is written to z=0
+
+    _resample_chunks(ipt, out, chunks, order, mode)
+    return out
+
+
+def get_input_box(
+    matrix: numpy.ndarray, in_shape: Sequence[int], out_shape: Sequence[int], plane: int, margin: int = 2
+) -> Tuple[Tuple[slice, ...], numpy.ndarray]:
+    """input box read by output `plane` in the continuous coordinates of `scipy_form2torch_theta` (voxel k spans
+    [k, k + 1]) and `matrix` relative to this box"""
+    corners = numpy.array(list(itertools.product([plane, plane + 1], *[[0, s] for s in out_shape[1:]])))
+    mapped = corners.dot(matrix[:-1, :-1].T) + matrix[:-1, -1] - 0.5  # voxel centers
+    lower = numpy.clip(numpy.floor(mapped.min(0)).astype(int) - margin, 0, numpy.asarray(in_shape) - 1)
+    upper = numpy.clip(numpy.ceil(mapped.max(0)).astype(int) + margin + 1, lower + 1, in_shape)
+    box = tuple(slice(int(lo), int(up)) for lo, up in zip(lower, upper))
+    return box, get_translation(-lower).dot(matrix)
+
+
+def _linspace_from_neg_one(steps: int, align_corners: bool) -> torch.Tensor:
+    # as in torch.nn.functional.affine_grid
+    if steps <= 1:
+        return torch.zeros(1, dtype=torch.float64)
+
+    coords = torch.linspace(-1, 1, steps, dtype=torch.float64)
+    if not align_corners:
+        coords = coords * (steps - 1) / steps
+
+    return coords
+
+
+def get_affine_grid_planes(
+    theta: torch.Tensor,
+    out_shape: Sequence[int],
+    planes: Sequence[int],
+    align_corners: bool,
+    device: Optional[torch.device] = None,
+) -> torch.Tensor:
+    """`affine_grid(theta, (1, 1) + out_shape, align_corners)[:, planes]`, without computing the full grid"""
+    assert theta.shape == (1, len(out_shape), len(out_shape) + 1), (theta.shape, out_shape)
+    theta = theta[0].to(dtype=torch.float64, device=device)
+    coords = [_linspace_from_neg_one(s, align_corners).to(device) for s in out_shape]
+    coords[0] = coords[0][torch.as_tensor(list(planes), dtype=torch.long, device=device)]
+    ndim = len(out_shape)
+    grid = theta[:, -1].expand(*[len(c) for c in coords], ndim)
+    # grid coordinates are ordered (x, y, z), i.e. reversed w.r.t. the spatial axes
+    for i, c in enumerate(reversed(coords)):
+        axis = ndim - 1 - i
+        grid = grid + c.reshape([-1 if a == axis else 1 for a in range(ndim)] + [1]) * theta[:, i]
+
+    return grid[None]
+
+
+def grid_sample_chunked(
+    ipt: torch.Tensor,
+    theta: torch.Tensor,
+    *,
+    output_shape: Sequence[int],
+    align_corners: bool,
+    mode: str,
+    padding_mode: str,
+    chunk_size: Optional[int] = None,
+) -> torch.Tensor:
+    """`grid_sample` with the affine grid of `theta`, computed chunk by chunk (for cpu tensors)"""
+    output_shape = tuple(output_shape)
+    chunk_size = chunk_size or settings.affine_chunk_size
+    out = torch.empty(ipt.shape[:2] + output_shape, dtype=ipt.dtype, device=ipt.device)
+
+    def resample(z0: int):
+        z1 = min(z0 + chunk_size, output_shape[0])
+        grid = get_affine_grid_planes(theta, output_shape, range(z0, z1), align_corners).to(ipt)
+        out[:, :, z0:z1] = torch.nn.functional.grid_sample(
+            ipt,
+            grid.expand(ipt.shape[0], *([-1] * (len(ipt.shape) - 1))),
+            align_corners=align_corners,
+            mode=mode,
+            padding_mode=padding_mode,
+        )
+
+    run_all([lambda z0=z0: resample(z0) for z0 in range(0, output_shape[0], chunk_size)])
+    return out
+
+
+class AffineGridCache:
+    """process-wide LRU cache of affine grids, resident on the device they are used on.
+
+    Grids are evicted (least recently used first) once their total size exceeds `budget_bytes`; grids larger than
+    the budget are not cached at all.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._grids: Dict[Tuple[Hashable, ...], torch.Tensor] = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[Hashable, ...], like: torch.Tensor, create: Callable[[], torch.Tensor]) -> torch.Tensor:
+        """grid for `key` with dtype and device of `like`; created by `create` if not cached"""
+        key = tuple(key) + (like.dtype, str(like.device))
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                self.hits += 1
+                return grid
+
+            self.misses += 1
+
+        grid = create().to(like)
+        nbytes = grid.numel() * grid.element_size()
+        if nbytes > self.budget_bytes:
+            return grid
+
+        with self._lock:
+            if key not in self._grids:
+                self._grids[key] = grid
+                self.nbytes += nbytes
+                while self.nbytes > self.budget_bytes:
+                    _, evicted = self._grids.popitem(last=False)
+                    self.nbytes -= evicted.numel() * evicted.element_size()
+                    self.evictions += 1
+
+        logger.debug("affine grid cache: %s", self.stats())
+        return grid
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            bytes_per_device = {}
+            for (*_, device), grid in self._grids.items():
+                bytes_per_device[device] = bytes_per_device.get(device, 0) + grid.numel() * grid.element_size()
+
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else float("nan"),
+                "evictions": self.evictions,
+                "entries": len(self._grids),
+                "bytes": self.nbytes,
+                "bytes_per_device": bytes_per_device,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._grids.clear()
+            self.nbytes = 0
+
+
+_affine_grid_cache: Optional[AffineGridCache] = None
+
+
+def get_affine_grid_cache() -> AffineGridCache:
+    """per process affine grid cache"""
+    global _affine_grid_cache
+    if _affine_grid_cache is None:
+        _affine_grid_cache = AffineGridCache(budget_bytes=settings.affine_grid_cache_bytes)
+
+    return _affine_grid_cache
@@ -1,7 +1,13 @@
 import logging
-from typing import Any, Dict, List, Tuple, Union
-from hylfm.datasets.collate import collate, separate
-from hylfm.hylfm_types import TransformLike
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy
+import torch
+import torch.utils.data
+
+from hylfm import settings
+from hylfm.datasets.collate import COMMON_BATCH_KEYS, collate, separate
+from hylfm.hylfm_types import Array, TransformLike
 
 try:
     from typing import Protocol
@@ -62,6 +68,35 @@ class Transform:
 
         return batch
 
+    @property
+    def per_sample(self) -> bool:
+        """only implemented per sample (see `apply_to_sample`), i.e. applying it to a batch requires `separate`"""
+        return type(self).apply_to_batch is Transform.apply_to_batch and type(self).__call__ is Transform.__call__
+
+    def call_on_sample(self, sample: Dict[str, Any]) -> Dict[str, Any]:
+        """like `__call__`, but for a single sample"""
+        missing_inputs = [k for k in self.input_mapping if k not in sample]
+        if missing_inputs:
+            raise ValueError(f"required keys {missing_inputs} for {self} not found in sample {list(sample.keys())}")
+
+        input_sample = {self.input_mapping[k]: v for k, v in sample.items() if k in self.input_mapping}
+        try:
+            transformed = self.apply_to_sample(**input_sample)
+        except Exception:
+            logger.error("transform %s failed", self)
+            raise
+
+        if isinstance(transformed, dict):
+            for k, v in transformed.items():
+                sample[self.output_mapping.get(k, k)] = v
+        elif len(self.output_mapping) == 1:
+            k, v = next(iter(self.output_mapping.items()))
+            sample[v] = transformed
+        else:
+            raise NotImplementedError(f"{self}, {type(transformed)}")
+
+        return sample
+
     def apply_to_batch(self, **batch: Any) -> Dict[str, Any]:
         try:
             transformed_samples = [self.apply_to_sample(**sample_in) for sample_in in separate(batch)]
@@ -84,6 +119,10 @@ class Transform:
     def apply_to_sample(self, **sample: Any) -> Any:
         raise RuntimeError(f"{self}.apply_to_sample() not implemented or called erroneously")
 
+    def get_fused_ops(self, **batch: Any) -> Dict[str, List[Any]]:
+        """per sample `hylfm.transforms.fusion.FusedOp`s for each tensor (optional, see `hylfm.transforms.fusion`)"""
+        raise NotImplementedError(self)
+
     def __add__(self, other):
         if isinstance(other, ComposedTransform):
             return ComposedTransform(self, *other.transforms)
@@ -103,6 +142,20 @@ class ComposedTransform(Transform):
     def update_randomly_changes_shape(self):
         self.randomly_changes_shape = any(getattr(t, "randomly_changes_shape", True) for t in self.transforms)
 
+    def get_plan(self) -> List[TransformLike]:
+        """transforms to execute, with fusable runs fused if `settings.fuse_transforms`"""
+        if not settings.fuse_transforms:
+            return self.transforms
+
+        planned_for, plan = getattr(self, "_plan", (None, None))
+        if planned_for != self.transforms:  # (re)plan if transforms were added or removed
+            from hylfm.transforms.fusion import fuse
+
+            plan = fuse(self.transforms)
+            self._plan = (list(self.transforms), plan)
+
+        return plan
+
     def __add__(self, other):
         if isinstance(other, self.__class__):
             return self.__class__(*self.transforms, *other.transforms)
@@ -135,13 +188,114 @@ class ComposedTransform(Transform):
         return self
 
     def __call__(self, batch: Dict[str, Any]) -> Dict[str, Any]:
-        for transform in self.transforms:
-            batch = transform(batch)
-            assert isinstance(batch, dict), transform
+        # consecutive per sample transforms share a single separate/collate round trip
+        transforms = self.get_plan()
+        i = 0
+        while i < len(transforms):
+            j = i + 1
+            if getattr(transforms[i], "per_sample", False):
+                while j < len(transforms) and getattr(transforms[j], "per_sample", False):
+                    j += 1
+
+            if j - i > 1:
+                batch = apply_per_sample(transforms[i:j], batch)
+            else:
+                batch = transforms[i](batch)
+                assert isinstance(batch, dict), transforms[i]
+
+            i = j
 
         return batch
 
 
+def apply_per_sample(transforms: Sequence[Transform], batch: Dict[str, Any]) -> Dict[str, Any]:
+    """apply per sample transforms with a single separate/collate round trip.
+
+    Transforms are applied one after the other to all samples (as if applied to the batch one by one) to keep the
+    order of random draws.
+    """
+    keys = {k for t in transforms for k in t.input_mapping if k in batch}
+    samples = separate({k: v for k, v in batch.items() if k in keys or k in COMMON_BATCH_KEYS})
+    outputs_before = [dict(s) for s in samples]
+    for transform in transforms:
+        samples = [transform.call_on_sample(s) for s in samples]
+
+    # only restack what changed
+    changed = {
+        k for s, before in zip(samples, outputs_before) for k, v in s.items() if k not in before or before[k] is not v
+    }
+    collated = collate([{k: s[k] for k in changed} for s in samples])
+    batch.update(collated)
+    return batch
+
+
+def get_process_seed(seed: Optional[int] = None) -> int:
+    """seed for a random generator created in this process.
+
+    Without `seed` it is drawn from numpy's global random state (which is seeded for training runs and per DataLoader
+    worker, see `hylfm.datasets.loading.seed_worker`). In a DataLoader worker a given `seed` is combined with the
+    worker id, such that workers do not draw the same numbers.
+    """
+    if seed is None:
+        return numpy.random.randint(2 ** 31)
+
+    worker_info = torch.utils.data.get_worker_info()
+    if worker_info is None:
+        return seed
+
+    return int(numpy.random.SeedSequence([seed, worker_info.id]).generate_state(1)[0] % 2 ** 31)
+
+
+class TorchGenerators:
+    """lazily created torch.Generator per device for random transforms on torch tensors.
+
+    Generators are seeded with `get_process_seed(seed)`. They are not pickled, but recreated in each process.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        self.seed = seed
+        self._generators: Dict[torch.device, torch.Generator] = {}
+
+    def __getitem__(self, device: Union[str, torch.device]) -> torch.Generator:
+        device = torch.device(device)
+        if device.type == "cuda" and device.index is None:
+            device = torch.device("cuda", torch.cuda.current_device())
+
+        if device not in self._generators:
+            generator = torch.Generator(device=device)
+            generator.manual_seed(get_process_seed(self.seed))
+            self._generators[device] = generator
+
+        return self._generators[device]
+
+    def __getstate__(self):
+        return {"seed": self.seed, "_generators": {}}
+
+
+def get_per_sample(values: Sequence[Any], fn: Callable[[Any], Any]) -> List[Any]:
+    """`fn(v)` for each per sample value `v` (e.g. a sample's stat), evaluated once per distinct object"""
+    computed = {}
+    for v in values:
+        if id(v) not in computed:
+            computed[id(v)] = fn(v)
+
+    return [computed[id(v)] for v in values]
+
+
+def to_batch_param(values: Sequence[Any], like: Array) -> Union[Any, Array]:
+    """per sample parameters broadcastable to batch `like` (in its floating point precision), scalar if all equal"""
+    if all(v == values[0] for v in values[1:]):
+        return values[0]
+
+    shape = (len(values),) + (1,) * (len(like.shape) - 1)
+    if isinstance(like, torch.Tensor):
+        dtype = like.dtype if like.is_floating_point() else torch.get_default_dtype()
+        return torch.tensor(values, dtype=dtype, device=like.device).reshape(shape)
+    else:
+        dtype = like.dtype if numpy.issubdtype(like.dtype, numpy.floating) else numpy.float64
+        return numpy.asarray(values, dtype=dtype).reshape(shape)
+
+
 class DTypeMapping:
     DTYPE_MAPPING = {
         "float32": "float32",
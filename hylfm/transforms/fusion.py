@@ -0,0 +1,236 @@
+"""fuse runs of elementwise and view-only transforms.
+
+Fusable transforms implement `get_fused_ops`, which describes their effect on each sample as a list of
+ - `View`s (crops, flips, ...), applied as numpy views without copying,
+ - `Affine` intensity changes, folded into a single pending multiply-add per sample, and
+ - `Barrier`s (e.g. noise), which need the current values and materialize the pending ops first.
+Random parameters are drawn in `get_fused_ops` and barriers run immediately, such that random draws happen in the
+same order as when applying the transforms one by one. The pending ops of each tensor are finally evaluated in a
+single pass (with numexpr if available), written directly into the output batch.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy
+import torch
+
+from .base import Transform
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+logger = logging.getLogger(__name__)
+
+NUMEXPR_DTYPES = {numpy.dtype(dt) for dt in ("int32", "int64", "float32", "float64")}
+
+
+class FusedOp:
+    pass
+
+
+@dataclass
+class View(FusedOp):
+    fn: Callable[[numpy.ndarray], numpy.ndarray]
+    shape: Optional[Tuple[int, ...]] = None  # sample shape after materialization, if it differs from the view's shape
+
+
+@dataclass
+class Affine(FusedOp):
+    scale: float = 1.0
+    offset: float = 0.0
+
+    def __post_init__(self):
+        # python floats for numpy's value based casting, as for the scalars used by the unfused transforms
+        self.scale = float(self.scale)
+        self.offset = float(self.offset)
+
+
+@dataclass
+class Barrier(FusedOp):
+    """operates on the materialized sample (which it may modify in place), returns it with a pending scale and offset"""
+
+    fn: Callable[[numpy.ndarray], Tuple[numpy.ndarray, float, float]]
+
+
+def clip_in_place(lower: float, upper: float) -> Barrier:
+    return Barrier(lambda x: (numpy.clip(x, lower, upper, out=x), 1.0, 0.0))
+
+
+def get_result_dtype(dtype: numpy.dtype, scale: float, offset: float) -> numpy.dtype:
+    return dtype if scale == 1 and offset == 0 else numpy.result_type(dtype, scale, offset)
+
+
+def evaluate_affine(x: numpy.ndarray, scale: float, offset: float, out: Optional[numpy.ndarray] = None):
+    """`x * scale + offset` in a single pass (if numexpr is available) into `out`"""
+    dtype = get_result_dtype(x.dtype, scale, offset)
+    if out is None:
+        out = numpy.empty(x.shape, dtype=dtype)
+    else:
+        assert out.dtype == dtype, (out.dtype, dtype)
+
+    if scale == 1 and offset == 0:
+        numpy.copyto(out, x)
+    elif numexpr is not None and x.dtype in NUMEXPR_DTYPES:
+        numexpr.evaluate(
+            "x * scale + offset", local_dict={"x": x, "scale": scale, "offset": offset}, out=out, casting="unsafe"
+        )
+    else:
+        numpy.multiply(x, scale, out=out)
+        if offset:
+            out += offset
+
+    return out
+
+
+class _TensorState:
+    """pending ops of one tensor, per sample"""
+
+    def __init__(self, samples: List[numpy.ndarray]):
+        self.views = samples
+        self.scales = [1.0] * len(samples)
+        self.offsets = [0.0] * len(samples)
+        self.shapes: List[Optional[Tuple[int, ...]]] = [None] * len(samples)  # pending reshapes
+        self.changed = False
+
+    def copy(self) -> "_TensorState":
+        copied = _TensorState(list(self.views))
+        copied.scales = list(self.scales)
+        copied.offsets = list(self.offsets)
+        copied.shapes = list(self.shapes)
+        copied.changed = self.changed
+        return copied
+
+    def get_dtype(self) -> numpy.dtype:
+        return numpy.result_type(
+            *[get_result_dtype(v.dtype, s, o) for v, s, o in zip(self.views, self.scales, self.offsets)]
+        )
+
+    def materialize_sample(self, i: int, out: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        shape = self.shapes[i]
+        if out is not None and shape is not None:
+            out = out.reshape(self.views[i].shape)
+
+        ret = evaluate_affine(self.views[i], self.scales[i], self.offsets[i], out=out)
+        return ret if shape is None else ret.reshape(shape)
+
+    def materialize(self) -> None:
+        """evaluate pending ops sample by sample"""
+        self.views = [self.materialize_sample(i) for i in range(len(self.views))]
+        self.scales = [1.0] * len(self.views)
+        self.offsets = [0.0] * len(self.views)
+        self.shapes = [None] * len(self.views)
+
+    def apply(self, i: int, op: FusedOp) -> None:
+        self.changed = True
+        if isinstance(op, View):
+            assert self.shapes[i] is None, "materialize first"
+            self.views[i] = op.fn(self.views[i])
+            self.shapes[i] = op.shape
+        elif isinstance(op, Affine):
+            # scale * (s * x + o) + offset
+            self.scales[i] = op.scale * self.scales[i]
+            self.offsets[i] = op.scale * self.offsets[i] + op.offset
+        elif isinstance(op, Barrier):
+            assert self.shapes[i] is None, "materialize first"
+            x = self.materialize_sample(i)  # always a new array, which the barrier may modify in place
+            self.views[i], scale, offset = op.fn(x)
+            self.scales[i], self.offsets[i] = float(scale), float(offset)
+        else:
+            raise NotImplementedError(type(op))
+
+    def to_batch(self) -> numpy.ndarray:
+        sample_shape = self.shapes[0] or self.views[0].shape
+        out = numpy.empty((len(self.views),) + tuple(sample_shape), dtype=self.get_dtype())
+        for i in range(len(self.views)):
+            self.materialize_sample(i, out=out[i])
+
+        return out
+
+
+def is_fusable(transform: Any) -> bool:
+    return isinstance(transform, Transform) and type(transform).get_fused_ops is not Transform.get_fused_ops
+
+
+class FusedTransform(Transform):
+    """applies a run of fusable transforms (see module docstring)"""
+
+    def __init__(self, *transforms: Transform):
+        assert all(is_fusable(t) for t in transforms), transforms
+        super().__init__()
+        self.transforms = list(transforms)
+        self.randomly_changes_shape = any(getattr(t, "randomly_changes_shape", True) for t in transforms)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({', '.join(type(t).__name__ for t in self.transforms)})"
+
+    def __call__(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        if any(isinstance(batch.get(k), torch.Tensor) for t in self.transforms for k in t.input_mapping):
+            for t in self.transforms:  # fusion is only implemented for numpy
+                batch = t(batch)
+
+            return batch
+
+        states: Dict[str, _TensorState] = {}
+        for t in self.transforms:
+            missing_inputs = [k for k in t.input_mapping if k not in batch and k not in states]
+            if missing_inputs:
+                raise ValueError(f"required keys {missing_inputs} for {t} not found in batch {list(batch.keys())}")
+
+            inputs = {}
+            for k, name in t.input_mapping.items():
+                if k not in states and isinstance(batch[k], numpy.ndarray):
+                    states[k] = _TensorState(list(batch[k]))
+
+                if k in states:
+                    if any(shape is not None for shape in states[k].shapes):
+                        states[k].materialize()
+
+                    inputs[name] = states[k].views
+                else:
+                    inputs[name] = batch[k]
+
+            input_keys = {name: k for k, name in t.input_mapping.items()}
+            for name, ops in t.get_fused_ops(**inputs).items():
+                in_key = input_keys[name]
+                out_key = t.output_mapping.get(name, name)
+                state = states[in_key]
+                if out_key != in_key:  # e.g. ChannelFromLightField(apply_to={"lf": "lfc"})
+                    state = state.copy()
+                    states[out_key] = state
+
+                for i, sample_ops in enumerate(ops):
+                    if isinstance(sample_ops, FusedOp):
+                        sample_ops = [sample_ops]
+
+                    for op in sample_ops or []:
+                        state.apply(i, op)
+
+        for key, state in states.items():
+            if state.changed:
+                batch[key] = state.to_batch()
+
+        return batch
+
+
+def fuse(transforms: Sequence[Any]) -> List[Any]:
+    """replace runs of at least two fusable transforms with a `FusedTransform`"""
+    fused = []
+    run = []
+    for t in list(transforms) + [None]:
+        if t is not None and is_fusable(t):
+            run.append(t)
+            continue
+
+        if len(run) > 1:
+            fused.append(FusedTransform(*run))
+        else:
+            fused += run
+
+        run = []
+        if t is not None:
+            fused.append(t)
+
+    return fused
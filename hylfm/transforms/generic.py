@@ -6,7 +6,9 @@ import scipy.special
 import torch
 
 from .base import DTypeMapping, Transform
+from ..datasets.collate import BatchBufferPool
 from ..hylfm_types import Array
+from ..utils.distributed import get_device
 
 logger = logging.getLogger(__name__)
 
@@ -28,18 +30,19 @@ class AddConstant(Transform):
 
 
 class Cast(Transform, DTypeMapping):
-    """Casts inputs to a specified datatype."""
+    """Casts inputs to a specified datatype and device ('numpy', a torch device, or `None` for the device of this
+    process, see `hylfm.utils.distributed.get_device`)."""
 
     def __init__(
         self,
         *,
         dtype: str,
-        device: str,
+        device: Optional[str] = None,
         numpy_kwargs: Optional[Dict[str, Any]] = None,
         non_blocking: bool = False,
         **super_kwargs,
     ):
-        assert device == "numpy" or torch.device(device), device
+        assert device is None or device == "numpy" or torch.device(device), device
         if device == "cpu" and numpy_kwargs:
             raise ValueError(f"got numpy kwargs {numpy_kwargs}, but device != 'cpu'")
 
@@ -50,6 +53,7 @@ class Cast(Transform, DTypeMapping):
         self.non_blocking = non_blocking
 
     def apply_to_batch(self, **batch: Array) -> Dict[str, Array]:
+        device = None if self.device == "numpy" else get_device() if self.device is None else torch.device(self.device)
         for key, tensor in batch.items():
             if isinstance(tensor, torch.Tensor):
                 if self.device == "numpy":
@@ -57,7 +61,7 @@ class Cast(Transform, DTypeMapping):
                 else:
                     batch[key] = tensor.to(
                         dtype=getattr(torch, self.dtype),
-                        device=torch.device(self.device),
+                        device=device,
                         non_blocking=self.non_blocking,
                     )
             elif isinstance(tensor, numpy.ndarray):
@@ -65,8 +69,16 @@ class Cast(Transform, DTypeMapping):
                     assert not self.non_blocking, "'non_blocking' not supported for numpy.ndarray"
                     batch[key] = tensor.astype(self.dtype, **self.numpy_kwargs)
                 else:
-                    batch[key] = torch.from_numpy(tensor.astype(dtype=self.dtype)).to(
-                        dtype=getattr(torch, self.dtype), device=torch.device(self.device)
+                    # no copy if dtype matches; the conversion is left to torch (on device) where possible
+                    if BatchBufferPool.get_torch_dtype(tensor.dtype) is None:
+                        tensor = tensor.astype(dtype=self.dtype)
+                    else:
+                        tensor = numpy.ascontiguousarray(tensor)  # e.g. flipped views (negative strides)
+
+                    batch[key] = torch.from_numpy(tensor).to(
+                        dtype=getattr(torch, self.dtype),
+                        device=device,
+                        non_blocking=self.non_blocking,
                     )
             else:
                 raise NotImplementedError(type(tensor))
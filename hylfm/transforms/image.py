@@ -1,5 +1,6 @@
 import logging
-from typing import Any, Callable, Collection, Dict, Optional, Sequence, Tuple, Union
+from functools import partial
+from typing import Any, Callable, Collection, Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
 import skimage.transform
@@ -8,7 +9,8 @@ import torch
 
 from hylfm.utils.for_log import DuplicateLogFilter
 from .affine_utils import get_lf_roi_in_raw_lf, get_ls_roi
-from .base import Transform
+from .base import TorchGenerators, Transform, to_batch_param
+from .fusion import Affine, View
 from ..hylfm_types import Array
 
 logger = logging.getLogger(__name__)
@@ -41,13 +43,25 @@ class Crop(Transform):
         assert len(tensor.shape) == len(crop), (tensor.shape, crop)
         return tensor[tuple(slice(lower, upper) for lower, upper in crop)]
 
+    def apply_to_batch(self, tensor: Array) -> Union[numpy.ndarray, torch.Tensor]:
+        if not isinstance(tensor, (numpy.ndarray, torch.Tensor)):
+            raise TypeError(type(tensor))
+
+        crop = self.crop if self.crop_fn is None else self.crop_fn(tuple(tensor.shape[1:]))
+        assert len(tensor.shape) == len(crop) + 1, (tensor.shape, crop)
+        return tensor[(slice(None),) + tuple(slice(lower, upper) for lower, upper in crop)]
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray]) -> Dict[str, List[View]]:
+        return {"tensor": [View(self.apply_to_sample)] * len(tensor)}
+
 
 class RandomlyFlipAxis(Transform):
     randomly_changes_shape = True
 
-    def __init__(self, axis: int, **super_kwargs):
+    def __init__(self, axis: int, seed: Optional[int] = None, **super_kwargs):
         super().__init__(**super_kwargs)
         self.axis = axis
+        self.torch_generators = TorchGenerators(seed)
 
     def apply_to_sample(self, **sample_tensors: Union[numpy.ndarray, torch.Tensor]) -> Dict[str, Any]:
         if numpy.random.uniform() < 0.5:
@@ -61,13 +75,55 @@ class RandomlyFlipAxis(Transform):
 
         return sample_tensors
 
+    def apply_to_batch(self, **batch: Union[numpy.ndarray, torch.Tensor]) -> Dict[str, Any]:
+        batch_len = len(next(iter(batch.values())))
+        if all(isinstance(tensor, torch.Tensor) for tensor in batch.values()):
+            # per sample draws on the host (no device synchronization)
+            flip = (torch.rand(batch_len, generator=self.torch_generators["cpu"]) < 0.5).numpy()
+        else:
+            flip = numpy.random.uniform(size=batch_len) < 0.5  # one draw per sample, as in apply_to_sample
+
+        if not flip.any():
+            return batch
+
+        axis = self.axis if self.axis < 0 else self.axis + 1
+        for key, tensor in batch.items():
+            if isinstance(tensor, numpy.ndarray):
+                if flip.all():
+                    batch[key] = numpy.flip(tensor, axis=axis)
+                else:
+                    flipped = tensor.copy()
+                    flipped[flip] = numpy.flip(tensor[flip], axis=axis)
+                    batch[key] = flipped
+            elif isinstance(tensor, torch.Tensor):
+                if flip.all():
+                    batch[key] = tensor.flip([axis])
+                else:
+                    flip_mask = torch.from_numpy(flip).to(tensor.device)
+                    flipped = tensor.clone()
+                    flipped[flip_mask] = tensor[flip_mask].flip([axis])
+                    batch[key] = flipped
+            else:
+                raise NotImplementedError(type(tensor))
+
+        return batch
+
+    def get_fused_ops(self, **batch: List[numpy.ndarray]) -> Dict[str, List[Optional[View]]]:
+        batch_len = len(next(iter(batch.values())))
+        flip = numpy.random.uniform(size=batch_len) < 0.5
+        flip_view = View(partial(numpy.flip, axis=self.axis))
+        return {key: [flip_view if f else None for f in flip] for key in batch}
+
 
 class RandomIntensityScale(Transform):
-    def __init__(self, factor_min: float, factor_max: float, independent: bool, **super_kwargs):
+    def __init__(
+        self, factor_min: float, factor_max: float, independent: bool, seed: Optional[int] = None, **super_kwargs
+    ):
         super().__init__(**super_kwargs)
         self.factor_min = factor_min
         self.factor_max = factor_max
         self.independent = independent
+        self.torch_generators = TorchGenerators(seed)
 
     def _get_factor(self):
         return numpy.random.uniform(low=self.factor_min, high=self.factor_max)
@@ -81,15 +137,48 @@ class RandomIntensityScale(Transform):
 
         return sample_tensors
 
+    def apply_to_batch(self, **batch: Array) -> Dict[str, Array]:
+        batch_len = len(next(iter(batch.values())))
+        if all(isinstance(tensor, torch.Tensor) for tensor in batch.values()):
+            factors = torch.empty(batch_len, 1 + len(batch) if self.independent else 1)
+            factors.uniform_(self.factor_min, self.factor_max, generator=self.torch_generators["cpu"])
+            for i, (key, tensor) in enumerate(batch.items()):
+                factor = factors[:, i if self.independent else 0].to(device=tensor.device, non_blocking=True)
+                batch[key] = tensor * factor.to(tensor.dtype).reshape((-1,) + (1,) * (tensor.dim() - 1))
+
+            return batch
+
+        # draw factors in the same order as apply_to_sample does sample by sample
+        factors = numpy.random.uniform(
+            low=self.factor_min, high=self.factor_max, size=(batch_len, 1 + len(batch) if self.independent else 1)
+        )
+        for i, (key, tensor) in enumerate(batch.items()):
+            batch[key] = tensor * to_batch_param(list(factors[:, i if self.independent else 0]), tensor)
+
+        return batch
+
+    def get_fused_ops(self, **batch: List[numpy.ndarray]) -> Dict[str, List[Affine]]:
+        batch_len = len(next(iter(batch.values())))
+        factors = numpy.random.uniform(
+            low=self.factor_min, high=self.factor_max, size=(batch_len, 1 + len(batch) if self.independent else 1)
+        )
+        return {
+            key: [Affine(scale=f) for f in factors[:, i if self.independent else 0]] for i, key in enumerate(batch)
+        }
+
 
 class RandomRotate90(Transform):
     randomly_changes_shape = True
 
-    def __init__(self, axes: Tuple[int, int] = (-2, -1), **super_kwargs):
+    def __init__(self, axes: Tuple[int, int] = (-2, -1), seed: Optional[int] = None, **super_kwargs):
         super().__init__(**super_kwargs)
         self.axes = [sa if sa < 0 else sa + 1 for sa in axes]  # add batch dim to axes
+        self.torch_generators = TorchGenerators(seed)
 
     def apply_to_batch(self, **batch: Array) -> Dict[str, Sequence]:
+        if all(isinstance(tensor, torch.Tensor) for tensor in batch.values()):
+            return self.apply_to_torch_batch(**batch)
+
         k = numpy.random.randint(4)
         for key, tensor in batch.items():
             if isinstance(tensor, numpy.ndarray):
@@ -99,6 +188,25 @@ class RandomRotate90(Transform):
 
         return batch
 
+    def apply_to_torch_batch(self, **batch: torch.Tensor) -> Dict[str, torch.Tensor]:
+        batch_len = len(next(iter(batch.values())))
+        square = all(tensor.shape[self.axes[0]] == tensor.shape[self.axes[1]] for tensor in batch.values())
+        # rotate each sample independently if rotations do not change the shape
+        ks = torch.randint(4, (batch_len if square else 1,), generator=self.torch_generators["cpu"]).tolist()
+        for key, tensor in batch.items():
+            if not square or len(set(ks)) == 1:
+                batch[key] = torch.rot90(tensor, k=ks[0], dims=self.axes)
+                continue
+
+            rotated = torch.empty_like(tensor)
+            for k in set(ks):
+                idx = torch.tensor([i for i, ki in enumerate(ks) if ki == k], device=tensor.device)
+                rotated[idx] = torch.rot90(tensor[idx], k=k, dims=self.axes)
+
+            batch[key] = rotated
+
+        return batch
+
 
 class Resize(Transform):
     def __init__(self, shape: Sequence[Union[int, float]], order: int, apply_to: str):
@@ -187,6 +295,12 @@ class CropLSforDynamicTraining(Transform):
     def apply_to_sample(self, tensor: Any, crop_name: str) -> Union[numpy.ndarray, torch.Tensor]:
         return self.crops[crop_name].apply_to_sample(tensor=tensor)
 
+    def apply_to_batch(self, tensor: Any, crop_name: str) -> Union[numpy.ndarray, torch.Tensor]:
+        return self.crops[crop_name].apply_to_batch(tensor=tensor)  # crop_name is equal for all samples in a batch
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], crop_name: str) -> Dict[str, List[View]]:
+        return self.crops[crop_name].get_fused_ops(tensor=tensor)
+
 
 class CropWhatShrinkDoesNot(Transform):
     def __init__(self, apply_to: str, crop_names: Collection[str], nnum: int, scale: int, shrink: int, wrt_ref: bool):
@@ -207,6 +321,12 @@ class CropWhatShrinkDoesNot(Transform):
     def apply_to_sample(self, tensor: Array, crop_name: str) -> Union[numpy.ndarray, torch.Tensor]:
         return self.crops[crop_name].apply_to_sample(tensor=tensor)
 
+    def apply_to_batch(self, tensor: Array, crop_name: str) -> Union[numpy.ndarray, torch.Tensor]:
+        return self.crops[crop_name].apply_to_batch(tensor=tensor)  # crop_name is equal for all samples in a batch
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], crop_name: str) -> Dict[str, List[View]]:
+        return self.crops[crop_name].get_fused_ops(tensor=tensor)
+
 
 class Pad(Transform):
     def __init__(self, pad_width: Sequence[Sequence[int]], pad_mode: str, nnum: Optional[int] = None, **super_kwargs):
@@ -1,4 +1,10 @@
+from typing import Dict, List
+
+import numpy
+import torch
+
 from .base import Transform
+from .fusion import View
 from ..hylfm_types import Array
 
 
@@ -19,6 +25,37 @@ class ChannelFromLightField(Transform):
             .reshape(self.nnum ** 2, x // self.nnum, y // self.nnum)
         )
 
+    def apply_to_batch(self, tensor: Array):
+        assert len(tensor.shape) == 4, tensor.shape
+        b, c, x, y = tensor.shape
+        assert c == 1
+        assert x % self.nnum == 0, (x, self.nnum)
+        assert y % self.nnum == 0, (y, self.nnum)
+        tensor = tensor.reshape(b, x // self.nnum, self.nnum, y // self.nnum, self.nnum)
+        if isinstance(tensor, torch.Tensor):
+            tensor = tensor.permute(0, 2, 4, 1, 3)
+        else:
+            tensor = tensor.transpose(0, 2, 4, 1, 3)
+
+        return tensor.reshape(b, self.nnum ** 2, x // self.nnum, y // self.nnum)
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray]) -> Dict[str, List[View]]:
+        ops = []
+        for t in tensor:
+            assert len(t.shape) == 3, t.shape
+            c, x, y = t.shape
+            assert c == 1
+            assert x % self.nnum == 0, (x, self.nnum)
+            assert y % self.nnum == 0, (y, self.nnum)
+            # transposed view, materialized directly in the channel layout
+            ops.append(View(self.get_transposed_view, shape=(self.nnum ** 2, x // self.nnum, y // self.nnum)))
+
+        return {"tensor": ops}
+
+    def get_transposed_view(self, tensor: numpy.ndarray) -> numpy.ndarray:
+        c, x, y = tensor.shape
+        return tensor.reshape(x // self.nnum, self.nnum, y // self.nnum, self.nnum).transpose(1, 3, 0, 2)
+
 
 class LightFieldFromChannel(Transform):
     def __init__(self, nnum: int, **super_kwargs):
@@ -1,11 +1,14 @@
-from typing import Any, Dict, Optional, Tuple
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy
 import skimage.util
+import torch
 
 from hylfm.hylfm_types import Array
 from hylfm.stat_ import DatasetStat
-from .base import Transform
+from .base import TorchGenerators, Transform, get_per_sample, get_process_seed, to_batch_param
+from .fusion import Barrier
 
 try:
     from typing import Literal
@@ -22,6 +25,7 @@ class AdditiveGaussianNoise(Transform):
         sigma: Optional[float] = None,
         percentile_range_to_compute_sigma: Tuple[float, float] = (0.0, 100.0),
         scale_factor: float = 1.0,
+        seed: Optional[int] = None,
         apply_to: str,
     ):
         assert isinstance(apply_to, str)
@@ -33,18 +37,45 @@ class AdditiveGaussianNoise(Transform):
         self.sigma = sigma
         self.percentile_range_to_compute_sigma = percentile_range_to_compute_sigma
         self.scale_factor = scale_factor
+        self.torch_generators = TorchGenerators(seed)
 
-    def apply_to_sample(self, tensor, stat: Dict[str, DatasetStat]):
-        if not isinstance(tensor, numpy.ndarray):
-            raise NotImplementedError(type(tensor))
-
+    def get_scale(self, stat: Dict[str, DatasetStat]) -> float:
         assert isinstance(stat, dict), type(stat)
         if self.sigma is None:
             mean, sigma = stat[self.apply_to].get_mean_std(name=self.apply_to, percentile_range=self.percentile_range_to_compute_sigma)
         else:
             sigma = self.sigma
 
-        scale = sigma * self.scale_factor
+        return sigma * self.scale_factor
+
+    def apply_to_sample(self, tensor, stat: Dict[str, DatasetStat]):
+        if not isinstance(tensor, numpy.ndarray):
+            raise NotImplementedError(type(tensor))
+
+        return self.add_noise(tensor, self.get_scale(stat))
+
+    def apply_to_batch(self, tensor, stat: List[Dict[str, DatasetStat]]):
+        if isinstance(tensor, torch.Tensor):
+            scale = to_batch_param(get_per_sample(stat, self.get_scale), tensor)
+            noise = torch.randn(
+                tensor.shape, generator=self.torch_generators[tensor.device], device=tensor.device, dtype=tensor.dtype
+            )
+            return tensor + noise * scale
+        elif not isinstance(tensor, numpy.ndarray):
+            raise NotImplementedError(type(tensor))
+
+        # noise for the whole batch is drawn in one go, which equals drawing it sample by sample
+        return self.add_noise(tensor, to_batch_param(get_per_sample(stat, self.get_scale), tensor))
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], stat: List[Dict[str, DatasetStat]]):
+        scales = get_per_sample(stat, self.get_scale)
+        return {"tensor": [Barrier(partial(self.add_fused_noise, scale=s)) for s in scales]}
+
+    def add_fused_noise(self, tensor: numpy.ndarray, scale: float):
+        return self.add_noise(tensor, scale), 1.0, 0.0
+
+    @staticmethod
+    def add_noise(tensor: numpy.ndarray, scale) -> numpy.ndarray:
         if numpy.issubdtype(tensor.dtype, numpy.floating):
             tensor += numpy.random.normal(loc=0, scale=scale, size=tuple(tensor.shape))
             return tensor
@@ -68,22 +99,63 @@ class PoissonNoise(Transform):
         if peak is None and peak_percentile is None:
             raise ValueError("Require argument 'peak' or 'peak_percentile'.")
 
-        self.generator = numpy.random.default_rng(seed=seed)
+        self.seed = seed
+        self._generator: Optional[numpy.random.Generator] = None
+        self.torch_generators = TorchGenerators(seed)
         self.peak = max(min_peak, peak)
         self.peak_percentile = peak_percentile
         self.min_peak = min_peak
 
-    def apply_to_sample(self, tensor: Array, stat: Dict[str, DatasetStat]):
+    @property
+    def generator(self) -> numpy.random.Generator:
+        """created lazily in each process (not pickled), such that DataLoader workers draw different numbers"""
+        if self._generator is None:
+            self._generator = numpy.random.default_rng(seed=get_process_seed(self.seed))
+
+        return self._generator
+
+    def __getstate__(self):
+        return dict(self.__dict__, _generator=None)
+
+    def get_peak(self, stat: Dict[str, DatasetStat]) -> float:
         assert isinstance(stat, dict), type(stat)
         if self.peak is None:
             peak = stat[self.apply_to].get_percentile(name=self.apply_to, percentile=self.peak_percentile)
-            peak = max(self.min_peak, peak)
+            return max(self.min_peak, peak)
         else:
-            peak = self.peak
+            return self.peak
 
+    def apply_to_sample(self, tensor: Array, stat: Dict[str, DatasetStat]):
+        peak = self.get_peak(stat)
         offset = min(0, tensor.min())
         return self.generator.poisson((tensor - offset) * peak) / peak + offset
 
+    def apply_to_batch(self, tensor: Array, stat: List[Dict[str, DatasetStat]]):
+        peak = to_batch_param(get_per_sample(stat, self.get_peak), tensor)
+        if isinstance(tensor, torch.Tensor):
+            offset = tensor.reshape(tensor.shape[0], -1).min(1).values.clamp(max=0)
+            offset = offset.reshape((-1,) + (1,) * (tensor.dim() - 1))
+            generator = self.torch_generators[tensor.device]
+            return torch.poisson((tensor - offset) * peak, generator=generator) / peak + offset
+
+        offset = to_batch_param(list(numpy.minimum(0, tensor.reshape(tensor.shape[0], -1).min(1))), tensor)
+        # one draw for the whole batch yields the same numbers as drawing sample by sample
+        return self.generator.poisson((tensor - offset) * peak) / peak + offset
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], stat: List[Dict[str, DatasetStat]]):
+        return {"tensor": [Barrier(partial(self.draw_fused, peak=p)) for p in get_per_sample(stat, self.get_peak)]}
+
+    def draw_fused(self, tensor: numpy.ndarray, peak: float):
+        """draw poisson noise, leaving the rescaling (`/ peak + offset`) pending"""
+        offset = min(0, tensor.min())
+        if numpy.issubdtype(tensor.dtype, numpy.floating):
+            tensor -= offset
+            tensor *= peak
+        else:
+            tensor = (tensor - offset) * peak
+
+        return self.generator.poisson(tensor), 1 / peak, offset
+
 
 class RandomNoise(Transform):
     def __init__(
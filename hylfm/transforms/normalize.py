@@ -1,10 +1,11 @@
-from typing import Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy
 import torch
 
 from hylfm.stat_ import DatasetStat
-from .base import Transform
+from .base import Transform, get_per_sample, to_batch_param
+from .fusion import Affine, Barrier, FusedOp, clip_in_place
 from ..hylfm_types import Array
 
 
@@ -41,7 +42,7 @@ class Normalize01Dataset(Transform):
         self.max_percentile = max_percentile
         self.clip = clip
 
-    def apply_to_sample(self, tensor: Array, stat: DatasetStat):
+    def get_min_max(self, stat: Dict[str, DatasetStat]) -> Tuple[float, float]:
         percentiles2compute = [
             p for p, m in [(self.min_percentile, self.min), (self.max_percentile, self.max)] if m is None
         ]
@@ -54,12 +55,35 @@ class Normalize01Dataset(Transform):
         min_ = self.min or min_max.pop()
         assert not min_max, min_max
         assert min_ < max_, (min_, max_)
+        return min_, max_
+
+    def normalize(self, tensor: Array, min_, max_) -> Array:
         tensor = (tensor - min_) / (max_ - min_)
         if self.clip:
             tensor = numpy.clip(tensor, 0.0, 1.0)
 
         return tensor
 
+    def apply_to_sample(self, tensor: Array, stat: Dict[str, DatasetStat]):
+        return self.normalize(tensor, *self.get_min_max(stat))
+
+    def apply_to_batch(self, tensor: Array, stat: List[Dict[str, DatasetStat]]):
+        min_max = get_per_sample(stat, self.get_min_max)
+        return self.normalize(
+            tensor, to_batch_param([mi for mi, _ in min_max], tensor), to_batch_param([ma for _, ma in min_max], tensor)
+        )
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], stat: List[Dict[str, DatasetStat]]):
+        ops = []
+        for min_, max_ in get_per_sample(stat, self.get_min_max):
+            sample_ops: List[FusedOp] = [Affine(scale=1 / (max_ - min_), offset=-min_ / (max_ - min_))]
+            if self.clip:
+                sample_ops.append(clip_in_place(0.0, 1.0))
+
+            ops.append(sample_ops)
+
+        return {"tensor": ops}
+
 
 class Normalize01Sample(Transform):
     def __init__(
@@ -143,11 +167,14 @@ class NormalizeMeanStd(Transform):
         self.determine_mean_std_from_stat = determine_mean_std_from_stat
         self.epsilon = epsilon
 
-    def apply_to_sample(self, tensor: Array, stat: DatasetStat):
+    def get_mean_std_from_stat(self, stat: Dict[str, DatasetStat]) -> Tuple[float, float]:
+        return stat[self.apply_to].get_mean_std(name=self.apply_to, percentile_range=self.percentile_range)
+
+    def apply_to_sample(self, tensor: Array, stat: Dict[str, DatasetStat]):
         if self.mean is None:
             assert self.std is None
             if self.determine_mean_std_from_stat:
-                mean, std = stat[self.apply_to].get_mean_std(name=self.apply_to, percentile_range=self.percentile_range)
+                mean, std = self.get_mean_std_from_stat(stat)
             elif self.percentile_range == (0.0, 100.0):
                 mean = tensor.mean()
                 std = tensor.std()
@@ -164,6 +191,38 @@ class NormalizeMeanStd(Transform):
 
         return (tensor - mean) / (std + self.epsilon)
 
+    def apply_to_batch(self, tensor: Array, stat: List[Dict[str, DatasetStat]]):
+        if self.mean is not None:
+            assert self.std is not None
+            mean, std = self.mean, self.std
+        elif self.determine_mean_std_from_stat:
+            mean_std = get_per_sample(stat, self.get_mean_std_from_stat)
+            mean = to_batch_param([m for m, _ in mean_std], tensor)
+            std = to_batch_param([s for _, s in mean_std], tensor)
+        else:
+            mean, std = get_sample_mean_std(tensor, self.percentile_range)
+
+        return (tensor - mean) / (std + self.epsilon)
+
+    def get_fused_ops(self, tensor: List[numpy.ndarray], stat: List[Dict[str, DatasetStat]]):
+        if self.mean is not None:
+            affine = Affine(1 / (self.std + self.epsilon), -self.mean / (self.std + self.epsilon))
+            return {"tensor": [affine] * len(tensor)}
+        elif self.determine_mean_std_from_stat:
+            return {
+                "tensor": [
+                    Affine(1 / (std + self.epsilon), -mean / (std + self.epsilon))
+                    for mean, std in get_per_sample(stat, self.get_mean_std_from_stat)
+                ]
+            }
+        else:
+            return {"tensor": [Barrier(self.get_data_dependent_affine)] * len(tensor)}
+
+    def get_data_dependent_affine(self, tensor: numpy.ndarray):
+        mean, std = get_sample_mean_std(tensor[None], self.percentile_range)
+        mean, std = mean.item(), std.item()
+        return tensor, 1 / (std + self.epsilon), -mean / (std + self.epsilon)
+
 
 class NormalizeMeanStdDataset(Transform):
     def __init__(
@@ -204,16 +263,32 @@ class NormalizeMeanStdDataset(Transform):
         self.std = std
         self.epsilon = epsilon
 
-    def apply_to_sample(self, tensor: Array, stat: DatasetStat):
+    def get_mean_std(self, stat: Dict[str, DatasetStat]) -> Tuple[float, float]:
         if self.mean is None:
             assert self.std is None
-            mean, std = stat[self.apply_to].get_mean_std(name=self.apply_to, percentile_range=self.percentile_range)
+            return stat[self.apply_to].get_mean_std(name=self.apply_to, percentile_range=self.percentile_range)
         else:
             assert self.std is not None
-            mean, std = self.mean, self.std
+            return self.mean, self.std
+
+    def apply_to_sample(self, tensor: Array, stat: Dict[str, DatasetStat]):
+        mean, std = self.get_mean_std(stat)
+        return (tensor - mean) / (std + self.epsilon)
 
+    def apply_to_batch(self, tensor: Array, stat: List[Dict[str, DatasetStat]]):
+        mean_std = get_per_sample(stat, self.get_mean_std)
+        mean = to_batch_param([m for m, _ in mean_std], tensor)
+        std = to_batch_param([s for _, s in mean_std], tensor)
         return (tensor - mean) / (std + self.epsilon)
 
+    def get_fused_ops(self, tensor: List[numpy.ndarray], stat: List[Dict[str, DatasetStat]]):
+        return {
+            "tensor": [
+                Affine(1 / (std + self.epsilon), -mean / (std + self.epsilon))
+                for mean, std in get_per_sample(stat, self.get_mean_std)
+            ]
+        }
+
 
 class NormalizeMeanStdSample(Transform):
     def __init__(
@@ -252,6 +327,40 @@ class NormalizeMeanStdSample(Transform):
         std = tensor.std()
         return (tensor - mean) / (std + self.epsilon)
 
+    def apply_to_batch(self, tensor: Array):
+        if not isinstance(tensor, numpy.ndarray):
+            raise NotImplementedError(type(tensor))
+
+        if tensor.shape[1] != 1:
+            raise NotImplementedError("multichannel")
+
+        tensor = clip_samples(tensor, (self.percentile_min, self.percentile_max))
+        mean, std = get_sample_mean_std(tensor, (None, None))
+        return (tensor - mean) / (std + self.epsilon)
+
+
+def clip_samples(tensor: Array, percentile_range: Tuple[Optional[float], Optional[float]]) -> Array:
+    """clip each sample in a batch to its percentile range"""
+    pmin, pmax = percentile_range
+    if pmin in (None, 0.0) and pmax in (None, 100.0):
+        return tensor
+    elif not isinstance(tensor, numpy.ndarray):
+        raise NotImplementedError(type(tensor))
+
+    flat = tensor.reshape(tensor.shape[0], -1)
+    lower = None if pmin is None else numpy.percentile(flat, pmin, axis=1, keepdims=True)
+    upper = None if pmax is None else numpy.percentile(flat, pmax, axis=1, keepdims=True)
+    return flat.clip(lower, upper).reshape(tensor.shape)
+
+
+def get_sample_mean_std(
+    tensor: Array, percentile_range: Tuple[Optional[float], Optional[float]]
+) -> Tuple[Array, Array]:
+    """mean and standard deviation of each sample in a batch, after clipping it to its percentile range"""
+    keepdims_shape = (tensor.shape[0],) + (1,) * (len(tensor.shape) - 1)
+    flat = clip_samples(tensor, percentile_range).reshape(tensor.shape[0], -1)
+    return flat.mean(1).reshape(keepdims_shape), flat.std(1).reshape(keepdims_shape)
+
 
 class NormalizeMSE(Transform):
     def __init__(self, *, apply_to: str, target_name: str, return_alpha_beta: bool = True):
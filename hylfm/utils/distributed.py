@@ -0,0 +1,139 @@
+"""helpers for distributed (DistributedDataParallel) training.
+
+Launch with torchrun, e.g. `torchrun --nproc_per_node=4 -m hylfm train ...`. All helpers fall back to single process
+behavior if no process group is initialized.
+"""
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+import torch
+import torch.distributed
+
+from hylfm import settings
+
+logger = logging.getLogger(__name__)
+
+
+def is_distributed() -> bool:
+    return torch.distributed.is_available() and torch.distributed.is_initialized()
+
+
+def get_rank() -> int:
+    return torch.distributed.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    return torch.distributed.get_world_size() if is_distributed() else 1
+
+
+def get_local_rank() -> int:
+    return int(os.environ.get("LOCAL_RANK", 0))
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def get_device() -> torch.device:
+    """cuda device of this process (if available)"""
+    if torch.cuda.is_available():
+        return torch.device("cuda", torch.cuda.current_device())
+    else:
+        return torch.device("cpu")
+
+
+def init_distributed(backend: Optional[str] = None) -> bool:
+    """initialize the default process group if launched with several processes (WORLD_SIZE > 1)"""
+    if is_distributed():
+        return True
+
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return False
+
+    if backend is None:
+        backend = settings.distributed_backend or ("nccl" if torch.cuda.is_available() else "gloo")
+
+    if torch.cuda.is_available():
+        torch.cuda.set_device(get_local_rank())  # plain "cuda" now refers to this process' device
+
+    torch.distributed.init_process_group(backend=backend)
+    logger.info("initialized process group (%s): rank %s of %s", backend, get_rank(), get_world_size())
+    return True
+
+
+def get_reduce_device() -> torch.device:
+    if is_distributed() and torch.distributed.get_backend() == "nccl":
+        return get_device()
+    else:
+        return torch.device("cpu")
+
+
+def all_reduce_sum(value: Any) -> Any:
+    """sum of `value` (float, int, numpy.ndarray or torch.Tensor) over all ranks"""
+    if not is_distributed():
+        return value
+
+    tensor = torch.as_tensor(value, dtype=torch.float64)
+    reduced = tensor.to(get_reduce_device())
+    torch.distributed.all_reduce(reduced, op=torch.distributed.ReduceOp.SUM)
+    reduced = reduced.cpu()
+    if isinstance(value, torch.Tensor):
+        return reduced.to(value)
+    elif isinstance(value, (int, float)):
+        return type(value)(reduced.item())
+    else:
+        return reduced.numpy().astype(value.dtype)
+
+
+def any_rank(flag: bool) -> bool:
+    """True if `flag` is True on any rank (e.g. to stop all ranks early together)"""
+    if not is_distributed():
+        return flag
+
+    tensor = torch.tensor([int(flag)], device=get_reduce_device())
+    torch.distributed.all_reduce(tensor, op=torch.distributed.ReduceOp.MAX)
+    return bool(tensor.item())
+
+
+def all_gather_object(obj: Any) -> List[Any]:
+    if not is_distributed():
+        return [obj]
+
+    gathered = [None] * get_world_size()
+    torch.distributed.all_gather_object(gathered, obj)
+    return gathered
+
+
+def broadcast_object(obj: Any, src: int = 0) -> Any:
+    """`obj` of rank `src` on all ranks"""
+    if not is_distributed():
+        return obj
+
+    objs = [obj]
+    torch.distributed.broadcast_object_list(objs, src=src)
+    return objs[0]
+
+
+def get_shared_seed() -> int:
+    """a random seed, equal on all ranks"""
+    return broadcast_object(int(torch.empty((), dtype=torch.int64).random_().item()))
+
+
+def barrier() -> None:
+    if is_distributed():
+        torch.distributed.barrier()
+
+
+@contextmanager
+def main_process_first() -> Iterator[None]:
+    """run the block on rank 0 before all other ranks, e.g. to build caches that the other ranks then reuse"""
+    if not is_main_process():
+        barrier()
+
+    try:
+        yield
+    finally:
+        if is_main_process():
+            barrier()  # (also if rank 0 failed, instead of leaving the others waiting)
@@ -0,0 +1,38 @@
+"""mixed precision (autocast) helpers, see `PrecisionChoice`"""
+import logging
+from contextlib import nullcontext
+from typing import ContextManager, Optional, Union
+
+import torch
+
+from hylfm.hylfm_types import PrecisionChoice
+
+logger = logging.getLogger(__name__)
+
+
+AUTOCAST_DTYPES = {PrecisionChoice.fp16: torch.float16, PrecisionChoice.bf16: torch.bfloat16}
+
+
+def get_autocast_dtype(precision: Union[PrecisionChoice, str]) -> Optional[torch.dtype]:
+    return AUTOCAST_DTYPES.get(PrecisionChoice(precision))
+
+
+def autocast(precision: Union[PrecisionChoice, str], device: Union[torch.device, str]) -> ContextManager:
+    """autocast context for `device` or a null context for fp32"""
+    dtype = get_autocast_dtype(precision)
+    if dtype is None:
+        return nullcontext()
+
+    if not hasattr(torch, "autocast"):  # added in pytorch 1.10
+        raise RuntimeError(f"{PrecisionChoice(precision).value} requires pytorch>=1.10, got {torch.__version__}")
+
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype)
+
+
+def get_grad_scaler(precision: Union[PrecisionChoice, str], device: Union[torch.device, str]):
+    """gradient scaler, only enabled for fp16 on cuda (bf16 has the exponent range of fp32 and needs no scaling)"""
+    enabled = PrecisionChoice(precision) == PrecisionChoice.fp16 and torch.device(device).type == "cuda"
+    if PrecisionChoice(precision) == PrecisionChoice.fp16 and not enabled:
+        logger.warning("fp16 without gradient scaling on %s, consider bf16 instead", device)
+
+    return torch.cuda.amp.GradScaler(enabled=enabled)
@@ -0,0 +1,117 @@
+"""benchmark HyLFM_Net in mixed precision and channels last memory format against fp32 (on cpu by default)
+
+For each mode forward (eval) and forward + backward (train) are timed, and the metrics of the validation `MetricGroup`
+are compared to the fp32 metrics of the same model, input and target.
+
+example: python scripts/benchmark_precision.py --nnum 19 --z_out 49 --size 11 --batch_size 1
+"""
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import torch
+import typer
+
+from hylfm import metrics
+from hylfm.hylfm_types import PrecisionChoice
+from hylfm.metrics import MetricGroup
+from hylfm.model import HyLFM_Net
+from hylfm.utils.precision import autocast
+
+app = typer.Typer()
+
+
+def get_metric_group(data_range: float = 1.0) -> MetricGroup:
+    # validation metrics (see Run.get_metric_group) without MS-SSIM, which requires large volumes, and bead metrics
+    return MetricGroup(
+        metrics.MSE(),
+        metrics.NRMSE(),
+        metrics.PSNR(data_range=data_range),
+        metrics.SSIM(data_range=data_range, size_average=True, win_size=11, win_sigma=1.5, channel=1, spatial_dims=3),
+        metrics.SmoothL1(),
+    )
+
+
+def time_it(fn, repeat: int) -> float:
+    fn()  # warm up
+    start = perf_counter()
+    for _ in range(repeat):
+        fn()
+
+    return (perf_counter() - start) / repeat
+
+
+def run_mode(
+    model: HyLFM_Net, lfc: torch.Tensor, tgt: torch.Tensor, precision: PrecisionChoice, repeat: int
+) -> Tuple[float, float, Dict[str, float]]:
+    def forward():
+        with torch.no_grad(), autocast(precision, lfc.device):
+            return model(lfc).float()
+
+    def train_step():
+        with autocast(precision, lfc.device):
+            pred = model(lfc).float()
+
+        torch.nn.functional.l1_loss(pred, tgt).backward()
+        model.zero_grad()
+
+    model.eval()
+    t_eval = time_it(forward, repeat)
+    model.train()
+    t_train = time_it(train_step, repeat)
+
+    model.eval()
+    metric_group = get_metric_group()
+    metric_group.update_with_batch(prediction=forward(), target=tgt)
+    return t_eval, t_train, metric_group.compute()
+
+
+@app.command()
+def benchmark(
+    nnum: int = typer.Option(19, "--nnum"),
+    z_out: int = typer.Option(49, "--z_out"),
+    size: int = typer.Option(11, "--size", help="light field size in lenslets"),
+    batch_size: int = typer.Option(1, "--batch_size"),
+    repeat: int = typer.Option(3, "--repeat"),
+    rtol: float = typer.Option(0.05, "--rtol", help="relative metric tolerance w.r.t. fp32"),
+    device: str = typer.Option("cpu", "--device"),
+    seed: int = typer.Option(0, "--seed"),
+):
+    torch.manual_seed(seed)
+    model = HyLFM_Net(z_out=z_out, nnum=nnum).to(device)
+    lfc = torch.rand(batch_size, nnum ** 2, size, size, device=device)
+    with torch.no_grad():
+        ref = model(lfc)
+        # a target close to the fp32 prediction, such that metrics are in a realistic range
+        tgt = (ref + 0.1 * ref.std() * torch.randn_like(ref)).clamp(0, 1)
+
+    modes: List[Tuple[PrecisionChoice, bool]] = [(p, cl) for p in PrecisionChoice for cl in (False, True)]
+    if device == "cpu":
+        modes = [(p, cl) for p, cl in modes if p != PrecisionChoice.fp16]  # fp16 (with grad scaling) targets cuda
+
+    results = {}
+    for precision, channels_last in modes:
+        model.set_channels_last(channels_last)
+        results[precision, channels_last] = run_mode(model, lfc, tgt, precision, repeat)
+
+    t_eval_ref, t_train_ref, metrics_ref = results[PrecisionChoice.fp32, False]
+    failed = []
+    for (precision, channels_last), (t_eval, t_train, mode_metrics) in results.items():
+        mode = f"{precision.value}{' channels_last' if channels_last else ''}"
+        print(
+            f"{mode:18} eval {t_eval:8.3f}s ({t_eval_ref / t_eval:4.2f}x)  "
+            f"train {t_train:8.3f}s ({t_train_ref / t_train:4.2f}x)"
+        )
+        for name, value in mode_metrics.items():
+            value_ref = metrics_ref[name]
+            rel_diff = abs(value - value_ref) / max(abs(value_ref), 1e-8)
+            print(f"    {name:12} {value:12.6g} (fp32: {value_ref:12.6g}, rel. diff: {rel_diff:.2e})")
+            if rel_diff > rtol:
+                failed.append((mode, name))
+
+    if failed:
+        typer.echo(f"metrics differ by more than rtol={rtol}: {failed}", err=True)
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
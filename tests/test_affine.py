@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import numpy
+import pytest
+import torch
+import torch.nn.functional
+from scipy.spatial.transform import Rotation
+
+from hylfm.transforms.affine import AffineTransformation, scipy_form2torch_theta
+from hylfm.transforms.affine_resample import get_affine_grid_planes, get_translation, grid_sample_chunked
+
+OUT_SHAPE = (11, 13, 12)
+
+
+@pytest.fixture
+def matrix():
+    """output to input coordinates (scipy form): rotation about the first axis, shear and scaling"""
+    matrix = numpy.eye(4)
+    matrix[:3, :3] = Rotation.from_euler("x", 17, degrees=True).as_matrix()
+    matrix[:3, :3] = matrix[:3, :3].dot(numpy.array([[1, 0, 0], [0.2, 1, 0], [0, 0, 1]])) * 0.9
+    return get_translation([-1.0, 2.0, 1.0]).dot(matrix)
+
+
+@pytest.fixture
+def ipt():
+    return torch.from_numpy(numpy.random.default_rng(0).uniform(size=(3, 2, 9, 14, 12)))
+
+
+def grid_sample_full(ipt, matrix, align_corners, padding_mode):
+    grid = AffineTransformation.get_affine_grid(matrix, ipt.shape[2:], OUT_SHAPE, align_corners).to(ipt)
+    return torch.nn.functional.grid_sample(
+        ipt,
+        grid.expand(ipt.shape[0], -1, -1, -1, -1),
+        align_corners=align_corners,
+        mode="bilinear",
+        padding_mode=padding_mode,
+    )
+
+
+@pytest.mark.parametrize("align_corners", [False, True])
+def test_get_affine_grid_planes(matrix, align_corners):
+    theta = scipy_form2torch_theta(matrix, (9, 14, 12), OUT_SHAPE)
+    full = torch.nn.functional.affine_grid(theta, (1, 1) + OUT_SHAPE, align_corners=align_corners)
+    planes = [0, 4, 10]
+    numpy.testing.assert_allclose(
+        get_affine_grid_planes(theta, OUT_SHAPE, planes, align_corners).numpy(), full[:, planes].numpy(), atol=1e-6
+    )
+
+
+@pytest.mark.parametrize("align_corners", [False, True])
+@pytest.mark.parametrize("padding_mode", ["zeros", "border"])
+def test_grid_sample_chunked_equals_full_grid(ipt, matrix, align_corners, padding_mode):
+    out = grid_sample_chunked(
+        ipt,
+        scipy_form2torch_theta(matrix, ipt.shape[2:], OUT_SHAPE),
+        output_shape=OUT_SHAPE,
+        align_corners=align_corners,
+        mode="bilinear",
+        padding_mode=padding_mode,
+        chunk_size=4,
+    )
+    expected = grid_sample_full(ipt, matrix, align_corners, padding_mode)
+    numpy.testing.assert_allclose(out.numpy(), expected.numpy(), atol=1e-6)
+
+
+@pytest.mark.parametrize("align_corners", [False, True])
+@pytest.mark.parametrize("padding_mode", ["zeros", "border"])
+def test_sample_planes_equals_full_grid(ipt, matrix, align_corners, padding_mode):
+    planes = [0, 5, 10]
+    trf = SimpleNamespace(align_corners=align_corners, mode="bilinear", padding_mode=padding_mode)
+    out = AffineTransformation._sample_planes(trf, ipt, matrix, OUT_SHAPE, planes)
+    full = grid_sample_full(ipt, matrix, align_corners, padding_mode)
+    expected = torch.stack([full[b, :, p : p + 1] for b, p in enumerate(planes)])
+    numpy.testing.assert_allclose(out.numpy(), expected.numpy(), atol=1e-6)
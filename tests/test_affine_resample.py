@@ -0,0 +1,131 @@
+import numpy
+import pytest
+import torch
+from scipy.ndimage import affine_transform
+from scipy.spatial.transform import Rotation
+
+from hylfm import settings
+from hylfm.transforms.affine_resample import (
+    AffineGridCache,
+    affine_transform_chunked,
+    affine_transform_planes,
+    get_output_roi,
+    get_translation,
+)
+
+
+def get_matrix(degrees: float, shear: float, scale: float, shift) -> numpy.ndarray:
+    """output to input coordinates (scipy form): rotation about the first axis, shear and scaling"""
+    matrix = numpy.eye(4)
+    matrix[:3, :3] = Rotation.from_euler("x", degrees, degrees=True).as_matrix()
+    matrix[:3, :3] = matrix[:3, :3].dot(numpy.array([[1, 0, 0], [shear, 1, 0], [0, 0, 1]])) * scale
+    return get_translation(shift).dot(matrix)
+
+
+MATRICES = [
+    get_matrix(0, 0, 1.0, [1.5, -2.0, 0.5]),
+    get_matrix(17, 0.2, 0.9, [-1.0, 2.0, 1.0]),
+    get_matrix(-30, -0.3, 1.2, [2.0, 5.0, -3.0]),
+]
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+@pytest.mark.parametrize("matrix", MATRICES)
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_affine_transform_chunked_equals_scipy(order, matrix, max_workers, monkeypatch):
+    monkeypatch.setattr(settings, "max_workers_for_affine", max_workers)
+    rng = numpy.random.default_rng(0)
+    ipt = rng.uniform(size=(2, 2, 9, 14, 12))
+    output_shape = (11, 13, 12)  # chunk size does not divide the output planes
+    out = affine_transform_chunked(ipt, matrix, output_shape=output_shape, order=order, mode="constant", chunk_size=4)
+    expected = numpy.stack(
+        [
+            [affine_transform(c, matrix, output_shape=output_shape, order=order, mode="constant") for c in sample]
+            for sample in ipt
+        ]
+    )
+    numpy.testing.assert_allclose(out, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("order", [0, 1, 3])
+@pytest.mark.parametrize("matrix", MATRICES)
+def test_affine_transform_planes_equals_scipy(order, matrix):
+    rng = numpy.random.default_rng(0)
+    ipt = rng.uniform(size=(3, 2, 9, 14, 12))
+    output_shape = (11, 13, 12)
+    planes = [0, 5, 10]
+    out = affine_transform_planes(ipt, matrix, output_shape=output_shape, planes=planes, order=order, mode="constant")
+    expected = numpy.stack(
+        [
+            [
+                affine_transform(c, matrix, output_shape=output_shape, order=order, mode="constant")[p : p + 1]
+                for c in sample
+            ]
+            for sample, p in zip(ipt, planes)
+        ]
+    )
+    numpy.testing.assert_allclose(out, expected, atol=1e-6)
+
+
+def get_ones_roi(matrix: numpy.ndarray, in_shape, out_shape):
+    """output roi as determined by transforming a volume of ones"""
+    ones_out = affine_transform(numpy.ones(in_shape), matrix, output_shape=out_shape, order=0, mode="constant") > 0
+    dims = [ones_out.max(1).max(1), ones_out.max(0).max(1), ones_out.max(0).max(0)]
+    return [(int(numpy.argmax(dim)), -int(numpy.argmax(dim[::-1]))) for dim in dims]
+
+
+@pytest.mark.parametrize("matrix", MATRICES)
+def test_get_output_roi(matrix):
+    in_shape, out_shape = (9, 14, 12), (15, 19, 17)
+    roi = get_output_roi(matrix, in_shape, out_shape)
+    ones_roi = get_ones_roi(matrix, in_shape, out_shape)
+    if numpy.allclose(matrix[:3, :3], numpy.eye(3)):
+        assert roi == ones_roi
+    else:
+        # may include one more boundary plane that the input polytope only touches between voxel centers
+        for (start, neg_end), (ones_start, ones_neg_end) in zip(roi, ones_roi):
+            assert ones_start - 1 <= start <= ones_start
+            assert ones_neg_end <= neg_end <= ones_neg_end + 1
+
+
+def test_affine_grid_cache():
+    cache = AffineGridCache(budget_bytes=700)  # two float64 grids of 320 bytes
+    created = []
+
+    def get(name, dtype=torch.float64, shape=(4, 10)):
+        def create():
+            created.append(name)
+            return torch.zeros(shape, dtype=torch.float64)
+
+        return cache.get((name,), like=torch.zeros(1, dtype=dtype), create=create)
+
+    a = get("a")
+    get("b")
+    assert cache.nbytes == 640
+    assert get("a") is a  # hit, b is least recently used now
+    get("c")
+    assert (cache.evictions, cache.nbytes) == (1, 640)
+    assert get("a") is a
+    get("b")  # evicts c
+    assert created == ["a", "b", "c", "b"]
+
+    # dtype and device are part of the key
+    a32 = get("a", dtype=torch.float32)
+    assert a32.dtype == torch.float32 and a32 is not a
+    assert (cache.evictions, cache.nbytes) == (3, 160 + 320)  # evicted a (float64)
+
+    # grids larger than the budget are not cached
+    get("big", shape=(100, 10))
+    get("big", shape=(100, 10))
+    assert created[-2:] == ["big", "big"]
+
+    stats = cache.stats()
+    assert stats == {
+        "hits": 2,
+        "misses": 7,
+        "hit_rate": 2 / 9,
+        "evictions": 3,
+        "entries": 2,
+        "bytes": 160 + 320,
+        "bytes_per_device": {"cpu": 160 + 320},
+    }
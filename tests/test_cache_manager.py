@@ -0,0 +1,80 @@
+import os
+import time
+from hashlib import sha224
+
+import pytest
+
+from hylfm.datasets.cache_manager import CacheLease, CacheManager, fcntl
+
+
+def add_entry(cache_dir, name, suffixes, n5_datasets=(), complete=True):
+    key = sha224(name.encode()).hexdigest()
+    for suffix in suffixes:
+        path = cache_dir / f"{name}_{key}{suffix}"
+        if suffix == ".n5":
+            path.mkdir()
+            if complete:
+                (path / "attributes.json").write_text('{"n5": "2.0.0"}')
+
+            for ds in n5_datasets:
+                (path / ds).mkdir()
+                (path / ds / "attributes.json").write_text("{}")
+        else:
+            path.write_text(name)
+
+        old = time.time() - 7200
+        os.utime(path, (old, old))
+
+    return key
+
+
+def test_check_and_gc(tmp_path):
+    cached = add_entry(tmp_path, "beads_lf", [".n5", ".txt", ".stat_v2.yml", ".stat_v2.sketch.npz"], ["lf"])
+    from_source = add_entry(tmp_path, "beads_ls", [".txt", ".stat_v2.yml", ".stat_v2.sketch.npz"])
+    partial = add_entry(tmp_path, "beads_ls_trf", [".n5", ".txt"], complete=False)
+    orphaned = add_entry(tmp_path, "beads_lr", [".stat_v2.yml"])
+
+    manager = CacheManager(tmp_path)
+    entries = manager.scan()
+    assert entries[cached].kind == "n5"
+    assert not entries[cached].problems
+    assert entries[from_source].kind == "stat"
+    assert not entries[from_source].problems
+    assert entries[partial].problems
+    assert entries[orphaned].problems
+
+    removed = manager.gc(keep_recent=3600, dry_run=True)
+    assert {e.key for e in removed} == {partial, orphaned}
+    assert len(manager.scan()) == 4
+
+    manager.gc(keep_recent=3600)
+    assert set(manager.scan()) == {cached, from_source}
+
+    manager.gc(budget=0, keep_recent=3600)
+    assert not manager.scan()
+
+
+@pytest.mark.skipif(fcntl is None, reason="leases need fcntl")
+def test_gc_skips_leased_entries(tmp_path):
+    key = add_entry(tmp_path, "beads_lf", [".n5", ".txt"], ["lf"])
+    orphaned = add_entry(tmp_path, "beads_lr", [".stat_v2.yml"])
+    n5_path = tmp_path / f"beads_lf_{key}.n5"
+    lease = CacheLease(n5_path)
+    assert lease.path.name == f"beads_lf_{key}.lease"
+    old = time.time() - 7200
+    os.utime(lease.path, (old, old))  # leased entries are kept regardless of their last access
+
+    manager = CacheManager(tmp_path)
+    assert not manager.scan()[key].problems
+    assert {e.key for e in manager.gc(budget=0, keep_recent=0)} == {orphaned}
+    assert n5_path.exists()
+
+    lease.release()
+    assert {e.key for e in manager.gc(budget=0, keep_recent=0)} == {key}
+    assert not manager.scan()
+
+    # a new lease on an evicted entry creates a new lease file
+    lease = CacheLease(n5_path)
+    assert lease.path.exists()
+    assert not manager.gc(budget=0, keep_recent=0)
+    lease.release()
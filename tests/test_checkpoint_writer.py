@@ -0,0 +1,87 @@
+import pytest
+import torch
+
+from hylfm.checkpoint import Checkpoint
+from hylfm.run.checkpoint_writer import CheckpointWriter
+
+
+class FakeCheckpoint:
+    """stands in for a Checkpoint (writing does not depend on its config)"""
+
+    training_run_id = "run_id"
+    training_run_name = "run_name"
+    save = Checkpoint.save
+
+    def __init__(self, root, iteration, fail=False):
+        self.root = root
+        self.iteration = iteration
+        self.fail = fail
+
+    @property
+    def path(self):
+        return self.root / f"val00000_ep0_it{self.iteration}.pth"
+
+    def as_dict(self, for_logging):
+        if self.fail:
+            raise OSError("disk full")
+
+        return {"iteration": self.iteration}
+
+    def snapshot(self):
+        return self
+
+
+def test_save_replaces_best_atomically(tmp_path):
+    first = FakeCheckpoint(tmp_path, 1)
+    assert first.save(best=True) == first.path
+    best_path = tmp_path / "best.pth"
+    assert torch.load(str(best_path)) == {"iteration": 1}
+
+    second = FakeCheckpoint(tmp_path, 2)
+    second.save(best=True)
+    assert torch.load(str(best_path)) == {"iteration": 2}
+
+    with pytest.raises(OSError):
+        FakeCheckpoint(tmp_path, 3, fail=True).save(best=True)
+
+    assert torch.load(str(best_path)) == {"iteration": 2}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["best.pth", first.path.name, second.path.name]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_writer_keeps_best_checkpoints(tmp_path, asynchronous):
+    writer = CheckpointWriter(keep_best=2, asynchronous=asynchronous)
+    for iteration, best, keep_anyway in [(1, True, False), (2, False, False), (3, True, True), (4, True, False)]:
+        writer.submit(FakeCheckpoint(tmp_path, iteration), best=best, keep_anyway=keep_anyway)
+
+    writer.flush()
+    assert not FakeCheckpoint(tmp_path, 1).path.exists()  # rotated out
+    assert all(FakeCheckpoint(tmp_path, i).path.exists() for i in (2, 3, 4))
+
+    for iteration in (5, 6):
+        writer.submit(FakeCheckpoint(tmp_path, iteration), best=True, keep_anyway=False)
+
+    writer.close()
+    assert FakeCheckpoint(tmp_path, 3).path.exists()  # kept anyway
+    assert not FakeCheckpoint(tmp_path, 4).path.exists()
+    assert all(FakeCheckpoint(tmp_path, i).path.exists() for i in (5, 6))
+    assert torch.load(str(tmp_path / "best.pth")) == {"iteration": 6}
+
+
+def test_writer_raises_errors_of_the_writer_thread(tmp_path):
+    writer = CheckpointWriter(keep_best=1, asynchronous=True)
+    writer.submit(FakeCheckpoint(tmp_path, 1), best=True, keep_anyway=False)
+    writer.submit(FakeCheckpoint(tmp_path, 2, fail=True), best=True, keep_anyway=False)
+    with pytest.raises(RuntimeError) as error:
+        writer.flush()
+
+    assert isinstance(error.value.__cause__, OSError)
+
+    # the previous best checkpoint survives
+    assert FakeCheckpoint(tmp_path, 1).path.exists()
+    assert torch.load(str(tmp_path / "best.pth")) == {"iteration": 1}
+
+    writer.submit(FakeCheckpoint(tmp_path, 3), best=True, keep_anyway=False)
+    writer.close()
+    assert not FakeCheckpoint(tmp_path, 1).path.exists()
+    assert torch.load(str(tmp_path / "best.pth")) == {"iteration": 3}
@@ -0,0 +1,259 @@
+import inspect
+import itertools
+import time
+
+import numpy
+import pytest
+import torch
+import torch.distributed
+import torch.multiprocessing
+import wandb
+from torch.utils.data import ConcatDataset, RandomSampler, SequentialSampler
+
+import hylfm.datasets.base
+from hylfm import settings
+from hylfm.checkpoint import Checkpoint, TrainRunConfig
+from hylfm.get_model import get_model
+from hylfm.hylfm_types import (
+    CriterionChoice,
+    DatasetChoice,
+    LRSchedThresMode,
+    MetricChoice,
+    OptimizerChoice,
+    PeriodUnit,
+    TransformsPipeline,
+)
+from hylfm.metrics import MSE, MetricGroup
+from hylfm.run.base import Run
+from hylfm.run.train_run import TrainRun
+from hylfm.sampler import NoCrossBatchSampler
+from hylfm.transforms import Cast, ComposedTransform
+from hylfm.utils.distributed import broadcast_object, main_process_first
+
+WORLD_SIZE = 2
+
+
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_no_cross_batch_sampler_shards_sections(drop_last: bool):
+    dataset = ConcatDataset([list(range(11)), list(range(7)), list(range(20))])
+    batch_sizes = [2, 3, 2]
+    sampler_class = RandomSampler if drop_last else SequentialSampler
+    per_rank = [
+        NoCrossBatchSampler(
+            dataset, sampler_class, batch_sizes, drop_last=drop_last, num_replicas=WORLD_SIZE, rank=rank, seed=0
+        )
+        for rank in range(WORLD_SIZE)
+    ]
+    batches = [list(sampler) for sampler in per_rank]
+    assert [len(b) for b in batches] == [len(s) for s in per_rank]
+    if drop_last:
+        assert len(batches[0]) == len(batches[1])
+
+    indices = [idx for rank_batches in batches for batch in rank_batches for idx in batch]
+    assert len(indices) == len(set(indices))
+    if not drop_last:
+        assert sorted(indices) == list(range(len(dataset)))
+
+    for rank_batches in batches:
+        for batch in rank_batches:
+            sections = numpy.searchsorted(dataset.cumulative_sizes, batch, side="right")
+            assert len(set(sections)) == 1
+
+
+def reduce_metric_group(rank: int, init_method: str, data: numpy.ndarray, results):
+    torch.distributed.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    group = MetricGroup(MSE(), MSE(along_dim=1))
+    for sample in data[rank::WORLD_SIZE]:
+        prediction = torch.from_numpy(sample[None])
+        group.update_with_batch(prediction=prediction, target=torch.zeros_like(prediction))
+
+    group.reduce_across_ranks()
+    results[rank] = group.compute()
+    torch.distributed.destroy_process_group()
+
+
+def test_metric_group_reduced_across_ranks(tmp_path):
+    data = numpy.random.default_rng(0).random((5, 1, 3, 4, 4)).astype(numpy.float32)
+    results = torch.multiprocessing.Manager().dict()
+    torch.multiprocessing.spawn(
+        reduce_metric_group,
+        args=(f"file://{tmp_path / 'init'}", data, results),
+        nprocs=WORLD_SIZE,
+    )
+
+    expected = MetricGroup(MSE(), MSE(along_dim=1))
+    for sample in data:
+        prediction = torch.from_numpy(sample[None])
+        expected.update_with_batch(prediction=prediction, target=torch.zeros_like(prediction))
+
+    expected = expected.compute()
+    for rank in range(WORLD_SIZE):
+        assert results[rank].keys() == expected.keys()
+        for key, value in expected.items():
+            numpy.testing.assert_allclose(results[rank][key], value, rtol=1e-6)
+
+
+def build_main_process_first(rank: int, init_method: str, path, results):
+    torch.distributed.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    with main_process_first():
+        if rank == 0:
+            time.sleep(0.5)
+            path.write_text("built by rank 0")
+        else:
+            results[rank] = path.read_text()
+
+    torch.distributed.destroy_process_group()
+
+
+def test_main_process_first(tmp_path):
+    results = torch.multiprocessing.Manager().dict()
+    torch.multiprocessing.spawn(
+        build_main_process_first,
+        args=(f"file://{tmp_path / 'init'}", tmp_path / "cache", results),
+        nprocs=WORLD_SIZE,
+    )
+    assert dict(results) == {rank: "built by rank 0" for rank in range(1, WORLD_SIZE)}
+
+
+LFC_SHAPE = (8, 8)
+N_SAMPLES = 16
+N_STEPS = 3
+
+
+class RandomLightFieldDataset(torch.utils.data.Dataset):
+    def __init__(self, n: int, lfc_shape, tgt_shape):
+        rng = numpy.random.default_rng(0)
+        self.lfc = rng.random((n, *lfc_shape), dtype=numpy.float32)
+        self.tgt = rng.random((n, *tgt_shape), dtype=numpy.float32)
+
+    def __len__(self):
+        return len(self.lfc)
+
+    def __getitem__(self, idx):
+        return {"lfc": self.lfc[idx], "ls_reg": self.tgt[idx], "sample_idx": numpy.array([idx])}
+
+
+def get_random_dataset(run: Run):
+    lfc_shape = (run.model.nnum ** 2, *LFC_SHAPE)
+    with torch.no_grad():
+        tgt_shape = run.model(torch.zeros(1, *lfc_shape)).shape[1:]
+
+    return hylfm.datasets.base.ConcatDataset([RandomLightFieldDataset(N_SAMPLES, lfc_shape, tgt_shape)])
+
+
+def get_random_dataset_transforms_pipeline(run: Run):
+    return TransformsPipeline(
+        sample_precache_trf=None,
+        sample_preprocessing=ComposedTransform(),
+        batch_preprocessing=ComposedTransform(),
+        batch_preprocessing_in_step=Cast(apply_to=["lfc", "ls_reg"], dtype="float32", non_blocking=True),
+        batch_postprocessing=ComposedTransform(),
+        batch_premetric_trf=ComposedTransform(),
+        meta={},
+        tgt_name="ls_reg",
+        spatial_dims=3,
+    )
+
+
+def get_tiny_train_run_config() -> TrainRunConfig:
+    model_kwargs = {
+        name: getattr(param.default, "default", param.default)  # unwrap typer options
+        for name, param in inspect.signature(get_model).parameters.items()
+    }
+    model_kwargs.update(
+        nnum=3, z_out=4, c00_2d=8, c01_2d=0, up0_2d=0, c10_2d=0, cin_3d=2, c00_3d=2, up0_3d=0, c10_3d=0, c11_3d=0
+    )
+    return TrainRunConfig(
+        batch_multiplier=1,
+        batch_size=2,
+        crit_apply_weight_above_threshold=False,
+        crit_beta=1.0,
+        crit_decay_weight_by=None,
+        crit_decay_weight_every_unit=PeriodUnit.epoch,
+        crit_decay_weight_every_value=1,
+        crit_decay_weight_limit=1.0,
+        crit_ms_ssim_weight=0.01,
+        crit_threshold=0.5,
+        crit_weight=0.001,
+        criterion=CriterionChoice.L1,
+        data_range=1.0,
+        dataset=DatasetChoice.beads_highc_a,  # replaced by random data
+        eval_batch_size=2,
+        interpolation_order=2,
+        lr_sched_factor=0.5,
+        lr_sched_patience=10,
+        lr_sched_thres=1e-4,
+        lr_sched_thres_mode=LRSchedThresMode.abs,
+        lr_scheduler=None,
+        max_epochs=1,
+        model=model_kwargs,
+        model_weights=None,
+        opt_lr=1e-2,
+        opt_momentum=0.0,
+        opt_weight_decay=0.0,
+        optimizer=OptimizerChoice.Adam,
+        patience=5,
+        save_output_to_disk={},
+        score_metric=MetricChoice.MS_SSIM,
+        seed=None,
+        validate_every_unit=PeriodUnit.epoch,
+        validate_every_value=1,  # i.e. not within the first `N_STEPS` iterations
+        win_sigma=1.5,
+        win_size=3,
+        point_cloud_threshold=1.0,
+        hylfm_version="0.0.0",
+    )
+
+
+def train_steps(rank: int, init_method: str, log_dir, results):
+    torch.distributed.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    settings.log_dir = log_dir
+    settings.num_workers_data_loader = {dp: 0 for dp in settings.num_workers_data_loader}
+    Run.get_dataset = get_random_dataset
+    Run.get_transforms_pipeline = get_random_dataset_transforms_pipeline
+
+    wandb_run = wandb.init(mode="disabled")
+    run_name, run_id = broadcast_object((wandb_run.name, wandb_run.id))
+    checkpoint = Checkpoint(config=get_tiny_train_run_config(), training_run_name=run_name, training_run_id=run_id)
+    train_run = TrainRun(wandb_run=wandb_run, checkpoint=checkpoint)
+    initial_params = [p.detach().numpy().copy() for p in train_run.model.parameters()]
+    seen = []
+    for batch in itertools.islice(train_run, N_STEPS):
+        seen += batch["sample_idx"].flatten().tolist()
+
+    train_run.validation_scheduler.close()
+    train_run.checkpoint_writer.close()
+    results[rank] = {
+        "initial_params": initial_params,
+        "params": [p.detach().numpy().copy() for p in train_run.model.parameters()],
+        "seen": seen,
+        "epoch_len": train_run.epoch_len,
+    }
+    torch.distributed.destroy_process_group()
+
+
+def test_train_run_steps_in_sync(tmp_path):
+    results = torch.multiprocessing.Manager().dict()
+    torch.multiprocessing.spawn(
+        train_steps,
+        args=(f"file://{tmp_path / 'init'}", tmp_path / "logs", results),
+        nprocs=WORLD_SIZE,
+    )
+
+    batch_size = get_tiny_train_run_config().batch_size
+    for rank in range(WORLD_SIZE):
+        assert results[rank]["epoch_len"] == N_SAMPLES // batch_size // WORLD_SIZE
+
+    seen = [results[rank]["seen"] for rank in range(WORLD_SIZE)]
+    assert all(len(s) == N_STEPS * batch_size for s in seen)
+    assert not set(seen[0]) & set(seen[1])  # each rank trains on its own shard
+
+    for rank in range(1, WORLD_SIZE):
+        # weights are broadcast from rank 0 and stay in sync with gradients averaged across ranks
+        for p0, p in zip(results[0]["initial_params"], results[rank]["initial_params"]):
+            numpy.testing.assert_array_equal(p, p0)
+
+        for p0, p in zip(results[0]["params"], results[rank]["params"]):
+            numpy.testing.assert_allclose(p, p0, rtol=1e-6, atol=1e-7)
+
+    assert any((p != p0).any() for p0, p in zip(results[0]["initial_params"], results[0]["params"]))
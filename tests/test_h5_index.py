@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from hylfm import settings
+from hylfm.datasets.h5_index import H5Index
+
+
+def test_concurrent_adds_and_saves(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "cache_dir", tmp_path)
+    files = []
+    for i in range(200):
+        path = tmp_path / f"{i:03}.h5"
+        path.write_bytes(b"")
+        files.append(path)
+
+    index = H5Index(tmp_path / "*.h5", "ls", autosave_every=1)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda p: index._add(p, [{"name": p.stem}]), files))
+
+    index.save()
+    assert [p.name for p in tmp_path.iterdir() if p.suffix == ".tmp"] == []
+    reloaded = H5Index(tmp_path / "*.h5", "ls")
+    assert [reloaded.resolve(p) for p in files] == [[{"name": p.stem}] for p in files]
@@ -0,0 +1,42 @@
+import numpy
+import pytest
+import torch
+
+from hylfm import metrics
+
+
+@pytest.mark.parametrize("along_dim", [None, 1])
+@pytest.mark.parametrize(
+    "get_metric",
+    [
+        lambda **kwargs: metrics.MSE(**kwargs),
+        lambda **kwargs: metrics.NRMSE(**kwargs),
+        lambda **kwargs: metrics.PSNR(data_range=1.0, **kwargs),
+        lambda **kwargs: metrics.SmoothL1(**kwargs),
+        lambda **kwargs: metrics.SSIM(
+            data_range=1.0,
+            size_average=True,
+            win_size=3,
+            win_sigma=1.5,
+            channel=1,
+            spatial_dims=2 if kwargs.get("along_dim") else 3,
+            **kwargs,
+        ),
+    ],
+)
+def test_batched_metric_equals_per_sample(get_metric, along_dim):
+    rng = numpy.random.default_rng(0)
+    prediction = torch.from_numpy(rng.random((3, 1, 5, 16, 16)).astype(numpy.float32))
+    target = torch.from_numpy(rng.random((3, 1, 5, 16, 16)).astype(numpy.float32))
+
+    batched = get_metric(along_dim=along_dim)
+    assert batched.batched
+    step_values = metrics.MetricGroup(batched).update_with_batch(prediction=prediction, target=target)
+
+    per_sample = get_metric(along_dim=along_dim)
+    expected_step_values = [
+        per_sample.update_with_sample(prediction=p, target=t)[per_sample.name] for p, t in zip(prediction, target)
+    ]
+
+    numpy.testing.assert_allclose(step_values[batched.name], expected_step_values, rtol=1e-5)
+    numpy.testing.assert_allclose(batched.compute()[batched.name], per_sample.compute()[per_sample.name], rtol=1e-5)
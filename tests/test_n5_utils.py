@@ -0,0 +1,46 @@
+import multiprocessing
+import pickle
+
+import pytest
+
+from hylfm.datasets.n5_utils import FillMarkers, fcntl
+
+
+def test_fill_markers(tmp_path):
+    markers = FillMarkers(tmp_path / "filled", 10)
+    assert not any(markers.is_set(idx) for idx in range(10))
+    markers.set(3)
+    markers.set(9)
+    assert [idx for idx in range(10) if markers.is_set(idx)] == [3, 9]
+
+    reopened = pickle.loads(pickle.dumps(markers))
+    assert reopened._fd is None
+    assert [idx for idx in range(10) if reopened.is_set(idx)] == [3, 9]
+
+    # a grown dataset keeps its markers
+    grown = FillMarkers(tmp_path / "filled", 20)
+    assert [idx for idx in range(20) if grown.is_set(idx)] == [3, 9]
+    for m in (markers, reopened, grown):
+        m.close()
+
+
+def try_lock(markers: FillMarkers, idx: int) -> bool:
+    try:
+        fcntl.lockf(markers.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, idx)
+    except OSError:
+        return False
+    else:
+        return True
+
+
+@pytest.mark.skipif(fcntl is None, reason="fill locks need fcntl")
+def test_fill_markers_lock_samples_across_processes(tmp_path):
+    markers = FillMarkers(tmp_path / "filled", 10)
+    with markers.lock(3), multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert not pool.apply(try_lock, (markers, 3))
+        assert pool.apply(try_lock, (markers, 4))
+
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        assert pool.apply(try_lock, (markers, 3))
+
+    markers.close()
@@ -0,0 +1,13 @@
+import numpy
+import pytest
+
+from hylfm.transforms.normalize import NormalizeMeanStdSample
+
+
+@pytest.mark.parametrize("percentiles", [(None, None), (5.0, None), (None, 99.0), (2.0, 99.8)])
+def test_normalize_mean_std_sample_batch_equals_samples(percentiles):
+    rng = numpy.random.default_rng(0)
+    batch = rng.gamma(2.0, 3.0, size=(4, 1, 5, 16, 16)).astype(numpy.float32)
+    trf = NormalizeMeanStdSample(percentile_min=percentiles[0], percentile_max=percentiles[1], apply_to="ls")
+    expected = numpy.stack([trf.apply_to_sample(sample) for sample in batch])
+    numpy.testing.assert_allclose(trf.apply_to_batch(batch), expected, rtol=1e-5, atol=1e-5)
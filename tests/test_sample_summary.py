@@ -0,0 +1,105 @@
+import numpy
+import pytest
+
+from hylfm import settings
+from hylfm.datasets.filter_engine import evaluate_filters, evaluate_filters_on_summary
+from hylfm.datasets.sample_summary import SUMMARY_PERCENTILES, SampleSummary
+
+
+class SourceDataset:
+    tensor_name = "ls_trf"
+
+    def __init__(self, tensors):
+        self.tensors = tensors
+
+    def __len__(self):
+        return len(self.tensors)
+
+    def get_z_slice(self, idx):
+        return idx % 5
+
+
+class CachedDataset:
+    """stands in for N5CachedDatasetFromInfo"""
+
+    repeat = 2
+
+    def __init__(self, tensors, summary_path):
+        self.dataset = SourceDataset(tensors)
+        self.summary_path = summary_path
+        self.loaded = 0
+
+    def __len__(self):
+        return len(self.dataset) * self.repeat
+
+    def __getitem__(self, idx):
+        self.loaded += 1
+        return {self.dataset.tensor_name: self.dataset.tensors[idx // self.repeat]}
+
+    @property
+    def summary(self):
+        return SampleSummary(self.summary_path, dataset=self)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = numpy.random.default_rng(0)
+    tensors = [rng.gamma(2.0, scale, size=(1, 3, 8, 8)).astype(numpy.float32) for scale in rng.uniform(1, 10, 150)]
+    return CachedDataset(tensors, tmp_path / "ls_trf.summary.npz")
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_summary_table(dataset, max_workers, monkeypatch):
+    monkeypatch.setattr(settings, "max_workers_for_filters", max_workers)
+    summary = dataset.summary
+    assert not summary["computed"].any()
+    summary.compute()
+    assert summary["computed"].all()
+    for key in ["percentiles", "min", "max", "mean"]:
+        summary.data[key][100:] = numpy.nan
+
+    summary.data["computed"][100:] = False  # resume a partial table
+    summary.compute()
+    assert summary["computed"].all()
+
+    tensors = dataset.dataset.tensors
+    expected_percentiles = [numpy.percentile(t, SUMMARY_PERCENTILES) for t in tensors]
+    numpy.testing.assert_allclose(summary["percentiles"], expected_percentiles)
+    numpy.testing.assert_allclose(summary["min"], [t.min() for t in tensors])
+    numpy.testing.assert_allclose(summary["max"], [t.max() for t in tensors])
+    numpy.testing.assert_allclose(summary["mean"], [t.mean(dtype=numpy.float64) for t in tensors])
+    numpy.testing.assert_array_equal(summary["z_slice"], numpy.arange(len(tensors)) % 5)
+
+    dataset.loaded = 0
+    assert dataset.summary["computed"].all()
+    assert dataset.loaded == 0  # reloaded from disk
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        [("instensity_range", {"apply_to": "ls_trf", "min_below": 0.5, "max_above": 40.0})],
+        [("signal2noise", {"apply_to": "ls_trf", "signal_percentile": 99.9, "noise_percentile": 5.0, "ratio": 21.0})],
+        [
+            ("z_range", {"z_min": 1, "z_max": 4}),
+            ("signal2noise", {"apply_to": "ls_trf", "signal_percentile": 99, "noise_percentile": 10, "ratio": 12.0}),
+        ],
+    ],
+)
+def test_filters_on_summary_equal_per_sample(dataset, filters):
+    indices = numpy.arange(len(dataset))
+    expected = [evaluate_filters(dataset, int(idx), filters) for idx in indices]
+    assert 0 < sum(expected) < len(expected)
+    numpy.testing.assert_array_equal(evaluate_filters_on_summary(dataset, indices, filters), expected)
+
+
+def test_filters_on_summary_of_subset_summarize_subset_only(dataset):
+    filters = [("instensity_range", {"apply_to": "ls_trf", "min_below": 0.5, "max_above": 40.0})]
+    indices = numpy.arange(20, 30)
+    expected = [evaluate_filters(dataset, int(idx), filters) for idx in indices]
+    dataset.loaded = 0
+    numpy.testing.assert_array_equal(evaluate_filters_on_summary(dataset, indices, filters), expected)
+    assert dataset.loaded == len(numpy.unique(indices // dataset.repeat))
+    numpy.testing.assert_array_equal(
+        numpy.flatnonzero(dataset.summary["computed"]), numpy.unique(indices // dataset.repeat)
+    )
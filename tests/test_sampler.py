@@ -0,0 +1,81 @@
+import bisect
+import pickle
+
+import pytest
+from torch.utils.data import ConcatDataset, RandomSampler, SequentialSampler
+
+from hylfm import settings
+from hylfm.sampler import BlockShuffleSampler, NoCrossBatchSampler
+
+
+@pytest.mark.parametrize("sampler_class", [RandomSampler, BlockShuffleSampler, SequentialSampler])
+def test_no_cross_batch_sampler_resumes_epoch(sampler_class, monkeypatch):
+    monkeypatch.setattr(settings, "sampler_block_size", 4)
+    dataset = ConcatDataset([list(range(11)), list(range(7)), list(range(20))])
+
+    def get_sampler():
+        return NoCrossBatchSampler(dataset, sampler_class, [2, 3, 2], drop_last=True, seed=0)
+
+    sampler = get_sampler()
+    epoch0 = list(sampler)
+    state = sampler.state_dict(position=5)
+    epoch1 = list(sampler)
+
+    resumed = get_sampler()
+    resumed.load_state_dict(state)
+    assert list(resumed) == epoch0[5:]
+    assert list(resumed) == epoch1  # the following epoch is unaffected
+
+    resumed_after_epoch = get_sampler()
+    resumed_after_epoch.load_state_dict(dict(state, position=len(sampler)))
+    assert list(resumed_after_epoch) == epoch1
+
+
+def test_no_cross_batch_sampler_annotates_upcoming_batches(monkeypatch):
+    monkeypatch.setattr(settings, "cache_prefetch_lookahead", 5)
+    dataset = ConcatDataset([list(range(11)), list(range(7)), list(range(20))])
+    batches = list(NoCrossBatchSampler(dataset, SequentialSampler, [2, 3, 2], drop_last=False, seed=0))
+    for i, batch in enumerate(batches):
+        upcoming = batches[i + 1 : i + 1 + len(batch.upcoming)]
+        assert batch.upcoming == upcoming
+        n_upcoming = sum(map(len, upcoming))
+        assert n_upcoming >= 5 or i + 1 + len(upcoming) == len(batches)
+        assert n_upcoming - len(upcoming[-1]) < 5 if upcoming else True
+
+    # DataLoader workers receive the annotation
+    assert pickle.loads(pickle.dumps(batches[0])).upcoming == batches[0].upcoming
+
+
+def test_block_shuffle_sampler_draws_blocks_within_sections():
+    dataset = ConcatDataset([list(range(11)), list(range(7)), list(range(20))])
+    sampler = BlockShuffleSampler(dataset, block_size=4, shuffle_buffer=0, seed=0)
+    blocks = sampler.get_blocks()
+    assert all(len(block) <= 4 for block in blocks)
+    for block in blocks:
+        assert bisect.bisect_right(dataset.cumulative_sizes, block[0]) == bisect.bisect_right(
+            dataset.cumulative_sizes, block[-1]
+        )
+
+    epoch0 = list(sampler)
+    assert sorted(epoch0) == list(range(len(dataset)))
+    position = 0
+    while position < len(epoch0):  # without shuffle buffer each block is drawn at once
+        block = next(b for b in blocks if epoch0[position] in b)
+        assert sorted(epoch0[position : position + len(block)]) == list(block)
+        position += len(block)
+
+    epoch1 = list(sampler)
+    assert epoch1 != epoch0
+
+    same_seed = BlockShuffleSampler(dataset, block_size=4, shuffle_buffer=0, seed=0)
+    assert list(same_seed) == epoch0
+    same_seed.set_epoch(1)
+    assert list(same_seed) == epoch1
+
+
+def test_block_shuffle_sampler_shuffle_buffer():
+    dataset = ConcatDataset([list(range(11)), list(range(7)), list(range(20))])
+    get_sampler = lambda: BlockShuffleSampler(dataset, block_size=4, shuffle_buffer=6, seed=1)
+    epoch0 = list(get_sampler())
+    assert sorted(epoch0) == list(range(len(dataset)))
+    assert list(get_sampler()) == epoch0
@@ -0,0 +1,60 @@
+import numpy
+
+from hylfm import settings
+from hylfm.stat_ import DatasetStat, DDSketch, IntegerHistogram, RunningMoments
+
+
+def test_integer_histogram_is_exact_and_mergeable():
+    rng = numpy.random.default_rng(0)
+    data = rng.integers(0, 5000, size=(4, 10, 32)).astype(numpy.uint16)
+    merged = IntegerHistogram(data.dtype)
+    for part in data:
+        partial = IntegerHistogram(data.dtype)
+        partial.update(part)
+        merged.merge(partial)
+
+    percentiles = numpy.array([0, 5, 50, 95, 100])
+    ranks = numpy.clip(numpy.ceil(percentiles * data.size / 100).astype(int) - 1, 0, data.size - 1)
+    expected = numpy.sort(data.ravel())[ranks]
+    assert merged.get_percentiles(percentiles) == expected.tolist()
+    lower, upper = expected[1], expected[3]
+    clipped = numpy.clip(data.astype(numpy.float64), lower, upper)
+    numpy.testing.assert_allclose(merged.get_clipped_mean_std(lower, upper), (clipped.mean(), clipped.std()))
+
+
+def test_ddsketch_relative_accuracy():
+    rng = numpy.random.default_rng(0)
+    data = rng.lognormal(size=(4, 1000)).astype(numpy.float32) - 0.5
+    sketch = DDSketch(relative_accuracy=0.01)
+    moments = RunningMoments()
+    for part in data:
+        sketch.update(part)
+        moments.update(part)
+
+    numpy.testing.assert_allclose(sketch.get_percentiles([1, 50, 99]), numpy.percentile(data, [1, 50, 99]), rtol=0.03)
+    numpy.testing.assert_allclose((moments.mean, moments.std), (data.mean(), data.std()), rtol=1e-5)
+
+
+def test_dataset_stat_is_stored_per_sketch_setting(tmp_path, monkeypatch):
+    rng = numpy.random.default_rng(0)
+    dataset = [{"x": rng.lognormal(size=(1, 100)).astype(numpy.float32)} for _ in range(4)]
+    monkeypatch.setattr(settings, "max_workers_for_hist", 0)
+    monkeypatch.setattr(settings, "float_stat_sketch", "ddsketch")
+    ddsketch_stat = DatasetStat(tmp_path / "x.stat_v2.yml", dataset)
+    ddsketch_stat.get_percentile("x", 50)
+    assert ddsketch_stat.sketches["x"].kind == "ddsketch"
+
+    monkeypatch.setattr(settings, "float_stat_sketch", "linear")
+    monkeypatch.setattr(settings, "float_stat_bins", 64)
+    linear_stat = DatasetStat(tmp_path / "x.stat_v2.yml", dataset)
+    assert linear_stat.sketches["x"].kind == "adaptive_hist"
+    assert not linear_stat.computed  # percentiles of the ddsketch are not reused
+
+    monkeypatch.setattr(settings, "float_stat_bins", 128)
+    assert DatasetStat(tmp_path / "x.stat_v2.yml", dataset).sketches["x"].nbins == 128
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "x.stat_v2.ddsketch.sketch.npz",
+        "x.stat_v2.ddsketch.yml",
+        "x.stat_v2.linear128.sketch.npz",
+        "x.stat_v2.linear64.sketch.npz",
+    ]
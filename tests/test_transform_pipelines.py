@@ -0,0 +1,34 @@
+import numpy
+import pytest
+import torch
+
+from hylfm import settings
+from hylfm.datasets.named import DatasetPart
+from hylfm.hylfm_types import DatasetChoice
+from hylfm.transform_pipelines import DEVICE_AUGMENTATIONS, get_transforms_pipeline
+from hylfm.transforms import Cast, ComposedTransform
+from hylfm.utils.distributed import get_device
+
+
+@pytest.mark.parametrize(
+    "dataset_name", [DatasetChoice.beads_highc_b, DatasetChoice.heart_static_sample0, DatasetChoice.heart_dyn_refine]
+)
+def test_augmentations_run_on_device(dataset_name, monkeypatch):
+    monkeypatch.setattr(settings, "augment_on_device", True)
+    pipeline = get_transforms_pipeline(dataset_name, DatasetPart.train, nnum=19, z_out=49, scale=4, shrink=8)
+    assert not any(isinstance(t, DEVICE_AUGMENTATIONS) for t in pipeline.sample_preprocessing.transforms)
+
+    cast, *device_stage = pipeline.batch_preprocessing_in_step.transforms
+    assert isinstance(cast, Cast)
+    assert cast.device is None  # this process' device
+    augmentations = [t for t in device_stage if isinstance(t, DEVICE_AUGMENTATIONS)]
+    augmented = {k for t in augmentations for k in t.input_mapping}
+    assert augmented
+    assert augmented <= set(cast.input_mapping)
+
+    rng = numpy.random.default_rng(0)
+    batch = {k: rng.random((2, 1, 4, 16, 16), dtype=numpy.float32) for k in cast.input_mapping}
+    batch = ComposedTransform(cast, *augmentations)(batch)
+    for key in augmented:
+        assert isinstance(batch[key], torch.Tensor)
+        assert batch[key].device == get_device()
@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+import torch
+
+from hylfm.run.validation_scheduler import ValidationScheduler
+
+
+class FakeLogger:
+    def __init__(self):
+        self.deferred = False
+        self.pending = []
+        self.logged = []  # (logged at step, validated step, logging thread)
+
+    def log_summary(self, step):
+        if self.deferred:
+            self.pending.append(step)
+        else:
+            self.logged.append((step, step, threading.current_thread()))
+
+    def flush(self, step):
+        self.logged += [(step, val_step, threading.current_thread()) for val_step in self.pending]
+        self.pending.clear()
+
+
+class FakeValidator:
+    """stands in for a ValidationRun, scores the model's weight"""
+
+    def __init__(self, model):
+        self.model = model
+        self.run_logger = FakeLogger()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+    def prefetch(self):
+        pass
+
+    def get_validation_score(self, step):
+        self.proceed.wait()
+        self.run_logger.log_summary(step)
+        return self.model.weight.item()
+
+
+def set_weight(model, value):
+    with torch.no_grad():
+        model.weight.fill_(value)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_validation_results_in_order(asynchronous):
+    model = torch.nn.Linear(1, 1, bias=False)
+    validator = FakeValidator(model)
+    scheduler = ValidationScheduler(validator, model, asynchronous=asynchronous)
+    for validation_iteration in range(1, 4):
+        set_weight(model, validation_iteration)
+        scheduler.submit(step=10 * validation_iteration, validation_iteration=validation_iteration)
+        set_weight(model, -1)  # training continues
+
+    results = scheduler.poll(step=35, wait=True)
+    scheduler.close()
+    assert [r.validation_iteration for r in results] == [1, 2, 3]
+    assert [r.score for r in results] == [1.0, 2.0, 3.0]  # the weights at submit were validated
+    main_thread = threading.current_thread()
+    if asynchronous:
+        assert validator.run_logger.logged == [(35, 10, main_thread), (35, 20, main_thread), (35, 30, main_thread)]
+    else:
+        assert validator.run_logger.logged == [(10, 10, main_thread), (20, 20, main_thread), (30, 30, main_thread)]
+
+
+def test_asynchronous_validation_overlaps_training():
+    model = torch.nn.Linear(1, 1, bias=False)
+    validator = FakeValidator(model)
+    scheduler = ValidationScheduler(validator, model, asynchronous=True)
+    validator.proceed.clear()
+    set_weight(model, 2)
+    scheduler.submit(step=10, validation_iteration=1)
+    assert scheduler.poll(step=11) == []
+    assert validator.run_logger.logged == []
+
+    validator.proceed.set()
+    [result] = scheduler.poll(step=12, wait=True)
+    assert result.score == 2.0
+    assert [logged[:2] for logged in validator.run_logger.logged] == [(12, 10)]
+    scheduler.close()